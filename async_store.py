@@ -0,0 +1,47 @@
+# async_store.py
+"""Coroutine versions of the store reads used by the async views.
+
+Views that need several independent reads (the dashboard's folders and
+records, the record and folder lookups of a record scan) await them together
+with asyncio.gather instead of paying for each round trip in turn.
+
+Each read runs the sync Store method on one thread pool shared by the whole
+process. Flask runs every async view in a new event loop, so anything bound
+to a loop (a Firestore AsyncClient and its gRPC channel, or the loop's
+default executor) would be rebuilt on every request; the sync client's
+single channel and this pool are reused instead.
+"""
+import asyncio
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
+
+class AsyncStore:
+    def __init__(self, store, max_workers=16):
+        self.store = store
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="async-store")
+
+    async def _in_thread(self, method, *args):
+        # copy the context like asyncio.to_thread, so the call still sees the request
+        call = contextvars.copy_context().run
+        return await asyncio.get_running_loop().run_in_executor(
+            self._executor, call, getattr(self.store, method), *args)
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+
+    # ---- records ----
+    async def find_record(self, uid, title):
+        return await self._in_thread("find_record", uid, title)
+
+    async def list_records(self, uid):
+        return await self._in_thread("list_records", uid)
+
+    # ---- folders ----
+    async def get_folder(self, uid, folder_id):
+        if not folder_id:
+            return None
+        return await self._in_thread("get_folder", uid, folder_id)
+
+    async def list_folders(self, uid):
+        return await self._in_thread("list_folders", uid)
@@ -0,0 +1,139 @@
+# auth.py
+"""Firebase sign-in and session verification.
+
+Logging in used to cost a username lookup, then a password sign-in on a new
+TCP/TLS connection, and afterwards the user was trusted on the strength of a
+flag in the session. Now:
+
+- username -> email lookups are cached for `username_ttl` seconds (only
+  hits, so a freshly signed-up user is found at once);
+- Identity Toolkit calls share one keep-alive httpx.Client;
+- a successful sign-in is exchanged once for a Firebase session cookie
+  (valid `session_days`), which is kept in the server-side session and
+  checked on every request by verify_session_cookie. A verified cookie is
+  remembered until it expires or `verified_ttl` passes, so most
+  authenticated requests make no network call. Past that the cookie is
+  verified again: the Admin SDK checks the signature locally against
+  Google's cached public keys, and then fetches the user to see whether
+  the session was revoked or the account disabled or deleted. A revoked
+  session therefore ends within `verified_ttl` seconds.
+
+Without a service account no cookie can be minted; sign-in still works and
+the session falls back to the plain flag.
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
+
+SIGN_IN_URL = "https://identitytoolkit.googleapis.com/v1/accounts:signInWithPassword"
+
+
+class AuthError(Exception):
+    """Sign-in rejected; str() is a message that can be shown to the user."""
+
+
+class _TTLCache:
+    def __init__(self, ttl, max_entries=10000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key, value, ttl=None):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+class FirebaseAuth:
+    def __init__(self, firebase, api_key, store, session_days=5, username_ttl=300, verified_ttl=300):
+        self.firebase = firebase
+        self.api_key = api_key
+        self.store = store
+        self.session_days = session_days
+        self.verified_ttl = verified_ttl
+        self._emails = _TTLCache(username_ttl)
+        self._verified = _TTLCache(verified_ttl)
+        self._lock = threading.Lock()
+        self._client = None
+
+    @property
+    def http(self):
+        """The shared keep-alive client for Identity Toolkit calls (httpx is imported on first use)."""
+        if self._client is None:
+            import httpx
+            with self._lock:
+                if self._client is None:
+                    self._client = httpx.Client(timeout=10, limits=httpx.Limits(max_keepalive_connections=10))
+        return self._client
+
+    def close(self):
+        with self._lock:
+            if self._client is not None:
+                self._client.close()
+                self._client = None
+
+    # ---- sign-in ----
+    def email_for_username(self, username):
+        """The email registered for a username, or None."""
+        key = username.lower()
+        email = self._emails.get(key)
+        if email is None:
+            profile = self.store.get_profile_by_username(username)
+            email = (profile or {}).get("email")
+            if email:
+                self._emails.put(key, email)
+        return email
+
+    def sign_in(self, email, password):
+        """Check email/password with Firebase Auth; returns the REST response (localId, idToken, ...)."""
+        resp = self.http.post(SIGN_IN_URL, params={"key": self.api_key},
+                              json={"email": email, "password": password, "returnSecureToken": True})
+        if resp.status_code != 200:
+            raise AuthError(resp.json().get("error", {}).get("message", "Login failed."))
+        return resp.json()
+
+    # ---- session cookies ----
+    def mint_session_cookie(self, id_token):
+        """Exchange an ID token for a session cookie, or None without a service account."""
+        if not self.firebase.configured:
+            return None
+        return self.firebase.auth.create_session_cookie(id_token, expires_in=timedelta(days=self.session_days))
+
+    def verify_session_cookie(self, cookie):
+        """The uid the cookie was minted for, or None if it is invalid, expired or revoked.
+
+        Revocation is checked when the cookie is not cached as verified.
+        Other errors (e.g. the public keys or the user could not be fetched)
+        are raised.
+        """
+        key = hashlib.blake2b(cookie.encode(), digest_size=16).digest()
+        cached = self._verified.get(key)
+        if cached is not None:
+            uid, expires_at = cached
+            return uid if expires_at > time.time() else None
+        auth = self.firebase.auth
+        try:
+            claims = auth.verify_session_cookie(cookie, check_revoked=True)
+        except (auth.InvalidSessionCookieError, auth.UserDisabledError, auth.UserNotFoundError) as e:
+            # RevokedSessionCookieError is an InvalidSessionCookieError
+            print(f"Warning: session cookie rejected: {e}")
+            return None
+        uid, expires_at = claims["uid"], claims["exp"]
+        self._verified.put(key, (uid, expires_at), ttl=min(self.verified_ttl, expires_at - time.time()))
+        return uid
@@ -0,0 +1,103 @@
+# benchmarks/bench_decode.py
+"""Per-image decode time: full-frame pyzbar vs the strategy ladder.
+
+Compares the original single full-frame pass with decoder.decode_image_bytes,
+with and without the candidate-region stage, and reports p50/max time per
+image and how many codes each found.
+
+    python benchmarks/bench_decode.py                    # synthetic 12MP shelf photos
+    python benchmarks/bench_decode.py photo1.jpg ...     # your own images
+    python benchmarks/bench_decode.py -n 5 --codes 6 --size 4000x3000
+
+Synthetic images are a cluttered background with --codes small QR codes
+pasted at random positions, encoded as JPEG like a phone upload.
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import decoder  # noqa: E402
+
+
+def synthetic_image(rng, width, height, n_codes):
+    import cv2
+    import numpy as np
+    from qr_cache import render_qr_png
+
+    image = np.full((height, width, 3), 235, np.uint8)
+    # shelf clutter: boxes and label-like stripes
+    for _ in range(120):
+        x, y = rng.randrange(width), rng.randrange(height)
+        w, h = rng.randrange(80, 600), rng.randrange(80, 400)
+        color = tuple(rng.randrange(40, 220) for _ in range(3))
+        cv2.rectangle(image, (x, y), (x + w, y + h), color, -1)
+        for i in range(rng.randrange(0, 6)):
+            cv2.line(image, (x + 10, y + 20 + i * 14), (x + w - 10, y + 20 + i * 14), (30, 30, 30), 2)
+    payloads = []
+    for i in range(n_codes):
+        payload = f"SKU-{rng.randrange(10 ** 8):08d}-{i}"
+        png = render_qr_png(payload, {"box_size": 4, "border": 4})
+        qr = cv2.imdecode(np.frombuffer(png, np.uint8), cv2.IMREAD_COLOR)
+        qh, qw = qr.shape[:2]
+        x, y = rng.randrange(0, width - qw), rng.randrange(0, height - qh)
+        image[y:y + qh, x:x + qw] = qr
+        payloads.append(payload)
+    ok, buf = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, 90])
+    return buf.tobytes(), payloads
+
+
+def full_frame(data):
+    """What upload() did before the ladder: one pyzbar pass on the BGR image."""
+    import cv2
+    import numpy as np
+    image = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+    return [d for _, d in decoder._zbar(image)]
+
+
+MODES = {
+    "full frame": full_frame,
+    "ladder": lambda data: [c["data"] for c in decoder.decode_image_bytes(
+        data, strategies=tuple(s for s in decoder.STRATEGIES if s != "regions"))["codes"]],
+    "ladder + regions": lambda data: [c["data"] for c in decoder.decode_image_bytes(data)["codes"]],
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("images", nargs="*", help="image files (default: synthetic)")
+    parser.add_argument("-n", "--count", type=int, default=3, help="synthetic images")
+    parser.add_argument("--codes", type=int, default=4, help="codes per synthetic image")
+    parser.add_argument("--size", default="4000x3000", help="synthetic image size WxH")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    if args.images:
+        images = [(open(path, "rb").read(), None) for path in args.images]
+    else:
+        rng = random.Random(args.seed)
+        width, height = map(int, args.size.split("x"))
+        images = [synthetic_image(rng, width, height, args.codes) for _ in range(args.count)]
+
+    print(f"{'mode':<18}{'p50 ms':>10}{'max ms':>10}{'codes found':>14}")
+    for name, fn in MODES.items():
+        times, found, expected = [], 0, 0
+        for data, payloads in images:
+            start = time.perf_counter()
+            codes = fn(data)
+            times.append((time.perf_counter() - start) * 1000)
+            if payloads is None:
+                found += len(codes)
+            else:
+                found += len(set(codes) & set(payloads))
+                expected += len(payloads)
+        total = f"{found}/{expected}" if expected else str(found)
+        print(f"{name:<18}{statistics.median(times):>10.1f}{max(times):>10.1f}{total:>14}")
+
+
+if __name__ == "__main__":
+    main()
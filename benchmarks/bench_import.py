@@ -0,0 +1,78 @@
+# benchmarks/bench_import.py
+"""Measure cold start: importing main, create_app() and the first request.
+
+Each run is a fresh interpreter, as on a newly scheduled container. --eager
+imports the heavy modules up front first, which is what the module used to do
+at load time, so the two modes show what the lazy imports save.
+
+    python benchmarks/bench_import.py            # lazy (current code)
+    python benchmarks/bench_import.py --eager    # heavy modules preloaded
+    python benchmarks/bench_import.py --compare  # both, side by side
+
+Runs against the in-memory store so no credentials are needed.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+HEAVY = ["cv2", "pyzbar.pyzbar", "qrcode", "xlsxwriter", "httpx", "firebase_admin.firestore"]
+
+PROBE = """
+import importlib, json, sys, time
+t0 = time.perf_counter()
+for name in {eager!r}:
+    try:
+        importlib.import_module(name)
+    except Exception:
+        pass
+import main
+t1 = time.perf_counter()
+app = main.create_app()
+client = app.test_client()
+status = client.get("/").status_code
+t2 = time.perf_counter()
+print(json.dumps({{"import_ms": (t1 - t0) * 1000, "first_request_ms": (t2 - t1) * 1000, "status": status,
+                  "loaded": [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+
+def run_once(eager):
+    env = dict(os.environ, STORAGE_BACKEND="memory", WRITE_BEHIND="0")
+    code = PROBE.format(eager=HEAVY if eager else [], heavy=HEAVY)
+    out = subprocess.run([sys.executable, "-c", code], cwd=ROOT, env=env,
+                         capture_output=True, text=True, check=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def measure(eager, n):
+    runs = [run_once(eager) for _ in range(n)]
+    return {
+        "import_ms": statistics.median(r["import_ms"] for r in runs),
+        "first_request_ms": statistics.median(r["first_request_ms"] for r in runs),
+        "loaded": runs[-1]["loaded"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-n", "--runs", type=int, default=5, help="fresh interpreters per mode")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--eager", action="store_true", help="preload the heavy modules")
+    mode.add_argument("--compare", action="store_true", help="run lazy and eager")
+    args = parser.parse_args()
+
+    modes = [False, True] if args.compare else [args.eager]
+    print(f"{'mode':<8}{'import main ms':>16}{'create_app + GET / ms':>24}  heavy modules loaded")
+    for eager in modes:
+        r = measure(eager, args.runs)
+        loaded = ", ".join(r["loaded"]) or "-"
+        print(f"{'eager' if eager else 'lazy':<8}{r['import_ms']:>16.1f}{r['first_request_ms']:>24.1f}  {loaded}")
+
+
+if __name__ == "__main__":
+    main()
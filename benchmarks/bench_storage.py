@@ -0,0 +1,94 @@
+# benchmarks/bench_storage.py
+"""Compare storage backend latency side by side.
+
+Runs the same per-scan workload (the calls the scan routes make) against each
+backend and prints p50/p95 latency per operation.
+
+    python benchmarks/bench_storage.py                 # memory + sqlite
+    python benchmarks/bench_storage.py -b firestore -n 50
+
+Firestore needs SERVICE_ACCOUNT pointing at a service account key; the
+benchmark writes under a throwaway users/bench-<id> document and deletes its
+scans and records afterwards.
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from storage import FirestoreStore, SQLiteStore  # noqa: E402
+
+
+def make_store(backend):
+    if backend == "memory":
+        return SQLiteStore(":memory:")
+    if backend == "sqlite":
+        return SQLiteStore(os.path.join(tempfile.mkdtemp(), "bench.db"))
+    if backend == "firestore":
+        import firebase_admin
+        from firebase_admin import credentials, firestore
+        key = os.getenv("SERVICE_ACCOUNT", "qrpenguincloud-firebase-adminsdk.json")
+        if not firebase_admin._apps:
+            firebase_admin.initialize_app(credentials.Certificate(key))
+        return FirestoreStore(firestore.client())
+    raise ValueError(backend)
+
+
+def timed(samples, name, fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    samples.setdefault(name, []).append((time.perf_counter() - start) * 1000)
+    return result
+
+
+def run(store, n):
+    uid = f"bench-{uuid.uuid4().hex[:8]}"
+    samples = {}
+    record_id = timed(samples, "add_record", store.add_record, uid, {"title": "bench", "folder_id": None})
+    for i in range(n):
+        data = f"bench-code-{i}"
+        timed(samples, "scan_exists", store.scan_exists, uid, data)
+        timed(samples, "add_scan", store.add_scan, uid, {"data": data, "type": "QRCODE", "firebase_uid": uid})
+        timed(samples, "increment_count", store.increment_count, uid, "QRCODE")
+        timed(samples, "get_counts", store.get_counts, uid)
+        timed(samples, "find_record", store.find_record, uid, "bench")
+        timed(samples, "record_scan_exists", store.record_scan_exists, uid, record_id, data)
+        timed(samples, "save_record_scan", store.save_record_scan, uid, record_id,
+              {"record_id": record_id, "data": data, "type": "QRCODE"}, {})
+    timed(samples, "iter_scans", lambda: list(store.iter_scans(uid)))
+    timed(samples, "count_record_scans", store.count_record_scans, uid, record_id)
+    store.clear_scans(uid)
+    store.delete_record(uid, record_id)
+    store.reset_counts(uid)
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-b", "--backends", default="memory,sqlite", help="comma separated: memory,sqlite,firestore")
+    parser.add_argument("-n", "--scans", type=int, default=200, help="scans per backend")
+    args = parser.parse_args()
+
+    results = {}
+    for backend in args.backends.split(","):
+        results[backend] = run(make_store(backend), args.scans)
+
+    backends = list(results)
+    print(f"{'operation':<20}" + "".join(f"{b + ' p50/p95 ms':>26}" for b in backends))
+    for op in results[backends[0]]:
+        row = f"{op:<20}"
+        for b in backends:
+            vals = sorted(results[b][op])
+            p50 = statistics.median(vals)
+            p95 = vals[min(len(vals) - 1, int(len(vals) * 0.95))]
+            row += f"{p50:>17.3f} / {p95:>6.3f}"
+        print(row)
+
+
+if __name__ == "__main__":
+    main()
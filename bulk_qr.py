@@ -0,0 +1,212 @@
+# bulk_qr.py
+"""Bulk QR generation: parse a list of payloads, render them across a process
+pool and stream the results back as a ZIP while rendering is still going on.
+
+Rows come from a JSON body or a CSV upload and are either plain text or
+structured label/value pairs, which are encoded the same way as /generate's
+form_mode (indented JSON).
+"""
+import atexit
+import csv
+import json
+import multiprocessing
+import os
+import re
+import threading
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from io import StringIO
+
+from qr_cache import DEFAULT_OPTIONS, render_qr_png, render_qr_svg
+
+# Size of the render pool; 0 or 1 renders in the request thread.
+RENDER_WORKERS = int(os.getenv("QR_RENDER_WORKERS", str(min(4, os.cpu_count() or 1))))
+FORMATS = ("png", "svg")
+TEXT_COLUMNS = ("text", "data")
+NAME_COLUMNS = ("name", "filename")
+LOG_BATCH = 500  # qr_generations docs per batched write (Firestore's batch limit)
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+class BulkRequestError(ValueError):
+    """The bulk request body could not be turned into rows."""
+
+
+def _structured(fields):
+    return json.dumps(fields, indent=2)
+
+
+def _row_from_json(item):
+    """Normalize one JSON item to (name, payload, data_type)."""
+    if isinstance(item, str):
+        return None, item, "text"
+    if not isinstance(item, dict):
+        raise BulkRequestError(f"Unsupported item: {item!r}")
+    name = item.get("name") or item.get("filename")
+    for col in TEXT_COLUMNS:
+        if item.get(col):
+            return name, str(item[col]), "text"
+    labels = item.get("label[]", item.get("labels"))
+    values = item.get("value[]", item.get("values"))
+    if labels is not None and values is not None:
+        return name, _structured(dict(zip(labels, values))), "structured"
+    if isinstance(item.get("fields"), dict):
+        return name, _structured(item["fields"]), "structured"
+    raise BulkRequestError("Each item needs text/data, label[]/value[] or fields")
+
+
+def parse_json_rows(body):
+    items = body.get("items") if isinstance(body, dict) else body
+    if not isinstance(items, list):
+        raise BulkRequestError('Expected a JSON list or {"items": [...]}')
+    return [_row_from_json(item) for item in items]
+
+
+def parse_csv_rows(text):
+    """A `text`/`data` column gives text rows; otherwise every column is a label."""
+    reader = csv.DictReader(StringIO(text))
+    if not reader.fieldnames:
+        raise BulkRequestError("CSV has no header row")
+    columns = [c.strip() for c in reader.fieldnames]
+    reader.fieldnames = columns
+    text_col = next((c for c in columns if c.lower() in TEXT_COLUMNS), None)
+    name_col = next((c for c in columns if c.lower() in NAME_COLUMNS), None)
+    rows = []
+    for row in reader:
+        name = row.get(name_col) if name_col else None
+        if text_col:
+            if row.get(text_col):
+                rows.append((name, row[text_col], "text"))
+        else:
+            fields = {k: v or "" for k, v in row.items() if k is not None}
+            if any(fields.values()):
+                rows.append((name, _structured(fields), "structured"))
+    return rows
+
+
+def parse_options(raw):
+    opts = dict(DEFAULT_OPTIONS)
+    for key, value in (raw or {}).items():
+        if key == "error_correction":
+            if str(value).upper() not in ("L", "M", "Q", "H"):
+                raise BulkRequestError("error_correction must be L, M, Q or H")
+            opts[key] = str(value).upper()
+        elif key in ("box_size", "border"):
+            try:
+                opts[key] = max(0 if key == "border" else 1, min(int(value), 50))
+            except (TypeError, ValueError):
+                raise BulkRequestError(f"{key} must be an integer")
+    return opts
+
+
+def render_one(job):
+    """Pool worker: (payload, fmt, options) -> image bytes."""
+    payload, fmt, options = job
+    if fmt == "svg":
+        return render_qr_svg(payload, options)
+    return render_qr_png(payload, options)
+
+
+def _get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:  # concurrent first requests must not each start a pool
+            if _pool is None:
+                # spawn: never fork a threaded web worker
+                ctx = multiprocessing.get_context("spawn")
+                _pool = ProcessPoolExecutor(max_workers=RENDER_WORKERS, mp_context=ctx)
+    return _pool
+
+
+def _reset_pool(broken=None):
+    """Shut the pool down; with `broken`, only if it is still the current pool."""
+    global _pool
+    with _pool_lock:
+        if broken is not None and _pool is not broken:
+            return  # another thread already replaced it
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def render_all(jobs, chunksize=16):
+    """Yield rendered images in job order as they become available."""
+    if len(jobs) <= 1 or RENDER_WORKERS <= 1:
+        yield from map(render_one, jobs)
+        return
+    done = 0
+    pool = _get_pool()
+    try:
+        for image in pool.map(render_one, jobs, chunksize=chunksize):
+            yield image
+            done += 1
+    except BrokenProcessPool as e:
+        print(f"Warning: render pool died, rendering serially: {e}")
+        _reset_pool(pool)
+        yield from map(render_one, jobs[done:])
+
+
+@atexit.register
+def shutdown_renderer():
+    _reset_pool()
+
+
+def entry_name(index, name, fmt):
+    """Unique, filesystem-safe name for the index-th image."""
+    slug = re.sub(r"[^A-Za-z0-9._-]+", "_", str(name or "")).strip("._")[:60]
+    return f"{index:05d}_{slug}.{fmt}" if slug else f"qr_{index:05d}.{fmt}"
+
+
+class _ChunkSink:
+    """Write-only file object that hands out what ZipFile wrote so far."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def stream_zip(rows, fmt, options, on_rendered=None):
+    """Yield a ZIP of one image per row, plus manifest.csv, as it is built.
+
+    on_rendered(entries) is called with the (name, payload, data_type, filename)
+    tuples of each group of images written, so metadata can be logged in batches.
+    """
+    sink = _ChunkSink()
+    # PNGs are already deflated; SVG text compresses well
+    compression = zipfile.ZIP_DEFLATED if fmt == "svg" else zipfile.ZIP_STORED
+    zf = zipfile.ZipFile(sink, "w", compression=compression)
+    manifest = StringIO()
+    writer = csv.writer(manifest)
+    writer.writerow(["file", "data_type", "data"])
+    jobs = [(payload, fmt, options) for _, payload, _ in rows]
+    pending = []
+    for i, (row, image) in enumerate(zip(rows, render_all(jobs)), 1):
+        filename = entry_name(i, row[0], fmt)
+        zf.writestr(filename, image)
+        writer.writerow([filename, row[2], row[1]])
+        pending.append(row + (filename,))
+        if on_rendered and len(pending) >= LOG_BATCH:
+            on_rendered(pending)
+            pending = []
+        chunk = sink.take()
+        if chunk:
+            yield chunk
+    if on_rendered and pending:
+        on_rendered(pending)
+    zf.writestr("manifest.csv", manifest.getvalue())
+    zf.close()
+    yield sink.take()
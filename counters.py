@@ -0,0 +1,141 @@
+# counters.py
+"""Sharded scan counters for Firestore.
+
+A Firestore document sustains roughly one write per second, and every scan
+increments its user's counts, so busy users - above all the shared
+"anonymous" user behind kiosks - queue up on a single users/{uid}/meta/counts
+doc. Each counter is therefore split over N shard documents in meta:
+"counts" (the original doc, so existing totals are kept) and "counts_1" ...
+"counts_<N-1>". Writes increment one shard picked at random; reads fetch all
+shards in one get_all and sum them.
+
+Summed reads are cached for a short TTL. Increments committed by this process
+are applied to a cached sum in place, so a user sees their own scans at once;
+other processes' writes show up within the TTL. A fetch that a write of the
+same user overlapped may or may not include it, so its sum is served once
+but not cached (see WriteOverlap). The shard count may be raised
+at any time but must never be lowered, or the dropped shards' counts are lost.
+"""
+import random
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+
+class WriteOverlap:
+    """Tracks which cache fills raced a write of the same key.
+
+    Caches here are kept current by applying a write's increments after it
+    commits. A fill that reads the store while a write is in flight may see
+    it committed or not, and applying the increments to what it read could
+    count them twice. Writers hold writing(key) from before the write until
+    the cache is updated; a fill that overlapped one is not cached.
+    begin_fill and end_fill expect `lock` to be held by the caller.
+    """
+
+    def __init__(self, lock):
+        self._lock = lock
+        self._writes = {}  # key -> writes in progress
+        self._fills = {}  # key -> [overlapped] for each fill in progress
+
+    @contextmanager
+    def writing(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._writes[key] = self._writes.get(key, 0) + 1
+                for fill in self._fills.get(key, ()):
+                    fill[0] = True
+        try:
+            yield
+        finally:
+            with self._lock:
+                for key in keys:
+                    n = self._writes.pop(key) - 1
+                    if n:
+                        self._writes[key] = n
+
+    def begin_fill(self, key):
+        fill = [key in self._writes]
+        self._fills.setdefault(key, []).append(fill)
+        return fill
+
+    def end_fill(self, key, fill):
+        """True if a write overlapped the fill."""
+        fills = self._fills[key]
+        del fills[next(i for i, f in enumerate(fills) if f is fill)]
+        if not fills:
+            del self._fills[key]
+        return fill[0]
+
+
+class ShardedCounter:
+    def __init__(self, shards=8, cache_ttl=2.0, max_cached=10000):
+        self.shards = max(1, int(shards))
+        self.cache_ttl = cache_ttl
+        self.max_cached = max_cached
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()  # uid -> (counts, fetched_at)
+        self._overlap = WriteOverlap(self._lock)
+
+    def shard_names(self):
+        """Document ids (in meta) of every shard."""
+        return ["counts"] + [f"counts_{i}" for i in range(1, self.shards)]
+
+    def pick(self):
+        """Document id of the shard a write should go to."""
+        i = random.randrange(self.shards)
+        return f"counts_{i}" if i else "counts"
+
+    @staticmethod
+    def total(shard_dicts):
+        """Sum shard documents ({type: n}) into one counts dict."""
+        counts = {}
+        for shard in shard_dicts:
+            for scan_type, n in (shard or {}).items():
+                if isinstance(n, (int, float)):
+                    counts[scan_type] = counts.get(scan_type, 0) + n
+        return counts
+
+    # ---- read cache ----
+    def read(self, uid, fetch):
+        """uid's summed counts from the cache, or from fetch() when missing or expired."""
+        with self._lock:
+            entry = self._cache.get(uid)
+            if entry is not None and time.monotonic() - entry[1] < self.cache_ttl:
+                return dict(entry[0])
+            fill = self._overlap.begin_fill(uid)
+        try:
+            counts = fetch()
+        except BaseException:
+            with self._lock:
+                self._overlap.end_fill(uid, fill)
+            raise
+        with self._lock:
+            if not self._overlap.end_fill(uid, fill):
+                self._put(uid, counts)
+        return dict(counts)
+
+    def writing(self, *uids):
+        """Hold around a counted write, from before it is sent until apply()."""
+        return self._overlap.writing(*uids)
+
+    def apply(self, uid, delta):
+        """Add committed increments to a cached sum (its age is unchanged)."""
+        with self._lock:
+            entry = self._cache.get(uid)
+            if entry is not None:
+                counts = entry[0]
+                for scan_type, n in delta.items():
+                    counts[scan_type] = counts.get(scan_type, 0) + n
+
+    def reset(self, uid):
+        with self._lock:
+            self._put(uid, {})
+
+    def _put(self, uid, counts):
+        # caller holds self._lock
+        self._cache[uid] = (dict(counts), time.monotonic())
+        self._cache.move_to_end(uid)
+        while len(self._cache) > self.max_cached:
+            self._cache.popitem(last=False)
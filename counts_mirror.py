@@ -0,0 +1,70 @@
+# counts_mirror.py
+"""In-process mirror of each user's scan counts.
+
+Scan responses include the user's counts, which used to cost a read of the
+counts doc(s) after every save. The mirror loads a user's counts once, then
+adds every increment this process makes, so scan responses are answered
+from memory. Increments made by other workers are only seen when the mirror
+reconciles, which it does by reloading a user whose counts are older than
+`reconcile_every` seconds on their next read.
+
+Writers hold writing(uid) from before the write until they have called
+add(). A load that overlapped such a write may or may not include it, so it
+is served but not kept, and the next read loads again.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from counters import WriteOverlap
+
+
+class CountsMirror:
+    def __init__(self, load, reconcile_every=30.0, max_users=10000):
+        """load(uid) -> authoritative counts dict (store plus queued increments)."""
+        self._load = load
+        self.reconcile_every = reconcile_every
+        self.max_users = max_users
+        self._lock = threading.Lock()
+        self._users = OrderedDict()  # uid -> (counts, loaded_at)
+        self._overlap = WriteOverlap(self._lock)
+
+    def get(self, uid):
+        """uid's counts, loading or reconciling them first when due."""
+        with self._lock:
+            entry = self._users.get(uid)
+            if entry is not None and time.monotonic() - entry[1] < self.reconcile_every:
+                self._users.move_to_end(uid)
+                return dict(entry[0])
+            fill = self._overlap.begin_fill(uid)
+        try:
+            counts = dict(self._load(uid))
+        except BaseException:
+            with self._lock:
+                self._overlap.end_fill(uid, fill)
+            raise
+        with self._lock:
+            if not self._overlap.end_fill(uid, fill):
+                self._users[uid] = (counts, time.monotonic())
+                self._users.move_to_end(uid)
+                while len(self._users) > self.max_users:
+                    self._users.popitem(last=False)
+        return dict(counts)
+
+    def writing(self, *uids):
+        """Hold around a write of these users' counts, from before it is made until add()."""
+        return self._overlap.writing(*uids)
+
+    def add(self, uid, delta):
+        """Apply increments this process made; users not mirrored yet are skipped."""
+        with self._lock:
+            entry = self._users.get(uid)
+            if entry is not None:
+                counts = entry[0]
+                for scan_type, n in delta.items():
+                    counts[scan_type] = counts.get(scan_type, 0) + n
+
+    def reset(self, uid):
+        """uid's counts were cleared."""
+        with self._lock:
+            self._users[uid] = ({}, time.monotonic())
@@ -0,0 +1,319 @@
+# decoder.py
+"""Barcode/QR decoding used by the upload routes.
+
+Images are decoded straight from the uploaded bytes (no temp files) and a
+multi-image batch is fanned out over a bounded process pool, so a batch takes
+about as long as its slowest image instead of the sum of all of them.
+
+Each image goes through a ladder of strategies, cheapest first, and stops at
+the first one that finds anything:
+
+  regions     large images only: find textured candidate regions on a
+              downsampled frame and decode just those crops at full
+              resolution (small codes in big shelf/pallet photos)
+  downscaled  grayscale, longest side at most DECODE_MAX_SIDE (most photos)
+  adaptive    adaptive threshold (low contrast, uneven lighting)
+  sharpen     unsharp mask (slightly blurred shots)
+  full        grayscale at full resolution (small codes lost by downscaling)
+  rotate      45/30 degree rotations (skewed 1D barcodes)
+  opencv      OpenCV's QRCodeDetector.detectAndDecodeMulti
+
+When the regions stage hit the ROI_MAX_REGIONS cap, candidates past it went
+untried, so a hit is merged with the downscaled pass before the ladder stops.
+An image stops climbing once DECODE_BUDGET_MS is spent, counted from the
+first full-frame pass: a regions miss always falls back to at least that one. Every result reports
+which strategies ran, how long each took and which one hit; the parent
+process adds them to `decode_stats`.
+"""
+import os
+import atexit
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from metrics import counter, histogram
+
+# Size of the decode pool; 0 or 1 decodes in the request thread.
+DECODE_WORKERS = int(os.getenv("DECODE_WORKERS", str(min(4, os.cpu_count() or 1))))
+# Longest side of the first, downscaled pass
+DECODE_MAX_SIDE = int(os.getenv("DECODE_MAX_SIDE", "1280"))
+# Time after which an image gets no more fallback strategies (milliseconds)
+DECODE_BUDGET_MS = float(os.getenv("DECODE_BUDGET_MS", "1500"))
+
+# Candidate-region stage: detection frame size and how many crops to try
+ROI_DETECT_SIDE = int(os.getenv("ROI_DETECT_SIDE", "1500"))
+ROI_MAX_REGIONS = int(os.getenv("ROI_MAX_REGIONS", "16"))
+
+STRATEGIES = ("regions", "downscaled", "adaptive", "sharpen", "full", "rotate", "opencv")
+ROTATIONS = (45, -45, 30, -30)
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _zbar(image):
+    from pyzbar.pyzbar import decode
+    return [(str(obj.type), obj.data.decode("utf-8", errors="replace")) for obj in decode(image)]
+
+
+def _rotate(image, angle):
+    import cv2
+    h, w = image.shape[:2]
+    m = cv2.getRotationMatrix2D((w / 2, h / 2), angle, 1.0)
+    cos, sin = abs(m[0, 0]), abs(m[0, 1])
+    nw, nh = int(h * sin + w * cos), int(h * cos + w * sin)
+    m[0, 2] += nw / 2 - w / 2
+    m[1, 2] += nh / 2 - h / 2
+    return cv2.warpAffine(image, m, (nw, nh), borderValue=255)
+
+
+def candidate_regions(gray, max_regions=ROI_MAX_REGIONS):
+    """Boxes (x, y, w, h) of `gray` likely to hold a barcode, best first.
+
+    A barcode is an area where nearly every few pixels there is a strong
+    edge. On a downsampled frame, edge pixels (gradient magnitude above an
+    Otsu threshold) are averaged over a small window, and blobs where the
+    edge density is high become candidates. Candidates are ranked two ways
+    and interleaved: by density times how evenly the edges run in x and y
+    (2D codes), and by density alone (1D barcodes run one way).
+    """
+    import cv2
+    import numpy as np
+    h, w = gray.shape[:2]
+    scale = min(1.0, ROI_DETECT_SIDE / max(h, w))
+    small = cv2.resize(gray, (int(w * scale), int(h * scale)), interpolation=cv2.INTER_AREA) if scale < 1 else gray
+    gx = cv2.Sobel(small, cv2.CV_32F, 1, 0, ksize=3)
+    gy = cv2.Sobel(small, cv2.CV_32F, 0, 1, ksize=3)
+    _, edges = cv2.threshold(cv2.convertScaleAbs(cv2.magnitude(gx, gy)), 0, 1,
+                             cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    density = cv2.blur(edges.astype(np.float32), (5, 5))
+    mask = (density > 0.5).astype(np.uint8) * 255
+    # a light close only: a wider one fuses codes with neighbouring text into one busy crop
+    mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, cv2.getStructuringElement(cv2.MORPH_RECT, (3, 3)))
+    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+
+    frame = small.shape[0] * small.shape[1]
+    candidates = []
+    for contour in contours:
+        x, y, bw, bh = cv2.boundingRect(contour)
+        # too small to hold a readable code, or most of the frame (no point cropping)
+        if bw * bh < frame * 0.0002 or bw * bh > frame * 0.25:
+            continue
+        d = float(density[y:y + bh, x:x + bw].mean())
+        sx = float(np.abs(gx[y:y + bh, x:x + bw]).mean())
+        sy = float(np.abs(gy[y:y + bh, x:x + bw]).mean())
+        balance = min(sx, sy) / max(sx, sy, 1e-6)
+        candidates.append((d * balance, d, (x, y, bw, bh)))
+    by_2d = [c[2] for c in sorted(candidates, key=lambda c: -c[0])]
+    by_1d = [c[2] for c in sorted(candidates, key=lambda c: -c[1])]
+    ranked = list(dict.fromkeys(box for pair in zip(by_2d, by_1d) for box in pair))
+
+    boxes = []
+    for x, y, bw, bh in ranked[:max_regions]:
+        pad = int(max(bw, bh) * 0.15) + 4  # quiet zone around the code
+        x0, y0 = max(0, int((x - pad) / scale)), max(0, int((y - pad) / scale))
+        x1, y1 = min(w, int((x + bw + pad) / scale)), min(h, int((y + bh + pad) / scale))
+        boxes.append((x0, y0, x1 - x0, y1 - y0))
+    return boxes
+
+
+def _opencv_qr(image):
+    import cv2
+    ok, texts, _, _ = cv2.QRCodeDetector().detectAndDecodeMulti(image)
+    return [("QRCODE", t) for t in texts if t] if ok else []
+
+
+class _Ladder:
+    """Grayscale and downscaled copies of one image, shared by the strategies."""
+
+    def __init__(self, color):
+        import cv2
+        self.color = color
+        self.gray_full = cv2.cvtColor(color, cv2.COLOR_BGR2GRAY) if color.ndim == 3 else color
+        h, w = self.gray_full.shape[:2]
+        scale = DECODE_MAX_SIDE / max(h, w)
+        self.scaled = scale < 1
+        self.regions_capped = False
+        self.gray = (cv2.resize(self.gray_full, (int(w * scale), int(h * scale)), interpolation=cv2.INTER_AREA)
+                     if self.scaled else self.gray_full)
+
+    def run(self, strategy):
+        import cv2
+        if strategy == "regions":
+            if not self.scaled:
+                return None  # small image: the downscaled pass is already full frame
+            boxes = candidate_regions(self.gray_full)
+            # at the cap, candidates past it (possibly codes) went untried
+            self.regions_capped = len(boxes) >= ROI_MAX_REGIONS
+            found = []
+            for x, y, w, h in boxes:
+                found.extend(_zbar(self.gray_full[y:y + h, x:x + w]))
+            return found
+        if strategy == "downscaled":
+            return _zbar(self.gray)
+        if strategy == "full":
+            return _zbar(self.gray_full) if self.scaled else None
+        if strategy == "adaptive":
+            return _zbar(cv2.adaptiveThreshold(self.gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
+                                               cv2.THRESH_BINARY, 31, 10))
+        if strategy == "sharpen":
+            blurred = cv2.GaussianBlur(self.gray, (0, 0), 3)
+            return _zbar(cv2.addWeighted(self.gray, 1.5, blurred, -0.5, 0))
+        if strategy == "rotate":
+            for angle in ROTATIONS:
+                codes = _zbar(_rotate(self.gray, angle))
+                if codes:
+                    return codes
+            return []
+        if strategy == "opencv":
+            return _opencv_qr(self.color)
+        raise ValueError(strategy)
+
+
+def decode_image_bytes(data, budget_ms=None, strategies=STRATEGIES):
+    """Decode every symbol in an encoded image buffer (PNG/JPEG/...).
+
+    Returns {"codes": [{"type", "data"}, ...], "error": str or None,
+    "strategy": the strategy that found the codes (or None),
+    "attempts": [(strategy, ms), ...]}.
+    """
+    # imported on first decode so web workers that never decode skip OpenCV/zbar
+    import cv2
+    import numpy as np
+    budget = DECODE_BUDGET_MS if budget_ms is None else budget_ms
+    attempts = []
+    try:
+        buf = np.frombuffer(data, dtype=np.uint8)
+        image = cv2.imdecode(buf, cv2.IMREAD_COLOR) if buf.size else None
+        if image is None:
+            return {"codes": [], "error": "Could not process image file", "strategy": None, "attempts": attempts}
+        ladder = _Ladder(image)
+        start = None  # budget clock; the regions pre-pass doesn't count against it
+        for strategy in strategies:
+            # the first full-frame pass always runs; fallbacks only while budget remains
+            if start is not None and (time.perf_counter() - start) * 1000 >= budget:
+                break
+            t0 = time.perf_counter()
+            if start is None and strategy != "regions":
+                start = t0
+            found = ladder.run(strategy)
+            if found is None:
+                continue  # not applicable to this image
+            attempts.append((strategy, (time.perf_counter() - t0) * 1000))
+            if found and strategy == "regions" and ladder.regions_capped and "downscaled" in strategies:
+                # crops past the cap went untried; the cheap full-frame pass fills in codes among them
+                t0 = time.perf_counter()
+                found = found + ladder.run("downscaled")
+                attempts.append(("downscaled", (time.perf_counter() - t0) * 1000))
+            if found:
+                codes = [{"type": t, "data": d} for t, d in dict.fromkeys(found)]
+                return {"codes": codes, "error": None, "strategy": strategy, "attempts": attempts}
+        return {"codes": [], "error": None, "strategy": None, "attempts": attempts}
+    except Exception as e:
+        return {"codes": [], "error": str(e), "strategy": None, "attempts": attempts}
+
+
+class DecodeStats:
+    """Per-strategy attempt/hit counts and latency, aggregated in the web process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._strategies = {s: {"attempts": 0, "hits": 0, "ms": 0.0} for s in STRATEGIES}
+        self.images = 0
+        self.misses = 0
+        self.budget_exhausted = 0
+
+    def record(self, result):
+        attempts = result.get("attempts") or []
+        with self._lock:
+            self.images += 1
+            for strategy, ms in attempts:
+                s = self._strategies[strategy]
+                s["attempts"] += 1
+                s["ms"] += ms
+            if result.get("strategy"):
+                self._strategies[result["strategy"]]["hits"] += 1
+            elif not result.get("error"):
+                self.misses += 1
+                if attempts and attempts[-1][0] != STRATEGIES[-1]:
+                    self.budget_exhausted += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "images": self.images,
+                "misses": self.misses,
+                "budget_exhausted": self.budget_exhausted,
+                "strategies": {
+                    name: {"attempts": s["attempts"], "hits": s["hits"],
+                           "avg_ms": round(s["ms"] / s["attempts"], 2) if s["attempts"] else None}
+                    for name, s in self._strategies.items()
+                },
+            }
+
+
+decode_stats = DecodeStats()
+
+DECODE_SECONDS = histogram("decode_image_seconds", "Decode time per image (all strategies tried)", ["result"])
+DECODE_STRATEGY_SECONDS = histogram("decode_strategy_seconds", "Time per decode strategy attempt", ["strategy"])
+DECODE_CODES = histogram("decode_codes_per_image", "Codes found per decoded image", buckets=(0, 1, 2, 3, 5, 10, 20, 50))
+UPLOAD_BYTES = histogram("upload_image_bytes", "Size of uploaded images",
+                         buckets=(16e3, 64e3, 256e3, 1e6, 2e6, 4e6, 8e6, 16e6))
+UPLOAD_BYTES_TOTAL = counter("upload_image_bytes_total", "Bytes of uploaded images decoded")
+
+
+def _get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:  # concurrent first requests must not each start a pool
+            if _pool is None:
+                # spawn: never fork a threaded web worker
+                ctx = multiprocessing.get_context("spawn")
+                _pool = ProcessPoolExecutor(max_workers=DECODE_WORKERS, mp_context=ctx)
+    return _pool
+
+
+def _reset_pool(broken=None):
+    """Shut the pool down; with `broken`, only if it is still the current pool."""
+    global _pool
+    with _pool_lock:
+        if broken is not None and _pool is not broken:
+            return  # another thread already replaced it
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _decode_all(buffers):
+    if len(buffers) <= 1 or DECODE_WORKERS <= 1:
+        return [decode_image_bytes(b) for b in buffers]
+    pool = _get_pool()
+    try:
+        return list(pool.map(decode_image_bytes, buffers))
+    except BrokenProcessPool as e:
+        print(f"Warning: decode pool died, decoding serially: {e}")
+        _reset_pool(pool)
+        return [decode_image_bytes(b) for b in buffers]
+
+
+def decode_batch(buffers):
+    """Decode a list of image buffers, returning results in the same order."""
+    results = _decode_all(buffers)
+    for data, result in zip(buffers, results):
+        decode_stats.record(result)
+        UPLOAD_BYTES.observe(len(data))
+        UPLOAD_BYTES_TOTAL.inc(len(data))
+        attempts = result.get("attempts") or []
+        for strategy, ms in attempts:
+            DECODE_STRATEGY_SECONDS.observe(ms / 1000, strategy=strategy)
+        outcome = "error" if result.get("error") else "hit" if result.get("codes") else "miss"
+        DECODE_SECONDS.observe(sum(ms for _, ms in attempts) / 1000, result=outcome)
+        DECODE_CODES.observe(len(result.get("codes") or ()))
+    return results
+
+
+@atexit.register
+def shutdown_decoder():
+    _reset_pool()
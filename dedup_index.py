@@ -0,0 +1,118 @@
+# dedup_index.py
+"""Per-user "seen this code before?" index for the upload routes.
+
+Each user's scanned payloads are kept as a set of 64-bit content hashes,
+loaded lazily the first time the user is checked (scans still queued in the
+write-behind queue, then the scans collection) and kept up to date as scans
+are added. Scans added while a user is loading are applied to the loaded set.
+Users are evicted LRU and re-loaded after `ttl` seconds so scans written by
+other workers are picked up.
+
+A miss is answered from memory, but a hit is only a hint: it is confirmed
+with store.scan_exists before a scan is dropped as a duplicate, so a history
+cleared through another worker (or a hash collision) never hides a new scan.
+
+Scans made without a login all share the "anonymous" uid; they have never
+been de-duplicated and that history is unbounded, so it is never indexed.
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+ANONYMOUS_UID = "anonymous"
+
+
+def content_hash(data):
+    return int.from_bytes(hashlib.blake2b(str(data).encode("utf-8"), digest_size=8).digest(), "big")
+
+
+class DedupIndex:
+    def __init__(self, store, max_users=1000, ttl=600, pending=None):
+        """pending(uid), if given, -> payloads of uid's scans not written to the store yet."""
+        self.store = store
+        self.pending = pending
+        self.max_users = max_users
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._users = OrderedDict()  # uid -> (loaded_at, set of hashes)
+        self._loading = {}           # uid -> lock held while warming
+        self._added = {}             # uid -> [cleared, hashes added] while it is being loaded
+
+    @staticmethod
+    def tracks(uid):
+        return bool(uid) and uid != ANONYMOUS_UID
+
+    def _hashes(self, uid):
+        with self._lock:
+            entry = self._users.get(uid)
+            if entry and time.monotonic() - entry[0] < self.ttl:
+                self._users.move_to_end(uid)
+                return entry[1]
+            load_lock = self._loading.setdefault(uid, threading.Lock())
+        with load_lock:
+            # another thread may have warmed it while we waited
+            with self._lock:
+                entry = self._users.get(uid)
+                if entry and time.monotonic() - entry[0] < self.ttl:
+                    return entry[1]
+                added = self._added[uid] = [False, set()]
+            try:
+                # queued first: a scan leaves the queue only once it is in the store
+                hashes = {content_hash(d) for d in (self.pending(uid) if self.pending else ())}
+                hashes.update(content_hash(d) for d in self.store.iter_scan_data(uid))
+            except BaseException:
+                with self._lock:
+                    del self._added[uid]
+                raise
+            with self._lock:
+                del self._added[uid]
+                cleared, new = added
+                # scans added during the read may have been missed by it
+                hashes = new if cleared else hashes | new
+                self._users[uid] = (time.monotonic(), hashes)
+                self._users.move_to_end(uid)
+                while len(self._users) > self.max_users:
+                    self._users.popitem(last=False)
+                self._loading.pop(uid, None)
+            return hashes
+
+    def seen(self, uid, data):
+        """True if uid has already scanned `data` (an indexed hit is confirmed with the store)."""
+        if not self.tracks(uid):
+            return False
+        h = content_hash(data)
+        if h not in self._hashes(uid):
+            return False
+        if self.store.scan_exists(uid, data):
+            return True
+        with self._lock:
+            # stale: cleared through another worker, or a hash collision
+            entry = self._users.get(uid)
+            if entry:
+                entry[1].discard(h)
+        return False
+
+    def add(self, uid, data):
+        """Record a new scan, once it is queued or written."""
+        if not self.tracks(uid):
+            return
+        h = content_hash(data)
+        with self._lock:
+            entry = self._users.get(uid)
+            if entry:
+                entry[1].add(h)
+            if uid in self._added:
+                self._added[uid][1].add(h)
+
+    def clear(self, uid):
+        """Forget a user's scans (after their history was cleared)."""
+        if not self.tracks(uid):
+            return
+        with self._lock:
+            self._users[uid] = (time.monotonic(), set())
+            self._users.move_to_end(uid)
+            loading = self._added.get(uid)
+            if loading:
+                loading[0] = True
+                loading[1].clear()
@@ -0,0 +1,70 @@
+# events.py
+"""Per-user push channel (Socket.IO) for scan, record, folder and count changes.
+
+Every logged-in browser joins the room "user:<uid>" when it connects, and the
+write paths call emit_to_user() after a successful write, so open pages can
+apply the change instead of re-downloading whole collections.
+
+Events (payloads are small deltas):
+  scan_saved      {"type", "data", "timestamp"}
+  counts_changed  {"delta": {type: n}} or {"reset": true}
+  record_updated  {"action", "record_id", "title", ...}
+  folder_changed  {"action", "folder": {...}}
+
+If Flask-SocketIO is not installed the app runs without push and emitting is
+a no-op. With more than one server worker, set SOCKETIO_MESSAGE_QUEUE (e.g. a
+redis:// URL) so an emit from one worker reaches sockets held by the others.
+"""
+import json
+import os
+
+from flask import session
+
+try:
+    from flask_socketio import SocketIO, join_room
+except ImportError:  # optional dependency
+    SocketIO = None
+
+socketio = None
+
+
+def _room(uid):
+    return f"user:{uid}"
+
+
+def _jsonable(payload):
+    return json.loads(json.dumps(payload, default=lambda v: v.isoformat() if hasattr(v, "isoformat") else str(v)))
+
+
+def init_events(app):
+    """Attach Socket.IO to the app; returns the SocketIO instance or None."""
+    global socketio
+    if SocketIO is None:
+        print("⚠️ Flask-SocketIO not installed, live updates disabled")
+        return None
+    origins = os.getenv("SOCKETIO_CORS_ORIGINS")
+    socketio = SocketIO(
+        app,
+        async_mode=os.getenv("SOCKETIO_ASYNC_MODE") or None,
+        cors_allowed_origins=origins.split(",") if origins else None,
+        message_queue=os.getenv("SOCKETIO_MESSAGE_QUEUE") or None,
+    )
+
+    @socketio.on("connect")
+    def on_connect(auth=None):
+        uid = session.get("firebase_uid")
+        if not session.get("authenticated") or not uid:
+            return False  # reject anonymous sockets
+        join_room(_room(uid))
+
+    return socketio
+
+
+def emit_to_user(uid, event, payload):
+    """Push `event` to every socket of uid; never raises into the caller."""
+    if socketio is None or not uid:
+        return
+    try:
+        socketio.emit(event, _jsonable(payload), to=_room(uid))
+    except Exception as e:
+        print(f"Warning: could not emit {event}: {e}")
@@ -0,0 +1,188 @@
+# exports.py
+"""Streaming scan-history exports (CSV, JSON, NDJSON) and record exports.
+
+Each exporter is a generator of encoded chunks fed by a page-at-a-time scan
+iterator, so an export runs in constant memory and the first bytes go out
+as soon as the first page has been read.
+
+Record downloads are tables: record_table() yields the header and then one
+list per row, and both stream_table_csv() and write_table_xlsx() consume it.
+Records keep the union of their payload keys ("columns") and each record
+scan its content_hash, both maintained on write, so the header is known
+before the first scan is read and rows stream straight through.
+"""
+import csv
+import hashlib
+import json
+import tempfile
+import zlib
+from io import StringIO
+
+EXPORT_PAGE_SIZE = 500
+
+
+def iter_all_scans(store, uid, page_size=EXPORT_PAGE_SIZE):
+    """Yield every scan of uid, newest first, one store page at a time."""
+    cursor = None
+    while True:
+        docs, cursor = store.list_scans(uid, limit=page_size, cursor=cursor)
+        yield from docs
+        if not cursor:
+            return
+
+
+def _json_default(value):
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    return str(value)
+
+
+def _iso(value):
+    return value.isoformat() if hasattr(value, "isoformat") else value
+
+
+def stream_csv(scans, flush_every=EXPORT_PAGE_SIZE):
+    buf = StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(["Type", "Data", "Scanned At", "User ID"])
+    for i, scan in enumerate(scans, 1):
+        writer.writerow([scan.get("type"), scan.get("data"), _iso(scan.get("timestamp")) or "",
+                         scan.get("firebase_uid") or ""])
+        if i % flush_every == 0:
+            yield buf.getvalue().encode("utf-8")
+            buf.seek(0)
+            buf.truncate()
+    yield buf.getvalue().encode("utf-8")
+
+
+def stream_json(scans, counts, indent=None):
+    """{"counts": {...}, "scans": [...]} written one scan at a time."""
+    sep = ",\n" if indent else ","
+    yield ('{"counts": %s, "scans": [' % json.dumps(counts, default=_json_default)).encode("utf-8")
+    first = True
+    for scan in scans:
+        item = json.dumps(scan, indent=indent, default=_json_default)
+        yield (("\n" if first and indent else "" if first else sep) + item).encode("utf-8")
+        first = False
+    yield b"]}"
+
+
+def stream_ndjson(scans):
+    for scan in scans:
+        yield (json.dumps(scan, default=_json_default) + "\n").encode("utf-8")
+
+
+RECORD_FIXED_COLUMNS = ("id", "scanned at")
+
+
+def normalize_record_data(raw):
+    """The export row for one record scan's payload, before id/scanned at.
+
+    JSON object payloads become one column per key (keys and values trimmed
+    and lowercased); anything else goes in a "data" column.
+    """
+    try:
+        parsed = json.loads(raw) if isinstance(raw, str) else raw
+        if isinstance(parsed, dict):
+            return {k.strip().lower(): str(v).strip().lower() for k, v in parsed.items()}
+    except Exception:
+        pass
+    return {"data": str(raw).strip().lower()}
+
+
+def content_hash(row):
+    """Hash of a normalized row; scans with equal rows export once."""
+    raw = json.dumps(sorted(row.items()))
+    return hashlib.blake2b(raw.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def record_columns(keys):
+    """Export column order for a record whose payloads use `keys`."""
+    return sorted(set(keys) | set(RECORD_FIXED_COLUMNS))
+
+
+def iter_record_rows(scans):
+    """Yield one row per distinct scan payload, in a single pass.
+
+    Duplicates are recognised by the content_hash stored on each scan when it
+    was saved (computed here for scans saved before it was).
+    """
+    seen = set()
+    for scan in scans:
+        row = normalize_record_data(scan.get("data"))
+        key = scan.get("content_hash") or content_hash(row)
+        if key in seen:
+            continue
+        seen.add(key)
+        row["id"] = scan.get("id", "")
+        row["scanned at"] = _iso(scan.get("scanned_at"))
+        yield row
+
+
+def record_rows(scans):
+    """Buffered iter_record_rows for records without a stored column list.
+
+    Returns (rows, data keys seen, export columns).
+    """
+    rows, keys = [], set()
+    for row in iter_record_rows(scans):
+        keys.update(k for k in row if k not in RECORD_FIXED_COLUMNS)
+        rows.append(row)
+    return rows, sorted(keys), record_columns(keys)
+
+
+def record_table(rows, columns):
+    """Yield the header, then each row as a list in column order."""
+    yield list(columns)
+    for row in rows:
+        yield [row.get(k, "") for k in columns]
+
+
+def stream_table_csv(table, flush_every=EXPORT_PAGE_SIZE):
+    buf = StringIO()
+    writer = csv.writer(buf)
+    for i, values in enumerate(table, 1):
+        writer.writerow(values)
+        if i % flush_every == 0:
+            yield buf.getvalue().encode("utf-8")
+            buf.seek(0)
+            buf.truncate()
+    yield buf.getvalue().encode("utf-8")
+
+
+def write_table_xlsx(table, sheet_name="Record"):
+    """Write a table to an .xlsx in a temp file and return it, rewound.
+
+    constant_memory makes xlsxwriter flush each row to disk as soon as the
+    next one starts, so memory stays flat however many rows there are, and
+    the finished workbook is spooled to disk rather than held in RAM.
+    """
+    from xlsxwriter import Workbook
+    out = tempfile.TemporaryFile()
+    workbook = Workbook(out, {"constant_memory": True})
+    sheet = workbook.add_worksheet(sheet_name)
+    header_format = workbook.add_format({"bold": True, "border": 1, "align": "center"})
+    widths = {}
+    for r, values in enumerate(table):
+        for c, value in enumerate(values):
+            text = "" if value is None else str(value)
+            if not text and r:
+                continue  # leave missing values as empty cells
+            sheet.write_string(r, c, text, header_format if r == 0 else None)
+            widths[c] = max(widths.get(c, 0), len(text))
+    # column widths are stored apart from the row data, so they can be set last
+    for c, width in widths.items():
+        sheet.set_column(c, c, min(max(width, 8), 60) + 2)
+    workbook.close()
+    out.seek(0)
+    return out
+
+
+def gzip_stream(chunks, level=6):
+    """Gzip-compress a stream of byte chunks on the fly."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        out = compressor.compress(chunk)
+        if out:
+            yield out
+    yield compressor.flush()
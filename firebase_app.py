@@ -0,0 +1,59 @@
+# firebase_app.py
+"""Lazy, cached Firebase Admin initialization.
+
+Importing firebase_admin and its Firestore client (grpc, protobuf and the
+google-cloud stack) costs a large share of a cold start, and most requests
+never need it before the first Firestore call. LazyFirebase only checks that
+the service account file exists up front; the SDK is imported and the app
+initialized on first use, once per process, and the result is cached.
+"""
+import os
+import threading
+
+
+class LazyFirebase:
+    def __init__(self, service_account):
+        self.service_account = service_account
+        self._lock = threading.Lock()
+        self._app = None
+        self._firestore = None
+
+    @property
+    def configured(self):
+        """True if the service account key exists (the SDK is not touched)."""
+        return os.path.exists(self.service_account)
+
+    @property
+    def app(self):
+        """The initialized firebase_admin App; raises if it cannot be initialized."""
+        if self._app is None:
+            with self._lock:
+                if self._app is None:
+                    import firebase_admin
+                    from firebase_admin import credentials
+                    if not self.configured:
+                        raise FileNotFoundError(
+                            f"Service account file '{self.service_account}' not found in project root.")
+                    try:
+                        self._app = firebase_admin.get_app()
+                    except ValueError:
+                        self._app = firebase_admin.initialize_app(credentials.Certificate(self.service_account))
+                    print("✅ Firebase Admin initialized")
+        return self._app
+
+    @property
+    def auth(self):
+        """firebase_admin.auth, bound to the initialized app."""
+        self.app
+        from firebase_admin import auth
+        return auth
+
+    def firestore_client(self):
+        """The process-wide Firestore client."""
+        if self._firestore is None:
+            from firebase_admin import firestore
+            client = firestore.client(self.app)
+            with self._lock:
+                if self._firestore is None:
+                    self._firestore = client
+        return self._firestore
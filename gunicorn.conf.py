@@ -0,0 +1,66 @@
+# gunicorn.conf.py
+"""Production server settings: `gunicorn -c gunicorn.conf.py wsgi:app`.
+
+Every setting can be overridden from the environment:
+
+  WEB_CONCURRENCY            worker processes (default 1, see below)
+  GUNICORN_WORKER_CLASS      "gthread" (default) or "eventlet"
+  GUNICORN_THREADS           threads per gthread worker (default 8)
+  GUNICORN_KEEPALIVE         seconds an idle keep-alive connection is held (default 5)
+  GUNICORN_TIMEOUT           seconds before a silent worker is restarted (default 120)
+  GUNICORN_GRACEFUL_TIMEOUT  seconds a worker gets to finish on SIGTERM (default 30)
+  GUNICORN_MAX_REQUESTS      recycle a worker after this many requests (default 0, off)
+
+Image decoding and bulk QR rendering already run in per-worker process pools
+(DECODE_WORKERS, QR_RENDER_WORKERS), so one worker with threads uses every
+core for them. Keep WEB_CONCURRENCY at 1 unless stale reads are acceptable.
+The caches below live in each worker, and nothing tells one worker about
+another's writes, so with several workers a user can see:
+
+  counts_mirror  counts missing other workers' scans, up to COUNTS_RECONCILE_SECONDS
+  preview_cache  /preview-record missing their scans, up to PREVIEW_CACHE_TTL
+  record_cache   a record's old subtitle/folder after an edit elsewhere, up to RECORD_CACHE_TTL
+  dedup_index    a code saved twice if another worker saved it first, up to DEDUP_INDEX_TTL
+  write_queue    another worker's scans only after its flush (WRITE_BEHIND_MAX_AGE)
+
+More workers also need SOCKETIO_MESSAGE_QUEUE for live updates, and sticky
+sessions at the proxy.
+"""
+import os
+import sys
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "gthread")
+workers = int(os.getenv("WEB_CONCURRENCY", "1"))
+threads = int(os.getenv("GUNICORN_THREADS", "8"))
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", "5"))
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "120"))
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", "30"))
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", "0"))
+max_requests_jitter = max_requests // 10
+
+# Worker heartbeat files on tmpfs, so a slow disk cannot stall them into timeouts
+worker_tmp_dir = "/dev/shm" if os.path.isdir("/dev/shm") else None
+accesslog = "-"
+errorlog = "-"
+
+# Flask-SocketIO picks eventlet whenever it is installed; pin the mode to the worker type
+os.environ.setdefault("SOCKETIO_ASYNC_MODE", "eventlet" if worker_class == "eventlet" else "threading")
+
+
+def on_starting(server):
+    if workers > 1:
+        server.log.warning("WEB_CONCURRENCY=%s: counts, previews, record lookups and duplicate checks "
+                           "are cached per worker and can be stale across workers", workers)
+    if workers > 1 and not os.getenv("SOCKETIO_MESSAGE_QUEUE"):
+        server.log.warning("WEB_CONCURRENCY=%s without SOCKETIO_MESSAGE_QUEUE: "
+                           "live updates only reach sockets on the same worker", workers)
+
+
+def worker_exit(server, worker):
+    # graceful stop: write out the write-behind queue and stop the process pools.
+    # Also called in the master for killed workers, where the app was never loaded.
+    main = sys.modules.get("main")
+    if main is not None:
+        main.shutdown()
@@ -1,5 +1,8 @@
-from main import app, db
+import os
 
-with app.app_context():
-    db.create_all()
-    print("✅ SQLite DB created.")
+from storage import SQLiteStore
+
+SQLITE_PATH = os.getenv("SQLITE_PATH", "qr_project.db")
+
+SQLiteStore(SQLITE_PATH)
+print(f"✅ SQLite DB created at {SQLITE_PATH}.")
@@ -1,20 +1,35 @@
 # main.py
-from flask import Flask, render_template, request, redirect, url_for, jsonify, session, flash, send_file
+from flask import Flask, Response, render_template, request, redirect, url_for, jsonify, session, flash, send_file, send_from_directory, g, has_request_context
 import os
+import time
+import re
 import json
-from datetime import datetime
-from pyzbar.pyzbar import decode
-import cv2
+import atexit
+import asyncio
+from datetime import datetime, timezone
 from werkzeug.utils import secure_filename
-import qrcode
-import csv
-from io import StringIO, BytesIO
-from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.exceptions import NotFound, RequestEntityTooLarge
+from werkzeug.middleware.proxy_fix import ProxyFix
 from functools import wraps
-import pandas as pd
-from xlsxwriter import Workbook
-import requests
 from dotenv import load_dotenv
+from firebase_app import LazyFirebase
+from auth import AuthError, FirebaseAuth
+from decoder import decode_batch, decode_stats, shutdown_decoder
+from storage import create_store, record_scan_id, NotFoundError
+from async_store import AsyncStore
+from record_cache import RecordCache
+from counts_mirror import CountsMirror
+from preview_cache import PreviewCache, preview_entry
+from events import init_events, emit_to_user
+from dedup_index import DedupIndex
+from qr_cache import QRImageCache
+from bulk_qr import BulkRequestError, FORMATS as BULK_FORMATS, parse_csv_rows, parse_json_rows, parse_options, shutdown_renderer, stream_zip
+from exports import (iter_all_scans, stream_csv, stream_json, stream_ndjson, gzip_stream,
+                     normalize_record_data, content_hash, record_columns, iter_record_rows, record_rows,
+                     record_table, stream_table_csv, write_table_xlsx)
+from write_queue import WriteBehindQueue
+import metrics
+from sessions import create_session_interface
 
 # load .env if present
 load_dotenv()
@@ -29,12 +44,15 @@ API_KEY = os.getenv("FIREBASE_WEB_API_KEY", os.getenv("FIREBASE_API_KEY", "YOUR_
 app = Flask(__name__)
 app.secret_key = os.getenv("SECRET_KEY", "fallback-secret-key")
 
+# Session storage: "sqlite" (default), "memory" or "cookie"; the cookie only holds an id unless "cookie" (see sessions.py)
+SESSION_BACKEND = os.getenv("SESSION_BACKEND", "sqlite").lower()
+SESSION_DB_PATH = os.getenv("SESSION_DB_PATH", "sessions.db")
+SESSION_TTL = float(os.getenv("SESSION_TTL", str(7 * 24 * 3600)))  # seconds since last write
+
 # File upload / folders
 app.config['MAX_CONTENT_LENGTH'] = 10 * 1024 * 1024  # 10MB
 app.config['UPLOAD_FOLDER'] = 'uploads'
 app.config['STATIC_QR_FOLDER'] = os.path.join('static', 'qr')
-os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
-os.makedirs(app.config['STATIC_QR_FOLDER'], exist_ok=True)
 
 # Admin password for protected routes (if used anywhere)
 PROTECTED_PASSWORD = os.getenv("ADMIN_PASSWORD", "fallback-admin")
@@ -43,22 +61,85 @@ PROTECTED_PASSWORD = os.getenv("ADMIN_PASSWORD", "fallback-admin")
 FIRESTORE_WRITE = os.getenv("FIRESTORE_WRITE", "1").lower() in ("1", "true", "yes")
 FIRESTORE_READ = os.getenv("FIRESTORE_READ", "1").lower() in ("1", "true", "yes")
 
+# Storage backend: "firestore" (default), "sqlite" or "memory" (see storage.py)
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "firestore").lower()
+SQLITE_PATH = os.getenv("SQLITE_PATH", "qr_project.db")
+
+# Write-behind queue for scans and scan counts (see write_queue.py)
+WRITE_BEHIND = os.getenv("WRITE_BEHIND", "1").lower() in ("1", "true", "yes")
+WRITE_BEHIND_BATCH = int(os.getenv("WRITE_BEHIND_BATCH", "500"))
+WRITE_BEHIND_MAX_AGE = float(os.getenv("WRITE_BEHIND_MAX_AGE", "0.5"))  # seconds
+
+# Firestore scan counts: shard docs per user (raise only, never lower) and read cache TTL (see counters.py)
+COUNT_SHARDS = int(os.getenv("COUNT_SHARDS", "8"))
+COUNTS_CACHE_TTL = float(os.getenv("COUNTS_CACHE_TTL", "2"))
+# How often the in-process counts mirror re-reads a user's counts to pick up other workers' scans (seconds)
+COUNTS_RECONCILE_SECONDS = float(os.getenv("COUNTS_RECONCILE_SECONDS", "30"))
+
+# How long a cached record title -> id mapping is trusted (seconds)
+RECORD_CACHE_TTL = float(os.getenv("RECORD_CACHE_TTL", "300"))
+
+# How long a cached /preview-record payload is trusted (seconds)
+PREVIEW_CACHE_TTL = float(os.getenv("PREVIEW_CACHE_TTL", "300"))
+
+# Per-user index of already-scanned codes used by the upload routes
+DEDUP_INDEX_USERS = int(os.getenv("DEDUP_INDEX_USERS", "1000"))
+DEDUP_INDEX_TTL = float(os.getenv("DEDUP_INDEX_TTL", "600"))  # seconds before re-loading a user
+
+# Page sizes for /scans and /history
+SCANS_PAGE_SIZE = int(os.getenv("SCANS_PAGE_SIZE", "50"))
+SCANS_PAGE_MAX = 500
+
+# Largest batch /save-scans accepts (one Firestore batch per record)
+SAVE_SCANS_MAX = 200
+
+# Generated QR images, content-addressed and LRU-bounded (see qr_cache.py)
+QR_CACHE_DIR = os.getenv("QR_CACHE_DIR", os.path.join(app.config['STATIC_QR_FOLDER'], "cache"))
+QR_CACHE_MAX_ENTRIES = int(os.getenv("QR_CACHE_MAX_ENTRIES", "5000"))
+QR_CACHE_MAX_BYTES = int(os.getenv("QR_CACHE_MAX_MB", "256")) * 1024 * 1024
+QR_CACHE_MAX_AGE = 365 * 24 * 3600  # cached images never change, so browsers may keep them
+BULK_QR_MAX_ITEMS = int(os.getenv("BULK_QR_MAX_ITEMS", "5000"))
+QR_FILENAME_RE = re.compile(r"[0-9a-f]{32}\.(png|json)")
+
+# Firebase session cookies minted at login (5 minutes to 14 days), how often a verified cookie is
+# re-checked for revocation, and the username -> email cache (see auth.py)
+AUTH_SESSION_DAYS = float(os.getenv("AUTH_SESSION_DAYS", "5"))
+AUTH_REVOCATION_CHECK_SECONDS = float(os.getenv("AUTH_REVOCATION_CHECK_SECONDS", "300"))
+USERNAME_CACHE_TTL = float(os.getenv("USERNAME_CACHE_TTL", "300"))
+
+# Bearer token required by /metrics when set
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+
+# Number of reverse proxies in front of the app whose X-Forwarded-* headers are trusted
+PROXY_HOPS = int(os.getenv("PROXY_HOPS", "0"))
+
 # ---------------------------
-# Initialize Firebase Admin & Firestore
+# Initialize Firebase Admin & storage
 # ---------------------------
-import firebase_admin
-from firebase_admin import credentials, auth, firestore
-try:
-    if not os.path.exists(SERVICE_ACCOUNT):
-        raise FileNotFoundError(f"Service account file '{SERVICE_ACCOUNT}' not found in project root.")
-    cred = credentials.Certificate(SERVICE_ACCOUNT)
-    firebase_admin.initialize_app(cred)
-    firestore_db = firestore.client()
-    print("✅ Firebase Admin initialized")
-except Exception as e:
-    firestore_db = None
-    print(f"❌ Failed to initialize Firebase Admin SDK: {e}")
-    # If Firestore not available, app will still run but many features disabled.
+# The SDK is imported and initialized on first use (see firebase_app.py)
+firebase = LazyFirebase(SERVICE_ACCOUNT)
+
+# Every store call is timed per operation, and counted against the request that made it (see metrics.py);
+# a store method calling another counts once, and new_record_id only makes up an id
+STORE_OP_SECONDS = metrics.histogram("store_op_seconds", "Storage operation latency", ["backend", "op"])
+STORE_OP_ERRORS = metrics.counter("store_op_errors_total", "Storage operations that raised", ["backend", "op"])
+
+def count_store_op():
+    if has_request_context():
+        g.store_ops = g.get("store_ops", 0) + 1
+
+# Process state, built by create_app(): importing main opens no store or session DB and starts no threads
+store = None          # storage backend (see storage.py)
+astore = None         # coroutine reads for the async views (sync store calls on a shared thread pool)
+firebase_auth = None  # sign-in over a pooled connection; session cookies verified locally
+counts_mirror = None  # per-uid scan counts kept current by this process's writes (see counts_mirror.py)
+write_queue = None    # write-behind queue for scans and counts, when WRITE_BEHIND
+record_cache = None   # title -> record id/folder cache for /save-record-scan
+preview_cache = None  # record id -> /preview-record payload, updated as scans are saved
+dedup_index = None    # "seen before?" answers for /upload and /capture-upload without a query per code
+socketio = None       # Socket.IO room per uid for live updates (see events.py)
+
+qr_cache = QRImageCache(QR_CACHE_DIR, max_entries=QR_CACHE_MAX_ENTRIES, max_bytes=QR_CACHE_MAX_BYTES)
 
 # ---------------------------
 # Helpers: session & user profile
@@ -68,60 +149,95 @@ def login_required(f):
     def wrapper(*args, **kwargs):
         if not session.get("authenticated") or not session.get("firebase_uid"):
             return redirect(url_for("login"))
-        return f(*args, **kwargs)
+        # ensure_sync: also wraps async views
+        return app.ensure_sync(f)(*args, **kwargs)
     return wrapper
 
 def get_uid():
     """Return current firebase uid from session (or None)."""
     return session.get("firebase_uid")
 
+def log_in_session(uid, username, email, id_token=None):
+    """Mark the session as logged in, under a new session id when sessions are server-side.
+
+    With an ID token, a Firebase session cookie is minted and kept in the
+    session; check_auth_cookie() then verifies it on every request.
+    """
+    if hasattr(session, "regenerate"):
+        session.regenerate()
+    session["authenticated"] = True
+    session["firebase_uid"] = uid
+    session["username"] = username
+    session["email"] = email
+    if id_token:
+        try:
+            cookie = firebase_auth.mint_session_cookie(id_token)
+            if cookie:
+                session["auth_cookie"] = cookie
+        except Exception as e:
+            print(f"Warning: could not mint session cookie: {e}")
+
+HTTP_SECONDS = metrics.histogram("http_request_seconds", "Request latency by endpoint (until the response is returned)",
+                                 ["endpoint", "method", "status"])
+HTTP_STORE_OPS = metrics.histogram("http_request_store_ops", "Storage operations per request", ["endpoint"],
+                                   buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100))
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    start = g.get("request_start")
+    if start is not None:
+        endpoint = request.endpoint or "unmatched"
+        HTTP_SECONDS.observe(time.perf_counter() - start, endpoint=endpoint, method=request.method,
+                             status=response.status_code)
+        HTTP_STORE_OPS.observe(g.get("store_ops", 0), endpoint=endpoint)
+    return response
+
+@app.before_request
+def check_auth_cookie():
+    """Log out sessions whose Firebase session cookie expired, was revoked or belongs to someone else."""
+    if request.endpoint in ("static", "qr_image"):
+        return  # public, cacheable responses: don't touch the session (it adds Vary: Cookie)
+    cookie = session.get("auth_cookie")
+    if not cookie:
+        return
+    try:
+        uid = firebase_auth.verify_session_cookie(cookie)
+    except Exception as e:
+        print(f"Warning: session cookie not verified: {e}")
+        return  # keys unavailable; keep the session rather than log everyone out
+    if uid != session.get("firebase_uid"):
+        session.clear()
+
 def create_user_profile(uid, username, email):
-    """Create a user profile document in Firestore under users/{uid}/profile."""
+    """Create the user's profile, username mapping and default counts doc."""
     try:
-        if firestore_db is None or not FIRESTORE_WRITE:
+        if not FIRESTORE_WRITE:
             return False
-        profile_ref = firestore_db.collection("users").document(uid).collection("meta").document("profile")
-        profile_ref.set({
-            "username": username,
-            "email": email,
-            "created_at": firestore.SERVER_TIMESTAMP
-        }, merge=True)
-        # Maintain a usernames mapping for quick username->uid lookup
-        # (optional, but useful for your existing username-based flows)
-        firestore_db.collection("usernames").document(username.lower()).set({
-            "uid": uid,
-            "username": username,
-            "email": email,
-            "created_at": firestore.SERVER_TIMESTAMP
-        }, merge=True)
-        # Create default meta counts doc
-        firestore_db.collection("users").document(uid).collection("meta").document("counts").set({}, merge=True)
-        return True
+        return store.create_user_profile(uid, username, email)
     except Exception as e:
         print(f"Warning: create_user_profile failed: {e}")
         return False
 
 def get_profile_by_username(username):
     """Return profile dict by username lookup (using usernames collection)."""
-    if firestore_db is None or not FIRESTORE_READ:
+    if not FIRESTORE_READ:
         return None
     try:
-        doc = firestore_db.collection("usernames").document(username.lower()).get()
-        if doc.exists:
-            data = doc.to_dict()
-            return data
+        return store.get_profile_by_username(username)
     except Exception as e:
         print(f"Warning: get_profile_by_username failed: {e}")
     return None
 
 def get_profile_by_uid(uid):
     """Return profile doc data for a uid."""
-    if firestore_db is None or not FIRESTORE_READ:
+    if not FIRESTORE_READ:
         return None
     try:
-        doc = firestore_db.collection("users").document(uid).collection("meta").document("profile").get()
-        if doc.exists:
-            return doc.to_dict()
+        return store.get_profile_by_uid(uid)
     except Exception as e:
         print(f"Warning: get_profile_by_uid failed: {e}")
     return None
@@ -131,78 +247,136 @@ def get_profile_by_uid(uid):
 # ---------------------------
 def increment_scan_count(uid, scan_type):
     """Increment count for a given scan type in /users/{uid}/meta/counts."""
-    if firestore_db is None or not FIRESTORE_WRITE:
+    if not FIRESTORE_WRITE:
         return
     try:
-        counts_ref = firestore_db.collection("users").document(uid).collection("meta").document("counts")
-        # Atomic increment
-        counts_ref.set({scan_type: firestore.Increment(1)}, merge=True)
+        with counts_mirror.writing(uid):
+            if write_queue is not None:
+                write_queue.enqueue_increment(uid, scan_type)
+            else:
+                store.increment_count(uid, scan_type)
+            counts_mirror.add(uid, {scan_type: 1})
     except Exception as e:
         print(f"Warning: increment_scan_count failed: {e}")
 
+def load_scan_counts(uid):
+    """Counts as stored, plus increments still waiting in the write-behind queue."""
+    counts = store.get_counts(uid)
+    if write_queue is not None:
+        for scan_type, n in write_queue.pending_counts(uid).items():
+            counts[scan_type] = counts.get(scan_type, 0) + n
+    return counts
+
 def get_scan_counts(uid=None):
     """Return counts dict for a user or global aggregated counts fallback."""
     try:
-        if firestore_db is None or not FIRESTORE_READ:
-            return {}
-        if uid:
-            doc = firestore_db.collection("users").document(uid).collection("meta").document("counts").get()
-            if doc.exists:
-                return doc.to_dict()
-            else:
-                return {}
-        else:
+        if not FIRESTORE_READ or not uid:
             return {}
+        # served from the in-process mirror; reads the store only to (re)load it
+        return counts_mirror.get(uid)
     except Exception as e:
         print(f"Warning: get_scan_counts failed: {e}")
         return {}
 
 # ---------------------------
-# Utility: Firestore read/write wrappers
+# Utility: storage read/write wrappers
 # ---------------------------
 def add_scan_to_firestore(uid, data, scan_type, extra=None):
     """Add a scan doc to /users/{uid}/scans"""
-    if firestore_db is None or not FIRESTORE_WRITE or not uid:
+    if not FIRESTORE_WRITE or not uid:
         return None
     try:
         doc = {
             "data": data,
             "type": scan_type,
-            "firebase_uid": uid,
-            "timestamp": firestore.SERVER_TIMESTAMP
+            "firebase_uid": uid
         }
         if extra:
             doc.update(extra)
-        ref = firestore_db.collection("users").document(uid).collection("scans").add(doc)
+        if write_queue is not None:
+            # Persisted by the write-behind queue; no id until it is flushed
+            write_queue.enqueue_scan(uid, doc)
+            scan_id = None
+        else:
+            scan_id = store.add_scan(uid, doc)
+        dedup_index.add(uid, data)
         # increment counts
         increment_scan_count(uid, scan_type)
-        return ref
+        emit_to_user(uid, "scan_saved", dict(doc, timestamp=datetime.now(timezone.utc)))
+        emit_to_user(uid, "counts_changed", {"delta": {scan_type: 1}})
+        return scan_id
     except Exception as e:
         print(f"Warning: add_scan_to_firestore failed: {e}")
         return None
 
+def add_scans_to_firestore(uid, scans, raise_errors=False):
+    """Save [(format, text, extra)] as scans of uid in one batched write.
+
+    Codes uid already has (or that repeat within `scans`) are skipped; returns
+    one bool per scan, True if it was saved. A storage error marks every scan
+    unsaved, or is re-raised with raise_errors.
+    """
+    if not FIRESTORE_WRITE or not uid:
+        return [False] * len(scans)
+    results, docs, seen = [], [], set()
+    try:
+        for scan_type, data, extra in scans:
+            is_new = data not in seen and not (dedup_index.tracks(uid) and scan_already_saved(uid, data))
+            seen.add(data)
+            results.append(is_new)
+            if is_new:
+                docs.append(dict(extra or {}, data=data, type=scan_type, firebase_uid=uid))
+        if not docs:
+            return results
+        counts = {}
+        for doc in docs:
+            counts[doc["type"]] = counts.get(doc["type"], 0) + 1
+        with counts_mirror.writing(uid):
+            if write_queue is not None:
+                for doc in docs:
+                    write_queue.enqueue_scan(uid, doc)
+                for scan_type, n in counts.items():
+                    write_queue.enqueue_increment(uid, scan_type, n)
+            else:
+                store.write_batch([(uid, doc) for doc in docs], {uid: counts})
+            counts_mirror.add(uid, counts)
+    except Exception as e:
+        print(f"Warning: add_scans_to_firestore failed: {e}")
+        if raise_errors:
+            raise
+        return [False] * len(scans)
+    now = datetime.now(timezone.utc)
+    for doc in docs:
+        dedup_index.add(uid, doc["data"])
+        emit_to_user(uid, "scan_saved", dict(doc, timestamp=now))
+    emit_to_user(uid, "counts_changed", {"delta": counts})
+    return results
+
+def scan_already_saved(uid, data):
+    """True if uid already scanned `data` (including scans still queued)."""
+    if write_queue is not None and write_queue.has_pending_scan(uid, data):
+        return True
+    return dedup_index.seen(uid, data)
+
 def add_record_to_firestore(uid, record_obj):
     """Write a record dict to /users/{uid}/records with auto id."""
-    if firestore_db is None or not FIRESTORE_WRITE or not uid:
+    if not FIRESTORE_WRITE or not uid:
         return None
     try:
         # record_obj is expected to be a dict with title, subtitle, code, folder_id (optional)
         record_obj.setdefault("firebase_uid", uid)
-        record_obj.setdefault("created_at", firestore.SERVER_TIMESTAMP)
-        record_obj.setdefault("updated_at", firestore.SERVER_TIMESTAMP)
-        ref = firestore_db.collection("users").document(uid).collection("records").add(record_obj)
-        return ref
+        record_obj.setdefault("scan_count", 0)
+        record_obj.setdefault("keyed_scan_ids", True)  # scans go in under record_scan_id()
+        return store.add_record(uid, record_obj)
     except Exception as e:
         print(f"Warning: add_record_to_firestore failed: {e}")
         return None
 
 def update_record_firestore(uid, record_id, update_fields):
     try:
-        if firestore_db is None or not FIRESTORE_WRITE or not uid:
+        if not FIRESTORE_WRITE or not uid:
             return False
-        doc_ref = firestore_db.collection("users").document(uid).collection("records").document(record_id)
-        update_fields["updated_at"] = firestore.SERVER_TIMESTAMP
-        doc_ref.update(update_fields)
+        store.update_record(uid, record_id, update_fields)
         return True
     except Exception as e:
         print(f"Warning: update_record_firestore failed: {e}")
@@ -210,14 +384,11 @@ def update_record_firestore(uid, record_id, update_fields):
 
 def delete_record_firestore(uid, record_id):
     try:
-        if firestore_db is None or not FIRESTORE_WRITE or not uid:
+        if not FIRESTORE_WRITE or not uid:
             return False
-        # delete record scans that reference record_id
-        scans_q = firestore_db.collection("users").document(uid).collection("record_scans").where("record_id", "==", record_id).stream()
-        for s in scans_q:
-            s.reference.delete()
-        # delete record doc
-        firestore_db.collection("users").document(uid).collection("records").document(record_id).delete()
+        # delete record doc and the record scans that reference record_id
+        store.delete_record(uid, record_id)
+        preview_cache.invalidate(uid, record_id)
         return True
     except Exception as e:
         print(f"Warning: delete_record_firestore failed: {e}")
@@ -226,7 +397,8 @@ def delete_record_firestore(uid, record_id):
 # ---------------------------
 # Old local behaviour that we keep:
 # - Local QR image generation remains local (static/qr)
-# - Uploaded files stored in uploads/ and removed after processing
+# - Camera captures stored in uploads/ and removed after processing;
+#   /upload decodes straight from memory (see decoder.py)
 # ---------------------------
 
 # ---------------------------
@@ -245,8 +417,6 @@ def create():
 
 @app.route("/generate", methods=["POST"])
 def generate():
-    timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
-
     # Determine firebase uid if authenticated
     uid = get_uid()
 
@@ -256,34 +426,24 @@ def generate():
         structured_data = dict(zip(labels, values))
 
         json_data = json.dumps(structured_data, indent=2)
-        json_filename = f"data_{timestamp}.json"
-        json_dir = os.path.join(app.config['STATIC_QR_FOLDER'], "qr_json")
-        os.makedirs(json_dir, exist_ok=True)
-        json_path = os.path.join(json_dir, json_filename)
-        with open(json_path, "w") as f:
-            f.write(json_data)
-
-        qr_filename = f"qr_{timestamp}.png"
-        qr_path = os.path.join(app.config['STATIC_QR_FOLDER'], qr_filename)
-        img = qrcode.make(json_data)
-        img.save(qr_path)
+        json_filename = qr_cache.json_file(json_data)
+        qr_filename = qr_cache.qr_png(json_data)
 
         # Write QR generation metadata to Firestore
         try:
-            if firestore_db is not None and FIRESTORE_WRITE and uid:
-                firestore_db.collection("users").document(uid).collection("qr_generations").add({
+            if FIRESTORE_WRITE and uid:
+                store.add_qr_generation(uid, {
                     "user_id": uid,
                     "data_type": "structured",
                     "qr_data": json_data,
                     "qr_filename": qr_filename,
-                    "json_filename": json_filename,
-                    "generated_at": firestore.SERVER_TIMESTAMP
+                    "json_filename": json_filename
                 })
         except Exception as e:
             print(f"Warning: could not write qr_generation to Firestore: {e}")
 
-        session["qr_path"] = qr_filename
-        session["json_path"] = f"qr_json/{json_filename}"
+        session["qr_path"] = url_for("qr_image", filename=qr_filename)
+        session["json_path"] = url_for("qr_image", filename=json_filename)
         session["qr_data"] = json_data
         session["json_preview"] = json.dumps(structured_data, indent=2)
         return redirect(url_for("create"))
@@ -292,31 +452,102 @@ def generate():
     if not data:
         return redirect(url_for("create"))
 
-    qr_filename = f"qr_{timestamp}.png"
-    qr_path = os.path.join(app.config['STATIC_QR_FOLDER'], qr_filename)
-    img = qrcode.make(data)
-    img.save(qr_path)
+    qr_filename = qr_cache.qr_png(data)
 
     # Write QR generation metadata to Firestore
     try:
-        if firestore_db is not None and FIRESTORE_WRITE and uid:
-            firestore_db.collection("users").document(uid).collection("qr_generations").add({
+        if FIRESTORE_WRITE and uid:
+            store.add_qr_generation(uid, {
                 "user_id": uid,
                 "data_type": "text",
                 "qr_data": data,
                 "qr_filename": qr_filename,
-                "json_filename": None,
-                "generated_at": firestore.SERVER_TIMESTAMP
+                "json_filename": None
             })
     except Exception as e:
         print(f"Warning: could not write qr_generation to Firestore: {e}")
 
-    session["qr_path"] = qr_filename
+    session["qr_path"] = url_for("qr_image", filename=qr_filename)
     session["qr_data"] = data
     session.pop("json_path", None)
     session.pop("json_preview", None)
     return redirect(url_for("create"))
 
+@app.route("/qr/<filename>")
+def qr_image(filename):
+    """Serve a cached QR image (or its JSON); the name is a content hash, so it never changes."""
+    if not QR_FILENAME_RE.fullmatch(filename):
+        return "Not found", 404
+    try:
+        resp = send_from_directory(os.path.abspath(QR_CACHE_DIR), filename, max_age=QR_CACHE_MAX_AGE)
+    except NotFound:
+        return "Not found", 404
+    resp.cache_control.public = True
+    resp.cache_control.immutable = True
+    return resp
+
+@app.route("/api/generate-bulk", methods=["POST"])
+def api_generate_bulk():
+    """Render many QR codes at once and stream them back as a ZIP.
+
+    Accepts a JSON list (or {"items": [...], "format": "png|svg", "options": {...}})
+    of strings, {"text": ...} or {"label[]": [...], "value[]": [...]} items, or a
+    CSV upload (field "file" or a text/csv body) with a text column or one column
+    per label.
+    """
+    uid = get_uid()
+    body = {}
+    try:
+        upload = request.files.get("file")
+        if upload is not None:
+            raw = upload.read().decode("utf-8-sig")
+            if upload.filename.lower().endswith(".json"):
+                body = json.loads(raw)
+                rows = parse_json_rows(body)
+            else:
+                rows = parse_csv_rows(raw)
+        elif request.is_json:
+            body = request.get_json()
+            rows = parse_json_rows(body)
+        elif request.mimetype == "text/csv":
+            rows = parse_csv_rows(request.get_data(as_text=True))
+        else:
+            return jsonify({"success": False, "error": "Send a JSON list or a CSV file"}), 400
+        if not isinstance(body, dict):
+            body = {}
+        fmt = (request.values.get("format") or body.get("format") or "png").lower()
+        if fmt not in BULK_FORMATS:
+            raise BulkRequestError("format must be png or svg")
+        options = parse_options(body.get("options"))
+    except (BulkRequestError, ValueError, UnicodeDecodeError) as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+
+    if not rows:
+        return jsonify({"success": False, "error": "No rows to generate"}), 400
+    if len(rows) > BULK_QR_MAX_ITEMS:
+        return jsonify({"success": False, "error": f"At most {BULK_QR_MAX_ITEMS} codes per request"}), 413
+
+    def log_generations(entries):
+        if not (FIRESTORE_WRITE and uid):
+            return
+        try:
+            store.add_qr_generations(uid, [{
+                "user_id": uid,
+                "data_type": data_type,
+                "qr_data": payload,
+                "qr_filename": filename,
+                "json_filename": None,
+                "bulk": True
+            } for _, payload, data_type, filename in entries])
+        except Exception as e:
+            print(f"Warning: could not write bulk qr_generations to Firestore: {e}")
+
+    return Response(
+        stream_zip(rows, fmt, options, on_rendered=log_generations),
+        mimetype="application/zip",
+        headers={"Content-Disposition": f"attachment; filename=qr_codes_{fmt}.zip"}
+    )
+
 @app.route("/scan")
 def scan():
     return render_template("scan.html")
@@ -337,71 +568,53 @@ def upload():
     new_scans = []
     uid = get_uid()
 
+    # Read every upload into memory; decoding works on the raw bytes
+    payloads = []
     for file in files:
         if file.filename == "":
             continue
+        payloads.append((secure_filename(file.filename), file.read()))
+
+    # Decode phase: all images in parallel
+    results = decode_batch([data for _, data in payloads])
+
+    # Persistence phase
+    for (filename, data), result in zip(payloads, results):
+        codes_found = len(result["codes"])
+        error_message = result["error"]
+        if error_message:
+            print(f"Error processing image {filename}: {error_message}")
+
+        for code in result["codes"]:
+            code_data = code["data"]
+            code_type = code["type"]
+            # Add to scans (avoid duplicates of anything already scanned)
+            is_new = True
+            if uid and FIRESTORE_READ:
+                try:
+                    is_new = not scan_already_saved(uid, code_data)
+                except Exception:
+                    is_new = True
 
-        filename = secure_filename(file.filename)
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(filepath)
-
-        file_size = os.path.getsize(filepath) if os.path.exists(filepath) else 0
-        codes_found = 0
-        success = False
-        error_message = None
+            if is_new:
+                add_scan_to_firestore(uid if uid else "anonymous", code_data, code_type)
+                new_scans.append({"type": code_type, "data": code_data})
 
+        # Track upload attempt in Firestore meta collection (best-effort)
         try:
-            image = cv2.imread(filepath)
-            if image is None:
-                error_message = "Could not process image file"
-                continue
-
-            decoded = decode(image)
-            codes_found = len(decoded)
-
-            for obj in decoded:
-                code_data = obj.data.decode("utf-8")
-                code_type = str(obj.type)
-                # Add to Firestore scans (avoid duplicates by checking latest few)
-                is_new = True
-                if uid and firestore_db is not None and FIRESTORE_READ:
-                    # simple duplicate check: see if same data exists in last 100 scans
-                    try:
-                        recent = firestore_db.collection("users").document(uid).collection("scans").where("data", "==", code_data).limit(1).stream()
-                        if any(recent):
-                            is_new = False
-                    except Exception:
-                        is_new = True
-
-                if is_new:
-                    add_scan_to_firestore(uid if uid else "anonymous", code_data, code_type)
-                    new_scans.append({"type": code_type, "data": code_data})
-
-            success = codes_found > 0
-
+            attempt_doc = {
+                "upload_type": "file_upload",
+                "filename": filename,
+                "file_size": len(data),
+                "success": codes_found > 0,
+                "codes_found": codes_found,
+                "decode_strategy": result.get("strategy"),
+                "error_message": error_message
+            }
+            if uid and FIRESTORE_WRITE:
+                store.add_upload_attempt(uid, attempt_doc)
         except Exception as e:
-            error_message = str(e)
-            print(f"Error processing image {filename}: {e}")
-        finally:
-            # Track upload attempt in Firestore meta collection (best-effort)
-            try:
-                attempt_doc = {
-                    "upload_type": "file_upload",
-                    "filename": filename,
-                    "file_size": file_size,
-                    "success": success,
-                    "codes_found": codes_found,
-                    "error_message": error_message,
-                    "uploaded_at": firestore.SERVER_TIMESTAMP
-                }
-                if uid and firestore_db is not None and FIRESTORE_WRITE:
-                    firestore_db.collection("users").document(uid).collection("upload_attempts").add(attempt_doc)
-            except Exception as e:
-                print(f"Warning: could not save upload attempt to Firestore: {e}")
-
-            # Clean up uploaded file
-            if os.path.exists(filepath):
-                os.remove(filepath)
+            print(f"Warning: could not save upload attempt to Firestore: {e}")
 
     return render_template("upload_result.html", results=new_scans, counts=get_scan_counts(get_uid()))
 
@@ -426,26 +639,102 @@ def save_scan():
         "counts": get_scan_counts(get_uid())
     })
 
+@app.route("/save-scans", methods=["POST"])
+def save_scans():
+    """Save a buffered batch of scans from the live scanners.
+
+    Body: [{format, text, meta_info?, client_ts?}, ...] (or {"scans": [...]}).
+    Items with meta_info are saved as record scans of meta_info.title, the
+    rest as plain scans. Returns a verdict per item, in order.
+    """
+    data = request.get_json(silent=True)
+    items = data.get("scans") if isinstance(data, dict) else data
+    if not isinstance(items, list) or not items:
+        return jsonify({"error": "Expected a non-empty list of scans"}), 400
+    if len(items) > SAVE_SCANS_MAX:
+        return jsonify({"error": f"At most {SAVE_SCANS_MAX} scans per request"}), 413
+
+    uid = get_uid()
+    results = [None] * len(items)
+    plain, by_title = [], {}
+    for i, item in enumerate(items):
+        if not isinstance(item, dict) or not item.get("format") or not item.get("text"):
+            results[i] = {"index": i, "error": "Missing format or text"}
+            continue
+        scan = (str(item["format"]), str(item["text"]),
+                {"client_ts": item["client_ts"]} if item.get("client_ts") is not None else None)
+        meta_info = item.get("meta_info")
+        if not meta_info:
+            plain.append((i, scan))
+        elif not isinstance(meta_info, dict):
+            results[i] = {"index": i, "error": "meta_info must be an object"}
+        elif not uid:
+            results[i] = {"index": i, "error": "User not authenticated"}
+        elif not isinstance(meta_info.get("title"), str) or not meta_info["title"].strip():
+            results[i] = {"index": i, "error": "Title is required in meta_info"}
+        else:
+            title = meta_info["title"].strip()
+            by_title.setdefault(title, (meta_info, []))[1].append((i, scan))
+
+    if plain:
+        try:
+            verdicts = add_scans_to_firestore(uid or "anonymous", [scan for _, scan in plain], raise_errors=True)
+            for (i, _), is_new in zip(plain, verdicts):
+                results[i] = {"index": i, "new": is_new}
+        except Exception as e:
+            # not saved: an error verdict lets the scanner retry instead of treating it as a duplicate
+            for i, _ in plain:
+                results[i] = {"index": i, "error": str(e)}
+    for title, (meta_info, entries) in by_title.items():
+        try:
+            verdicts = save_scans_to_record(uid, meta_info, [scan for _, scan in entries])
+            for (i, _), is_new in zip(entries, verdicts):
+                results[i] = {"index": i, "new": is_new}
+        except Exception as e:
+            print(f"❌ Error saving record scans for '{title}': {e}")
+            for i, _ in entries:
+                results[i] = {"index": i, "error": str(e)}
+
+    return jsonify({"results": results, "counts": get_scan_counts(uid)})
+
+def get_scan_page(uid):
+    """Return (scans, next_cursor) for the ?cursor=, ?limit= and ?type= args."""
+    try:
+        limit = int(request.args.get("limit", SCANS_PAGE_SIZE))
+    except ValueError:
+        limit = SCANS_PAGE_SIZE
+    limit = max(1, min(limit, SCANS_PAGE_MAX))
+    docs, next_cursor = store.list_scans(
+        uid,
+        limit=limit,
+        cursor=request.args.get("cursor") or None,
+        scan_type=request.args.get("type") or None
+    )
+    for doc in docs:
+        # normalized timestamp
+        t = doc.get("timestamp")
+        if hasattr(t, "isoformat"):
+            doc["timestamp"] = t.isoformat()
+    return docs, next_cursor
+
 @app.route("/scans")
 def scans():
     try:
         uid = get_uid()
-        if FIRESTORE_READ and firestore_db is not None and uid:
-            docs = firestore_db.collection("users").document(uid).collection("scans").order_by("timestamp", direction=firestore.Query.DESCENDING).stream()
-            scan_list = []
-            for d in docs:
-                dd = d.to_dict()
-                # normalized timestamp
-                t = dd.get("timestamp")
-                if hasattr(t, "isoformat"):
-                    dd["timestamp"] = t.isoformat()
-                scan_list.append(dd)
-            return jsonify(scan_list)
+        if FIRESTORE_READ and uid:
+            scan_list, next_cursor = get_scan_page(uid)
+            return jsonify({
+                "scans": scan_list,
+                "next_cursor": next_cursor,
+                "counts": get_scan_counts(uid)
+            })
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         print(f"Warning: could not read scans from Firestore: {e}")
 
     # fallback: return empty or previous local caching behavior (none)
-    return jsonify([])
+    return jsonify({"scans": [], "next_cursor": None, "counts": {}})
 
 @app.route("/camera")
 def camera():
@@ -466,28 +755,29 @@ def capture_upload():
     codes_found = 0
     success = False
     error_message = None
+    decode_strategy = None
     new_scans = []
 
     try:
-        image = cv2.imread(filepath)
-        if image is None:
+        with open(filepath, "rb") as f:
+            result, = decode_batch([f.read()])
+        if result["error"]:
             error_message = "Snapshot could not be processed"
             return render_template("upload_result.html", results=[], counts={},
                                    error="❌ Snapshot could not be processed.")
 
-        decoded = decode(image)
+        decoded = result["codes"]
+        decode_strategy = result["strategy"]
         codes_found = len(decoded)
 
         for obj in decoded:
-            code_data = obj.data.decode("utf-8")
-            code_type = str(obj.type)
+            code_data = obj["data"]
+            code_type = obj["type"]
             # duplicate check
             is_new = True
-            if uid and firestore_db is not None and FIRESTORE_READ:
+            if uid and FIRESTORE_READ:
                 try:
-                    recent = firestore_db.collection("users").document(uid).collection("scans").where("data", "==", code_data).limit(1).stream()
-                    if any(recent):
-                        is_new = False
+                    is_new = not scan_already_saved(uid, code_data)
                 except Exception:
                     is_new = True
 
@@ -516,11 +806,11 @@ def capture_upload():
                 "file_size": file_size,
                 "success": success,
                 "codes_found": codes_found,
-                "error_message": error_message,
-                "uploaded_at": firestore.SERVER_TIMESTAMP
+                "decode_strategy": decode_strategy,
+                "error_message": error_message
             }
-            if uid and firestore_db is not None and FIRESTORE_WRITE:
-                firestore_db.collection("users").document(uid).collection("upload_attempts").add(attempt_doc)
+            if uid and FIRESTORE_WRITE:
+                store.add_upload_attempt(uid, attempt_doc)
         except Exception as e:
             print(f"Warning: could not save capture attempt to Firestore: {e}")
 
@@ -536,92 +826,80 @@ def capture_upload():
 def history():
     try:
         uid = get_uid()
-        if FIRESTORE_READ and firestore_db is not None and uid:
-            docs = firestore_db.collection("users").document(uid).collection("scans").order_by("timestamp", direction=firestore.Query.DESCENDING).stream()
-            scan_list = []
-            types = set()
-            for d in docs:
-                doc = d.to_dict()
-                types.add(doc.get("type"))
-                # normalize timestamp
-                t = doc.get("timestamp")
-                doc["timestamp"] = t.isoformat() if hasattr(t, "isoformat") else t
-                scan_list.append(doc)
-            return render_template("history.html", scans=scan_list, types=sorted(types))
+        if FIRESTORE_READ and uid:
+            scan_list, next_cursor = get_scan_page(uid)
+            # distinct types come from the counts doc, not from reading every scan
+            types = sorted(t for t, n in get_scan_counts(uid).items() if n)
+            return render_template("history.html", scans=scan_list, types=types,
+                                   selected_type=request.args.get("type", ""), next_cursor=next_cursor)
+    except ValueError:
+        # bad cursor: start again from the first page
+        return redirect(url_for("history", type=request.args.get("type") or None))
     except Exception as e:
         print(f"Warning: could not read scans from Firestore: {e}")
 
     # fallback empty
-    return render_template("history.html", scans=[], types=[])
-
-@app.route("/export/json")
-def export_json():
+    return render_template("history.html", scans=[], types=[], selected_type="", next_cursor=None)
+
+def export_scans(uid):
+    """Every scan of uid for the export routes, read page by page.
+
+    The first page is read before the response starts, so failing there
+    still gives an empty export. A failure on a later page is raised
+    mid-stream and aborts the response, rather than closing a truncated
+    file as if it were complete.
+    """
+    if not (FIRESTORE_READ and uid):
+        return iter(())
+    scans = iter_all_scans(store, uid)
     try:
-        uid = get_uid()
-        if FIRESTORE_READ and firestore_db is not None and uid:
-            docs = firestore_db.collection("users").document(uid).collection("scans").stream()
-            scans = [d.to_dict() for d in docs]
-            data = {"scans": scans, "counts": get_scan_counts(uid)}
-            return jsonify(data)
+        first = next(scans, None)
     except Exception as e:
         print(f"Warning: could not export scans from Firestore: {e}")
+        return iter(())
+    if first is None:
+        return iter(())
+    return _export_rest(first, scans)
+
+def _export_rest(first, scans):
+    yield first
+    try:
+        yield from scans
+    except Exception as e:
+        print(f"Error: scan export aborted partway: {e}")
+        raise
+
+def export_response(chunks, mimetype, download_name=None):
+    """Stream an export; gzip it when the client accepts it (?gzip=0 opts out)."""
+    headers = {"Vary": "Accept-Encoding", "X-Accel-Buffering": "no"}
+    if download_name:
+        headers["Content-Disposition"] = f"attachment; filename={download_name}"
+    if request.args.get("gzip", "1") != "0" and "gzip" in request.headers.get("Accept-Encoding", ""):
+        chunks = gzip_stream(chunks)
+        headers["Content-Encoding"] = "gzip"
+    return Response(chunks, mimetype=mimetype, headers=headers)
 
-    return jsonify({"scans": [], "counts": {}})
+@app.route("/export/json")
+def export_json():
+    uid = get_uid()
+    counts = get_scan_counts(uid) if uid else {}
+    return export_response(stream_json(export_scans(uid), counts), "application/json")
 
 @app.route("/download/csv")
 def download_csv():
-    try:
-        uid = get_uid()
-        if FIRESTORE_READ and firestore_db is not None and uid:
-            docs = firestore_db.collection("users").document(uid).collection("scans").order_by("timestamp", direction=firestore.Query.DESCENDING).stream()
-            scans = [d.to_dict() for d in docs]
-        else:
-            scans = []
-    except Exception as e:
-        print(f"Warning: could not read scans for CSV from Firestore: {e}")
-        scans = []
-
-    output = StringIO()
-    writer = csv.writer(output)
-    writer.writerow(["Type", "Data", "Scanned At", "User ID"])
-
-    for scan in scans:
-        scanned_at = scan.get("timestamp")
-        if hasattr(scanned_at, "isoformat"):
-            scanned_at = scanned_at.isoformat()
-        writer.writerow([scan.get("type"), scan.get("data"), scanned_at or "", scan.get("firebase_uid") or ""])
-
-    output.seek(0)
-    return send_file(
-        BytesIO(output.getvalue().encode('utf-8')),
-        mimetype='text/csv',
-        as_attachment=True,
-        download_name='scan_history.csv'
-    )
+    return export_response(stream_csv(export_scans(get_uid())), "text/csv", "scan_history.csv")
 
 @app.route("/download/json")
 def download_json():
-    try:
-        uid = get_uid()
-        if FIRESTORE_READ and firestore_db is not None and uid:
-            docs = firestore_db.collection("users").document(uid).collection("scans").stream()
-            scans = [d.to_dict() for d in docs]
-            data = {"scans": scans, "counts": get_scan_counts(uid)}
-            return send_file(
-                BytesIO(json.dumps(data, indent=4).encode('utf-8')),
-                mimetype='application/json',
-                as_attachment=True,
-                download_name='scan_history.json'
-            )
-    except Exception as e:
-        print(f"Warning: could not create JSON from Firestore: {e}")
+    uid = get_uid()
+    counts = get_scan_counts(uid) if uid else {}
+    return export_response(stream_json(export_scans(uid), counts, indent=4),
+                           "application/json", "scan_history.json")
 
-    return send_file(
-        BytesIO(json.dumps({"scans": [], "counts": {}}, indent=4).encode('utf-8')),
-        mimetype='application/json',
-        as_attachment=True,
-        download_name='scan_history.json'
-    )
+@app.route("/download/ndjson")
+def download_ndjson():
+    return export_response(stream_ndjson(export_scans(get_uid())),
+                           "application/x-ndjson", "scan_history.ndjson")
 
 @app.errorhandler(RequestEntityTooLarge)
 def handle_large_file(e):
@@ -643,24 +921,25 @@ def signup():
 
         # Check if username already exists (usernames collection)
         try:
-            if firestore_db is not None and FIRESTORE_READ:
-                existing = firestore_db.collection("usernames").document(username.lower()).get()
-                if existing.exists:
+            if FIRESTORE_READ:
+                if store.get_profile_by_username(username):
                     return render_template("signup.html", error="Username already exists.")
         except Exception as e:
             print(f"Warning: username uniqueness check failed: {e}")
 
         try:
             # Create Firebase Auth user using Admin SDK
-            firebase_user = auth.create_user(email=email, password=password, display_name=username)
+            firebase_user = firebase.auth.create_user(email=email, password=password, display_name=username)
             uid = firebase_user.uid
             # Create profile in Firestore
             created = create_user_profile(uid, username, email)
-            # Set session
-            session["authenticated"] = True
-            session["firebase_uid"] = uid
-            session["username"] = username
-            session["email"] = email
+            # Set session; signing in once gets the ID token for the session cookie
+            id_token = None
+            try:
+                id_token = firebase_auth.sign_in(email, password).get("idToken")
+            except Exception as e:
+                print(f"Warning: sign-in after signup failed: {e}")
+            log_in_session(uid, username, email, id_token)
             flash("✅ Signup successful! You are now logged in.")
             return redirect(url_for("record_builder"))
         except Exception as e:
@@ -680,33 +959,23 @@ def login():
         if not username or not password:
             return render_template("login.html", error="Username and password required.")
 
-        # First, look up email by username using user mapping
-        profile = get_profile_by_username(username)
-        if not profile:
-            return render_template("login.html", error="Invalid username or password.")
-
-        email = profile.get("email")
+        # First, look up email by username using user mapping (cached)
+        email = None
+        if FIRESTORE_READ:
+            try:
+                email = firebase_auth.email_for_username(username)
+            except Exception as e:
+                print(f"Warning: get_profile_by_username failed: {e}")
         if not email:
             return render_template("login.html", error="Invalid username or password.")
 
         try:
-            url = f"https://identitytoolkit.googleapis.com/v1/accounts:signInWithPassword?key={API_KEY}"
-            payload = {"email": email, "password": password, "returnSecureToken": True}
-            resp = requests.post(url, json=payload, timeout=10)
-            if resp.status_code == 200:
-                data = resp.json()
-                uid = data.get("localId")
-                id_token = data.get("idToken")
-                session["authenticated"] = True
-                session["firebase_uid"] = uid
-                session["username"] = username
-                session["email"] = email
-                # (Optional) store idToken short-lived if needed: session["idToken"] = id_token
-                flash("✅ Login successful!")
-                return redirect(url_for("history"))
-            else:
-                err = resp.json().get("error", {}).get("message", "Login failed.")
-                return render_template("login.html", error=f"❌ {err}")
+            data = firebase_auth.sign_in(email, password)
+            log_in_session(data.get("localId"), username, email, data.get("idToken"))
+            flash("✅ Login successful!")
+            return redirect(url_for("history"))
+        except AuthError as e:
+            return render_template("login.html", error=f"❌ {e}")
         except Exception as e:
             print(f"Warning: Firebase login request failed: {e}")
             return render_template("login.html", error="❌ Login failed; try again later.")
@@ -729,23 +998,17 @@ def clear_history():
         return redirect(url_for("login"))
 
     try:
-        # Delete all scans subcollection docs
-        scans_col = firestore_db.collection("users").document(uid).collection("scans")
-        # batch delete
-        docs = scans_col.stream()
-        batch = firestore_db.batch()
-        count = 0
-        for d in docs:
-            batch.delete(d.reference)
-            count += 1
-            if count == 500:
-                batch.commit()
-                batch = firestore_db.batch()
-                count = 0
-        if count > 0:
-            batch.commit()
+        # Write out queued scans first so none survive the clear
+        if write_queue is not None:
+            write_queue.flush()
+        # Delete all scans subcollection docs (batched)
+        store.clear_scans(uid)
+        dedup_index.clear(uid)
         # Reset counts doc
-        firestore_db.collection("users").document(uid).collection("meta").document("counts").set({}, merge=True)
+        with counts_mirror.writing(uid):
+            store.reset_counts(uid)
+            counts_mirror.reset(uid)
+        emit_to_user(uid, "counts_changed", {"reset": True})
         flash("✅ Scan history cleared successfully!")
     except Exception as e:
         print(f"Error clearing history in Firestore: {e}")
@@ -760,9 +1023,162 @@ def clear_history():
 def record_builder():
     return render_template("record-builder.html")
 
+_NOT_FETCHED = object()
+
+def _record_entry(record_id, record_data):
+    return {
+        "id": record_id,
+        "subtitle": record_data.get("subtitle", ""),
+        "folder_id": record_data.get("folder_id"),
+        "folder_name": record_data.get("folder_name"),
+        # records from before record_scan_id() may hold scans under random ids
+        "legacy": not record_data.get("keyed_scan_ids")
+    }
+
+def find_legacy_duplicates(uid, record_id, scan_docs):
+    """Indexes of scan_docs already saved in a legacy record under a random id."""
+    return {i for i, doc in enumerate(scan_docs) if store.record_scan_exists(uid, record_id, doc["data"])}
+
+def lookup_record_entry(uid, title):
+    """Cached record entry for a title, or None if there is no such record."""
+    entry = record_cache.get(uid, title)
+    if entry is None:
+        record_id, record_data = store.find_record(uid, title)
+        if record_id:
+            entry = _record_entry(record_id, record_data)
+    return entry
+
+async def prefetch_record_lookup(uid, meta_info):
+    """(entry, folder) for save_scans_to_record, read concurrently.
+
+    On a cache miss the record lookup and the folder lookup (only needed if
+    the record turns out to be new) go out together.
+    """
+    title = meta_info.get("title", "").strip()
+    entry = record_cache.get(uid, title)
+    if entry is not None:
+        return entry, _NOT_FETCHED
+    (record_id, record_data), folder = await asyncio.gather(
+        astore.find_record(uid, title),
+        astore.get_folder(uid, meta_info.get("folder_id") or None)
+    )
+    return (_record_entry(record_id, record_data) if record_id else None), folder
+
+def save_scans_to_record(uid, meta_info, scans, prefetched=None):
+    """Save [(format, text, extra)] as record scans of meta_info["title"] in one write.
+
+    The record is resolved through the title cache (and created in the same
+    write if it doesn't exist); `prefetched` is prefetch_record_lookup()'s
+    result. Returns one bool per scan, False for duplicates.
+    """
+    title = meta_info.get("title", "").strip()
+    subtitle = meta_info.get("subtitle", "").strip()
+    code = meta_info.get("code", "").strip()
+    folder_id = meta_info.get("folder_id") or None
+
+    # ---- Resolve record (cached title -> record id) and save in one write ----
+    for attempt in range(2):
+        if prefetched is not None and not attempt:
+            entry, folder = prefetched
+        else:
+            entry, folder = lookup_record_entry(uid, title), _NOT_FETCHED
+
+        new_record = entry is None
+        if new_record:
+            # Create new record as part of the same write
+            record_id = store.new_record_id(uid)
+            record_fields = {
+                "user_id": uid,
+                "title": title,
+                "subtitle": subtitle,
+                "code": code,
+                "folder_id": folder_id,
+                "folder_name": None,
+                "keyed_scan_ids": True
+            }
+            # Resolve folder name
+            if folder_id:
+                if folder is _NOT_FETCHED:
+                    folder = store.get_folder(uid, folder_id)
+                if folder:
+                    record_fields["folder_name"] = folder.get("name")
+        else:
+            record_id = entry["id"]
+            record_fields = {
+                "subtitle": subtitle or entry.get("subtitle", ""),
+                "folder_id": folder_id or entry.get("folder_id"),
+                "folder_name": entry.get("folder_name") or None
+            }
+
+        scan_docs, columns = [], set()
+        for fmt, text, extra in scans:
+            # export schema and dedup key, kept up to date as scans are written
+            row = normalize_record_data(text)
+            columns.update(row)
+            scan_docs.append(dict(extra or {}, record_id=record_id, data=text, type=fmt, user_id=uid,
+                                  content_hash=content_hash(row)))
+        try:
+            # Legacy records: the deterministic ids can't see older scans, so query for them first
+            legacy_dupes = find_legacy_duplicates(uid, record_id, scan_docs) if entry and entry.get("legacy") else set()
+            to_save = [doc for i, doc in enumerate(scan_docs) if i not in legacy_dupes]
+            counts_delta = {}
+            with counts_mirror.writing(uid):
+                # Dedup, scans, record metadata and scan counts in one batched write
+                if not to_save:
+                    saved = []
+                elif len(to_save) == 1:
+                    saved = [store.save_record_scan(uid, record_id, to_save[0], record_fields,
+                                                    new_record=new_record, columns=columns)]
+                else:
+                    saved = store.save_record_scans(uid, record_id, to_save, record_fields,
+                                                    new_record=new_record, columns=columns)
+                for doc, is_new in zip(to_save, saved):
+                    if is_new:
+                        counts_delta[doc["type"]] = counts_delta.get(doc["type"], 0) + 1
+                if counts_delta:
+                    counts_mirror.add(uid, counts_delta)
+            saved = iter(saved)
+            results = [False if i in legacy_dupes else next(saved) for i in range(len(scan_docs))]
+            break
+        except NotFoundError:
+            # Cached record was deleted elsewhere; look it up again
+            record_cache.invalidate(uid, title)
+            if attempt:
+                raise
+
+    if new_record and not any(results):
+        return results
+    record_cache.put(uid, title, {
+        "id": record_id,
+        "subtitle": record_fields["subtitle"],
+        "folder_id": record_fields["folder_id"],
+        "folder_name": record_fields["folder_name"],
+        "legacy": bool(entry and entry.get("legacy"))
+    })
+
+    now = datetime.now(timezone.utc)
+    for doc, is_new in zip(scan_docs, results):
+        if not is_new:
+            continue
+        saved_scan = dict(doc, id=record_scan_id(record_id, doc["data"]), scanned_at=now)
+        preview_key, preview = preview_entry(saved_scan)
+        emit_to_user(uid, "record_updated", {
+            "action": "created" if new_record else "scan_added",
+            "record_id": record_id,
+            "title": title,
+            "scan_count_delta": 1,
+            "preview_key": preview_key,
+            "preview": preview,
+            "preview_version": preview_cache.add_scan(uid, record_id, saved_scan)
+        })
+        new_record = False
+    if counts_delta:
+        emit_to_user(uid, "counts_changed", {"delta": counts_delta})
+    return results
+
 @app.route("/save-record-scan", methods=["POST"])
 @login_required
-def save_record_scan():
+async def save_record_scan():
     try:
         data = request.get_json(force=True)
         fmt = data.get("format")
@@ -772,87 +1188,24 @@ def save_record_scan():
         if not fmt or not text or not meta_info:
             return jsonify({"error": "Missing format, text, or meta_info"}), 400
 
-        title = meta_info.get("title", "").strip()
-        subtitle = meta_info.get("subtitle", "").strip()
-        code = meta_info.get("code", "").strip()
-        folder_id = meta_info.get("folder_id") or None
-
-        if not title:
+        if not meta_info.get("title", "").strip():
             return jsonify({"error": "Title is required in meta_info"}), 400
 
         uid = get_uid()
         if not uid:
             return jsonify({"error": "User not authenticated"}), 401
 
-        user_doc = firestore_db.collection("users").document(uid)
-
-        # ---- Look up or create record ----
-        records_col = user_doc.collection("records")
-        q = records_col.where("title", "==", title).limit(1).stream()
-        rec_docs = list(q)
-
-        if rec_docs:
-            rec_doc = rec_docs[0]
-            record_id = rec_doc.id
-            record_data = rec_doc.to_dict()
-        else:
-            # Create new record
-            record_doc = {
-                "user_id": uid,
-                "title": title,
-                "subtitle": subtitle,
-                "code": code,
-                "folder_id": folder_id,
-                "folder_name": None,
-                "created_at": firestore.SERVER_TIMESTAMP,
-                "updated_at": firestore.SERVER_TIMESTAMP
-            }
-
-            # Resolve folder name
-            if folder_id:
-                folder_ref = user_doc.collection("folders").document(folder_id)
-                folder_doc = folder_ref.get()
-                if folder_doc.exists:
-                    record_doc["folder_name"] = folder_doc.to_dict().get("name")
-
-            new_ref = records_col.add(record_doc)
-            record_id = new_ref[1].id
-            record_data = record_doc
-
-        # ---- Prevent duplicate scans ----
-        rec_scans_col = user_doc.collection("record_scans")
-        duplicates = rec_scans_col.where("record_id", "==", record_id).where("data", "==", text).limit(1).stream()
-        if any(duplicates):
+        prefetched = await prefetch_record_lookup(uid, meta_info)
+        is_new, = save_scans_to_record(uid, meta_info, [(fmt, text, None)], prefetched=prefetched)
+        if not is_new:
             return jsonify({"new": False, "message": "Duplicate scan."})
 
-        # ---- Save scan ----
-        new_scan_doc = {
-            "record_id": record_id,
-            "data": text,
-            "type": fmt,
-            "scanned_at": firestore.SERVER_TIMESTAMP,
-            "user_id": uid
-        }
-        rec_scans_col.add(new_scan_doc)
-
-        # ---- Update record metadata ----
-        records_col.document(record_id).update({
-            "updated_at": firestore.SERVER_TIMESTAMP,
-            "subtitle": subtitle or record_data.get("subtitle", ""),
-            "folder_id": folder_id or record_data.get("folder_id"),
-            "folder_name": record_data.get("folder_name") or None
-        })
-
-        # ---- Increment scan statistics ----
-        increment_scan_count(uid, fmt)
-
         return jsonify({"new": True, "message": "Scan saved."})
 
     except Exception as e:
         print("❌ Error saving record scan:", e)
         return jsonify({"error": f"Exception: {str(e)}"}), 500
 
-
 @app.route("/record-camera")
 @login_required
 def record_camera():
@@ -871,40 +1224,23 @@ def preview_record():
 
     try:
         # Find record by title
-        docs = firestore_db.collection("users").document(uid).collection("records").where("title", "==", title).stream()
-        rec_docs = list(docs)
-        if not rec_docs:
+        entry = record_cache.get(uid, title)
+        rec_id = entry["id"] if entry else store.find_record(uid, title)[0]
+        if not rec_id:
             return jsonify({"record": {}})
-        rec = rec_docs[0].to_dict()
-        rec_id = rec_docs[0].id
-
-        scans_docs = firestore_db.collection("users").document(uid).collection("record_scans").where("record_id", "==", rec_id).stream()
-        record_data = {}
-        label_keys = ["name", "full_name", "title", "username"]
-        for sd in scans_docs:
-            s_dict = sd.to_dict()
-            raw_data = s_dict.get("data", "")
-            cleaned_data = raw_data
-            label = "unknown"
-            try:
-                parsed = json.loads(raw_data)
-                if isinstance(parsed, dict):
-                    cleaned_data = json.dumps(parsed, separators=(",", ":"))
-                    for key_option in label_keys:
-                        if key_option in parsed and parsed[key_option].strip():
-                            label = parsed[key_option].strip().lower()
-                            break
-            except:
-                if raw_data.strip().lower().startswith("http"):
-                    label = "link"
-            key = f"{s_dict.get('type')}:{label}"
-            record_data[key] = {
-                "data": cleaned_data,
-                "id": sd.id,
-                "scanned_at": s_dict.get("scanned_at"),
-                "type": s_dict.get("type")
-            }
-        return jsonify(record_data)
+
+        # Clients poll after every scan: answer unchanged previews with 304,
+        # and ?since=<version> with only the entries added since then.
+        version, record_data = preview_cache.get(uid, rec_id, since=request.args.get("since"))
+        if request.if_none_match.contains(version):
+            resp = Response(status=304)
+        else:
+            resp = jsonify(record_data)
+        resp.set_etag(version)
+        resp.headers["X-Preview-Version"] = version
+        resp.cache_control.private = True
+        resp.cache_control.no_cache = True
+        return resp
     except Exception as e:
         print(f"Warning: preview_record failed: {e}")
         return jsonify({"record": {}})
@@ -947,24 +1283,20 @@ def record_dashboard():
     record_list = []
     folder_list = []
     try:
-        if FIRESTORE_READ and firestore_db is not None and uid:
+        if FIRESTORE_READ and uid:
             # Fetch records
-            records = firestore_db.collection("users").document(uid).collection("records").stream()
-            for r in records:
-                rd = r.to_dict()
+            for rd in store.list_records(uid):
                 record_list.append({
                     "title": rd.get("title"),
                     "subtitle": rd.get("subtitle"),
-                    "count": rd.get("count", 0),  # optional stored count
+                    "count": rd.get("scan_count", rd.get("count", 0)),
                     "folder": rd.get("folder", "Uncategorized"),
                     "folder_id": rd.get("folder_id"),
                     "last_modified": rd.get("updated_at"),
                     "modified": rd.get("updated_at")
                 })
             # Fetch folders
-            folders = firestore_db.collection("users").document(uid).collection("folders").stream()
-            for f in folders:
-                folder_list.append(f.to_dict())
+            folder_list.extend(store.list_folders(uid))
             return render_template("record-dashboard.html", records=record_list, folders=folder_list)
     except Exception as e:
         print(f"Warning: could not read records from Firestore: {e}")
@@ -982,12 +1314,12 @@ def delete_record():
 
     try:
         # Find record by title
-        docs = firestore_db.collection("users").document(uid).collection("records").where("title", "==", title).stream()
-        recs = list(docs)
-        if recs:
-            rec_id = recs[0].id
+        rec_id, _ = store.find_record(uid, title)
+        if rec_id:
             # delete record doc and its record_scans
             delete_record_firestore(uid, rec_id)
+            record_cache.invalidate(uid, title)
+            emit_to_user(uid, "record_updated", {"action": "deleted", "record_id": rec_id, "title": title})
             flash(f"✅ Record '{title}' deleted successfully!")
     except Exception as e:
         print(f"Warning: could not delete record: {e}")
@@ -1014,18 +1346,15 @@ def update_subtitle():
             return jsonify({"success": False, "error": "Missing title"}), 400
 
         # Find the record by title
-        records_ref = firestore_db.collection("users").document(uid).collection("records")
-        docs = records_ref.where("title", "==", title).limit(1).stream()
-        docs_l = list(docs)
+        rec_id, _ = store.find_record(uid, title)
 
-        if not docs_l:
+        if not rec_id:
             return jsonify({"success": False, "error": f"Record '{title}' not found"}), 404
 
-        rec_id = docs_l[0].id
-        records_ref.document(rec_id).update({
-            "subtitle": new_subtitle,
-            "updated_at": firestore.SERVER_TIMESTAMP
-        })
+        store.update_record(uid, rec_id, {"subtitle": new_subtitle})
+        record_cache.invalidate(uid, title)
+        emit_to_user(uid, "record_updated", {"action": "updated", "record_id": rec_id, "title": title,
+                                             "subtitle": new_subtitle})
 
         print(f"✅ Subtitle updated for '{title}' → '{new_subtitle}'")
 
@@ -1058,73 +1387,31 @@ def download_record():
         return "Missing title", 400
 
     try:
-        rec_docs = firestore_db.collection("users").document(uid).collection("records").where("title", "==", title).stream()
-        rec_list = list(rec_docs)
-        if not rec_list:
+        rec_id, rec = store.find_record(uid, title)
+        if not rec_id:
             return f"Record '{title}' not found", 404
-        rec_doc = rec_list[0]
-        rec = rec_doc.to_dict()
-        rec_id = rec_doc.id
-        scans_docs = firestore_db.collection("users").document(uid).collection("record_scans").where("record_id", "==", rec_id).order_by("scanned_at", direction=firestore.Query.DESCENDING).stream()
-        scans = [d.to_dict() for d in scans_docs]
+        scans = store.iter_record_scans(uid, rec_id, ordered=True)
+        if rec.get("columns_complete"):
+            # column set maintained on write: stream rows in one pass
+            columns = record_columns(rec.get("columns") or ())
+            rows = iter_record_rows(scans)
+        else:
+            # record saved before the column index; read it all once and backfill
+            rows, keys, columns = record_rows(scans)
+            try:
+                store.index_record_columns(uid, rec_id, keys)
+            except Exception as e:
+                print(f"Warning: could not backfill record columns: {e}")
     except Exception as e:
         print(f"Warning: could not read record from Firestore: {e}")
-        scans = []
-
-    # build rows dedup logic similar to old code
-    seen = set()
-    rows = []
-    all_keys = set(["id", "scanned at"])
-
-    for scan in scans:
-        row = {}
-        raw = scan.get("data")
-        try:
-            parsed = json.loads(raw) if isinstance(raw, str) else raw
-            if isinstance(parsed, dict):
-                row = {k.strip().lower(): str(v).strip().lower() for k, v in parsed.items()}
-            else:
-                row = {"data": str(raw).strip().lower()}
-        except Exception:
-            row = {"data": str(raw).strip().lower()}
-
-        identity_key = tuple(sorted(row.items()))
-        if identity_key in seen:
-            continue
-        seen.add(identity_key)
-
-        row["id"] = scan.get("id", "")
-        scanned_at = scan.get("scanned_at")
-        if hasattr(scanned_at, "isoformat"):
-            row["scanned at"] = scanned_at.isoformat()
-        else:
-            row["scanned_at"] = scanned_at
-        all_keys.update(row.keys())
-        rows.append(row)
-
-    sorted_keys = sorted(all_keys)
+        rows, columns = [], record_columns(())
 
     if format == "csv":
-        output = StringIO()
-        writer = csv.DictWriter(output, fieldnames=sorted_keys)
-        writer.writeheader()
-        for row in rows:
-            writer.writerow({k: row.get(k, "") for k in sorted_keys})
-        output.seek(0)
-        return send_file(
-            BytesIO(output.getvalue().encode("utf-8")),
-            mimetype="text/csv",
-            as_attachment=True,
-            download_name=f"{secure_filename(title)}.csv"
-        )
+        return export_response(stream_table_csv(record_table(rows, columns)), "text/csv",
+                               download_name=f"{secure_filename(title)}.csv")
     elif format == "excel":
-        df = pd.DataFrame([{k: row.get(k, "") for k in sorted_keys} for row in rows])
-        output = BytesIO()
-        with pd.ExcelWriter(output, engine="xlsxwriter") as writer:
-            df.to_excel(writer, index=False, sheet_name="Record")
-        output.seek(0)
         return send_file(
-            output,
+            write_table_xlsx(record_table(rows, columns)),
             mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
             as_attachment=True,
             download_name=f"{secure_filename(title)}.xlsx"
@@ -1146,19 +1433,18 @@ def create_folder():
             return jsonify({"error": "Folder name is required"}), 400
 
         # Check exists
-        q = firestore_db.collection("users").document(uid).collection("folders").where("name", "==", name).limit(1).stream()
-        if any(q):
+        if store.folder_name_exists(uid, name):
             return jsonify({"error": "Folder already exists"}), 400
 
         new_folder = {
             "user_id": uid,
             "name": name,
-            "parent_id": parent_id,
-            "created_at": firestore.SERVER_TIMESTAMP
+            "parent_id": parent_id
         }
-        ref = firestore_db.collection("users").document(uid).collection("folders").add(new_folder)
+        folder_id = store.add_folder(uid, new_folder)
         new_doc = new_folder.copy()
-        new_doc["id"] = ref[1].id
+        new_doc["id"] = folder_id
+        emit_to_user(uid, "folder_changed", {"action": "created", "folder": new_doc})
         return jsonify({"success": True, "folder": new_doc})
     except Exception as e:
         print(f"Error creating folder: {e}")
@@ -1185,26 +1471,24 @@ def rename_record():
             return jsonify({"success": False, "error": "Both old_title and new_title are required"}), 400
 
         # Prevent renaming to an existing title (duplicate)
-        records_ref = firestore_db.collection("users").document(uid).collection("records")
-        existing = list(records_ref.where("title", "==", new_title).limit(1).stream())
-        if existing:
+        existing_id, _ = store.find_record(uid, new_title)
+        if existing_id:
             return jsonify({
                 "success": False,
                 "error": f"A record with the title '{new_title}' already exists."
             }), 409  # Conflict
 
         # Find the record to rename
-        docs = list(records_ref.where("title", "==", old_title).limit(1).stream())
-        if not docs:
+        rec_id, _ = store.find_record(uid, old_title)
+        if not rec_id:
             return jsonify({"success": False, "error": f"Record '{old_title}' not found"}), 404
 
-        rec_id = docs[0].id
-
         # Update record title
-        records_ref.document(rec_id).update({
-            "title": new_title,
-            "updated_at": firestore.SERVER_TIMESTAMP
-        })
+        store.update_record(uid, rec_id, {"title": new_title})
+        record_cache.invalidate(uid, old_title)
+        record_cache.invalidate(uid, new_title)
+        emit_to_user(uid, "record_updated", {"action": "renamed", "record_id": rec_id, "title": new_title,
+                                             "old_title": old_title})
 
         print(f"✅ Record renamed from '{old_title}' → '{new_title}' (uid: {uid})")
 
@@ -1238,17 +1522,16 @@ def rename_folder():
         if not new_name:
             return jsonify({"error": "Folder name is required"}), 400
 
-        folder_ref = firestore_db.collection("users").document(uid).collection("folders").document(folder_id)
-        folder_doc = folder_ref.get()
-        if not folder_doc.exists:
+        if not store.get_folder(uid, folder_id):
             return jsonify({"error": "Folder not found"}), 404
 
         # check conflict
-        conflict = firestore_db.collection("users").document(uid).collection("folders").where("name", "==", new_name).limit(1).stream()
-        if any(conflict):
+        if store.folder_name_exists(uid, new_name):
             return jsonify({"error": "Folder name already exists"}), 400
 
-        folder_ref.update({"name": new_name})
+        store.update_folder(uid, folder_id, {"name": new_name})
+        record_cache.invalidate(uid)
+        emit_to_user(uid, "folder_changed", {"action": "renamed", "folder": {"id": folder_id, "name": new_name}})
         return jsonify({"success": True, "folder": {"id": folder_id, "name": new_name}})
     except Exception as e:
         print(f"Error renaming folder: {e}")
@@ -1262,21 +1545,16 @@ def delete_folder():
         folder_id = data.get("id")
         uid = get_uid()
 
-        folder_ref = firestore_db.collection("users").document(uid).collection("folders").document(folder_id)
-        folder_doc = folder_ref.get()
-        if not folder_doc.exists:
+        if not store.get_folder(uid, folder_id):
             return jsonify({"error": "Folder not found"}), 404
 
         # Move records in this folder to uncategorized
-        records_q = firestore_db.collection("users").document(uid).collection("records").where("folder_id", "==", folder_id).stream()
-        batch = firestore_db.batch()
-        for r in records_q:
-            doc_ref = firestore_db.collection("users").document(uid).collection("records").document(r.id)
-            batch.update(doc_ref, {"folder_id": None})
-        batch.commit()
+        store.update_records_in_folder(uid, folder_id, {"folder_id": None})
+        record_cache.invalidate(uid)
 
         # Delete folder (and optionally subfolders recursively - omitted for brevity)
-        folder_ref.delete()
+        store.delete_folder(uid, folder_id)
+        emit_to_user(uid, "folder_changed", {"action": "deleted", "folder": {"id": folder_id}})
         return jsonify({"success": True})
     except Exception as e:
         print(f"Error deleting folder: {e}")
@@ -1291,12 +1569,13 @@ def move_record_to_folder():
         folder_id = data.get("folder_id")  # Can be None
         uid = get_uid()
 
-        rec_docs = firestore_db.collection("users").document(uid).collection("records").where("title", "==", record_title).limit(1).stream()
-        recs = list(rec_docs)
-        if not recs:
+        rec_id, _ = store.find_record(uid, record_title)
+        if not rec_id:
             return jsonify({"success": False, "error": "Record not found"}), 404
-        rec_id = recs[0].id
         update_record_firestore(uid, rec_id, {"folder_id": folder_id})
+        record_cache.invalidate(uid, record_title)
+        emit_to_user(uid, "record_updated", {"action": "moved", "record_id": rec_id, "title": record_title,
+                                             "folder_id": folder_id})
         return jsonify({"success": True})
     except Exception as e:
         print(f"Error moving record to folder: {e}")
@@ -1305,70 +1584,70 @@ def move_record_to_folder():
 # ---------------------------
 # Dashboard API (folders & records)
 # ---------------------------
+DEFAULT_FOLDERS = [
+    "All Records", "Uncategorized", "Work Projects",
+    "Personal Records", "Archive", "Important Documents"
+]
+_default_folders_seeded = set()  # uids known to have been seeded (per process)
+
+def seed_default_folders(uid, existing):
+    """Create the default folders missing from `existing`, once per user.
+
+    Returns the folders that were added. Seeding is remembered with a user
+    flag, so defaults the user later deletes are not recreated.
+    """
+    if uid in _default_folders_seeded:
+        return []
+    added = []
+    if not store.get_user_flag(uid, "default_folders_seeded"):
+        existing_names = {f.get("name", "").lower() for f in existing}
+        missing = [
+            {"user_id": uid, "name": name}
+            for name in DEFAULT_FOLDERS
+            if name.lower() not in existing_names
+        ]
+        if missing:
+            added = store.add_folders(uid, missing)
+        store.set_user_flag(uid, "default_folders_seeded")
+    _default_folders_seeded.add(uid)
+    return added
+
 @app.route("/api/dashboard-data")
 @login_required
-def api_dashboard_data():
+async def api_dashboard_data():
     try:
         uid = get_uid()
         if not uid:
             return jsonify({"success": False, "error": "No UID found"}), 401
 
-        # ---- Folders ----
-        folders_col = firestore_db.collection("users").document(uid).collection("folders")
-        folders_docs = list(folders_col.stream())
-
-        # Create default folders only if missing
-        existing_names = [f.to_dict().get("name", "").lower() for f in folders_docs]
-        default_folders = [
-            "All Records", "Uncategorized", "Work Projects",
-            "Personal Records", "Archive", "Important Documents"
-        ]
-
-        batch = firestore_db.batch()
-        for name in default_folders:
-            if name.lower() not in existing_names:
-                ref = folders_col.document()
-                batch.set(ref, {
-                    "user_id": uid,
-                    "name": name,
-                    "created_at": firestore.SERVER_TIMESTAMP
-                })
-        if batch:
-            batch.commit()
+        # Folders and records are independent: stream them concurrently
+        folder_list, records = await asyncio.gather(astore.list_folders(uid), astore.list_records(uid))
 
-        # Re-fetch all folders (ensures consistency)
-        folders_docs = list(folders_col.stream())
-        folder_list = [
-            {"id": f.id, **f.to_dict()} for f in folders_docs
-        ]
+        # ---- Folders ----
+        folder_list.extend(seed_default_folders(uid, folder_list))
+        folder_names = {f["id"]: f.get("name", "Unknown") for f in folder_list}
 
         # ---- Records ----
-        records_col = firestore_db.collection("users").document(uid).collection("records")
-        records_docs = records_col.order_by(
-            "updated_at", direction=firestore.Query.DESCENDING
-        ).stream()
-
         record_list = []
-        for r in records_docs:
-            rd = r.to_dict()
-            rd["id"] = r.id
+        for rd in records:
             rd["updated_at"] = rd.get("updated_at")
+            # export schema index; not needed by the dashboard
+            rd.pop("columns", None)
+            rd.pop("columns_complete", None)
+            rd.pop("keyed_scan_ids", None)
 
-            # Count related scans (safe: one filter only)
-            try:
-                scans_ref = firestore_db.collection("users").document(uid).collection("record_scans")
-                scans_query = scans_ref.where("record_id", "==", r.id).stream()
-                rd["scan_count"] = sum(1 for _ in scans_query)
-            except Exception as scan_err:
-                print("⚠️ Scan count error:", scan_err)
-                rd["scan_count"] = 0
+            # Records saved before scan_count was kept on the doc: count once and store it
+            if "scan_count" not in rd:
+                try:
+                    rd["scan_count"] = store.count_record_scans(uid, rd["id"])
+                    store.update_record(uid, rd["id"], {"scan_count": rd["scan_count"]}, touch=False)
+                except Exception as scan_err:
+                    print("⚠️ Scan count error:", scan_err)
+                    rd["scan_count"] = 0
 
             # Resolve folder name if missing
-            if not rd.get("folder_name") and rd.get("folder_id"):
-                folder_ref = firestore_db.collection("users").document(uid).collection("folders").document(rd["folder_id"])
-                folder_doc = folder_ref.get()
-                if folder_doc.exists:
-                    rd["folder_name"] = folder_doc.to_dict().get("name", "Unknown")
+            if not rd.get("folder_name") and rd.get("folder_id") in folder_names:
+                rd["folder_name"] = folder_names[rd["folder_id"]]
 
             record_list.append(rd)
 
@@ -1397,17 +1676,16 @@ def api_create_folder():
         if not name:
             return jsonify({"success": False, "error": "Folder name is required"}), 400
 
-        existing = firestore_db.collection("users").document(uid).collection("folders").where("name", "==", name).limit(1).stream()
-        if any(existing):
+        if store.folder_name_exists(uid, name):
             return jsonify({"success": False, "error": "Folder already exists"}), 400
 
-        ref = firestore_db.collection("users").document(uid).collection("folders").add({
+        folder_id = store.add_folder(uid, {
             "user_id": uid,
             "name": name,
-            "parent_id": parent_id,
-            "created_at": firestore.SERVER_TIMESTAMP
+            "parent_id": parent_id
         })
-        doc = {"id": ref[1].id, "name": name, "parent_id": parent_id}
+        doc = {"id": folder_id, "name": name, "parent_id": parent_id}
+        emit_to_user(uid, "folder_changed", {"action": "created", "folder": doc})
         return jsonify({"success": True, "folder": doc})
     except Exception as e:
         print(f"Error api_create_folder: {e}")
@@ -1423,22 +1701,16 @@ def api_rename_folder():
         uid = get_uid()
         if not new_name:
             return jsonify({"success": False, "error": "Folder name is required"}), 400
-        folder_ref = firestore_db.collection("users").document(uid).collection("folders").document(folder_id)
-        folder_doc = folder_ref.get()
-        if not folder_doc.exists:
+        if not store.get_folder(uid, folder_id):
             return jsonify({"success": False, "error": "Folder not found"}), 404
         # conflict check
-        conflict = firestore_db.collection("users").document(uid).collection("folders").where("name", "==", new_name).limit(1).stream()
-        if any(conflict):
+        if store.folder_name_exists(uid, new_name):
             return jsonify({"success": False, "error": "Folder name already exists"}), 400
-        folder_ref.update({"name": new_name})
+        store.update_folder(uid, folder_id, {"name": new_name})
         # Update all records that reference this folder_id to reflect the new name
-        records_q = firestore_db.collection("users").document(uid).collection("records").where("folder_id", "==", folder_id).stream()
-        batch = firestore_db.batch()
-        for r in records_q:
-            rec_ref = firestore_db.collection("users").document(uid).collection("records").document(r.id)
-            batch.update(rec_ref, {"folder_name": new_name})
-        batch.commit()
+        store.update_records_in_folder(uid, folder_id, {"folder_name": new_name})
+        record_cache.invalidate(uid)
+        emit_to_user(uid, "folder_changed", {"action": "renamed", "folder": {"id": folder_id, "name": new_name}})
 
         return jsonify({"success": True, "folder": {"id": folder_id, "name": new_name}})
     except Exception as e:
@@ -1452,21 +1724,16 @@ def api_delete_folder():
         data = request.get_json()
         folder_id = data.get("id")
         uid = get_uid()
-        folder_ref = firestore_db.collection("users").document(uid).collection("folders").document(folder_id)
-        folder_doc = folder_ref.get()
-        if not folder_doc.exists:
+        if not store.get_folder(uid, folder_id):
             return jsonify({"success": False, "error": "Folder not found"}), 404
 
         # move records out of folder
-        records_q = firestore_db.collection("users").document(uid).collection("records").where("folder_id", "==", folder_id).stream()
-        batch = firestore_db.batch()
-        for r in records_q:
-            doc_ref = firestore_db.collection("users").document(uid).collection("records").document(r.id)
-            batch.update(doc_ref, {"folder_id": None})
-        batch.commit()
+        store.update_records_in_folder(uid, folder_id, {"folder_id": None})
+        record_cache.invalidate(uid)
 
         # delete subfolders recursively is omitted for simplicity
-        folder_ref.delete()
+        store.delete_folder(uid, folder_id)
+        emit_to_user(uid, "folder_changed", {"action": "deleted", "folder": {"id": folder_id}})
         return jsonify({"success": True})
     except Exception as e:
         print(f"Error api_delete_folder: {e}")
@@ -1480,21 +1747,105 @@ def api_move_record_to_folder():
         record_title = data.get("title")
         folder_id = data.get("folder_id")
         uid = get_uid()
-        rec_docs = firestore_db.collection("users").document(uid).collection("records").where("title", "==", record_title).limit(1).stream()
-        recs = list(rec_docs)
-        if not recs:
+        rec_id, _ = store.find_record(uid, record_title)
+        if not rec_id:
             return jsonify({"success": False, "error": "Record not found"}), 404
-        rec_id = recs[0].id
         update_record_firestore(uid, rec_id, {"folder_id": folder_id})
+        record_cache.invalidate(uid, record_title)
+        emit_to_user(uid, "record_updated", {"action": "moved", "record_id": rec_id, "title": record_title,
+                                             "folder_id": folder_id})
         return jsonify({"success": True})
     except Exception as e:
         print(f"Error api_move_record_to_folder: {e}")
         return jsonify({"success": False, "error": str(e)}), 500
 
 # ---------------------------
-# Run
+# Health / queue status
+# ---------------------------
+@app.route("/healthz")
+def healthz():
+    return jsonify({
+        "status": "ok",
+        "storage": store.name,
+        "write_queue": write_queue.stats() if write_queue is not None else None,
+        "qr_cache": qr_cache.stats(),
+        "decoder": decode_stats.snapshot()
+    })
+
+@app.route("/metrics")
+def metrics_endpoint():
+    """Prometheus scrape target for this worker process."""
+    if METRICS_TOKEN and request.headers.get("Authorization") != f"Bearer {METRICS_TOKEN}":
+        return "Unauthorized", 401
+    return Response(metrics.REGISTRY.render(), content_type=metrics.CONTENT_TYPE)
+
+# ---------------------------
+# Serving
+# ---------------------------
+def create_app():
+    """Build the process state and return the configured app (see wsgi.py and gunicorn.conf.py).
+
+    Importing main only defines the app and its routes. This opens the
+    session backend and the store, starts the write-behind flusher and
+    attaches Socket.IO; later calls return the same app. OpenCV/pyzbar,
+    qrcode, xlsxwriter, httpx and the Firebase SDK are still imported by
+    the code paths that need them.
+    """
+    global store, astore, firebase_auth, counts_mirror, write_queue, record_cache, preview_cache, dedup_index
+    global socketio
+    if store is not None:
+        return app
+    os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+    os.makedirs(app.config['STATIC_QR_FOLDER'], exist_ok=True)
+    if PROXY_HOPS and not isinstance(app.wsgi_app, ProxyFix):
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=PROXY_HOPS, x_proto=PROXY_HOPS, x_host=PROXY_HOPS)
+    session_interface = create_session_interface(SESSION_BACKEND, SESSION_TTL, SESSION_DB_PATH)
+    if session_interface is not None:
+        app.session_interface = session_interface
+
+    if not firebase.configured:
+        print(f"❌ Service account file '{SERVICE_ACCOUNT}' not found in project root; Firebase disabled")
+        # Auth features are disabled; data falls back to the local SQLite store.
+    new_store = create_store(STORAGE_BACKEND, firebase.firestore_client if firebase.configured else None,
+                             SQLITE_PATH, count_shards=COUNT_SHARDS, counts_cache_ttl=COUNTS_CACHE_TTL)
+    print(f"✅ Using {new_store.name} storage backend")
+    metrics.instrument(new_store, STORE_OP_SECONDS, STORE_OP_ERRORS, count_store_op, exclude=("new_record_id",),
+                       backend=new_store.name)
+    astore = AsyncStore(new_store)
+    firebase_auth = FirebaseAuth(firebase, API_KEY, new_store, session_days=AUTH_SESSION_DAYS,
+                                 username_ttl=USERNAME_CACHE_TTL, verified_ttl=AUTH_REVOCATION_CHECK_SECONDS)
+    counts_mirror = CountsMirror(load_scan_counts, reconcile_every=COUNTS_RECONCILE_SECONDS)
+    if WRITE_BEHIND:
+        write_queue = WriteBehindQueue(new_store, max_batch=WRITE_BEHIND_BATCH, max_age=WRITE_BEHIND_MAX_AGE,
+                                       counts_guard=counts_mirror.writing).start()
+        atexit.register(write_queue.drain)
+    record_cache = RecordCache(ttl=RECORD_CACHE_TTL)
+    preview_cache = PreviewCache(new_store, ttl=PREVIEW_CACHE_TTL)
+    dedup_index = DedupIndex(new_store, max_users=DEDUP_INDEX_USERS, ttl=DEDUP_INDEX_TTL,
+                             pending=write_queue.pending_scan_data if write_queue is not None else None)
+    socketio = init_events(app)
+    store = new_store  # last: marks the app as created
+    return app
+
+def shutdown():
+    """Write out queued scans and stop the worker pools; called when a server worker exits."""
+    if write_queue is not None:
+        write_queue.drain()
+    shutdown_decoder()
+    shutdown_renderer()
+    if firebase_auth is not None:
+        firebase_auth.close()
+    if astore is not None:
+        astore.close()
+
+# ---------------------------
+# Run (development server; production uses gunicorn, see gunicorn.conf.py)
 # ---------------------------
 if __name__ == '__main__':
     port = int(os.environ.get("PORT", 5000))
-    # debug=True for local development only
-    app.run(host='0.0.0.0', port=port, debug=True)
+    debug = os.getenv("FLASK_DEBUG", "1").lower() in ("1", "true", "yes")
+    create_app()
+    if socketio is not None:
+        socketio.run(app, host='0.0.0.0', port=port, debug=debug, allow_unsafe_werkzeug=True)
+    else:
+        app.run(host='0.0.0.0', port=port, debug=debug)
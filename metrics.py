@@ -0,0 +1,233 @@
+# metrics.py
+"""In-process counters and histograms, exposed in Prometheus text format.
+
+Kept deliberately small so it can stay on in production: an observation is a
+dict lookup, a bisect over the bucket bounds and a few additions under the
+metric's own lock. Nothing is exported until /metrics is scraped, which
+renders the registry on demand.
+
+Metrics are per process. With several gunicorn workers each scrape is
+answered by whichever worker takes it; the `pid` of that worker is exported
+in `process_info` so the series can be told apart.
+
+    from metrics import counter, histogram
+    UPLOADS = counter("uploads_total", "Uploaded files", ["route"])
+    UPLOADS.inc(route="/upload")
+    LATENCY = histogram("thing_seconds", "Time per thing", ["kind"])
+    with LATENCY.time(kind="a"):
+        ...
+"""
+import functools
+import inspect
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# seconds; covers cache hits (sub-millisecond) up to slow decodes and exports
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)] + list(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        try:
+            return tuple(str(labels[n]) for n in self.labelnames)
+        except KeyError as e:
+            raise ValueError(f"{self.name}: missing label {e}") from None
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = [(key, self._copy(value)) for key, value in self._values.items()]
+        for key, value in sorted(items):
+            lines.extend(self._samples(key, value))
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    @staticmethod
+    def _copy(value):
+        return value
+
+    def _samples(self, key, value):
+        yield f"{self.name}{_labels(self.labelnames, key)} {_number(value)}"
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        i = bisect_left(self.buckets, value)  # bucket upper bounds are inclusive
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][i] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    @staticmethod
+    def _copy(value):
+        return [list(value[0]), value[1], value[2]]
+
+    def _samples(self, key, value):
+        counts, total, count = value
+        cumulative = 0
+        for bound, n in zip(self.buckets + (float("inf"),), counts):
+            cumulative += n
+            le = 'le="' + _number(bound) + '"'
+            yield f"{self.name}_bucket{_labels(self.labelnames, key, [le])} {cumulative}"
+        yield f"{self.name}_sum{_labels(self.labelnames, key)} {_number(total)}"
+        yield f"{self.name}_count{_labels(self.labelnames, key)} {count}"
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+
+    def register(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                if type(existing) is not type(metric) or existing.labelnames != metric.labelnames:
+                    raise ValueError(f"Metric {metric.name} already registered differently")
+                return existing  # re-imported module: keep the live series
+            self._metrics[metric.name] = metric
+            return metric
+
+    def render(self):
+        """The whole registry in Prometheus text exposition format."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = ["# HELP process_info This worker process.", "# TYPE process_info gauge",
+                 f'process_info{{pid="{os.getpid()}"}} 1']
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def counter(name, documentation, labelnames=()):
+    return REGISTRY.register(Counter(name, documentation, labelnames))
+
+
+def histogram(name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+    return REGISTRY.register(Histogram(name, documentation, labelnames, buckets))
+
+
+def instrument(obj, latency, errors, on_call=None, exclude=(), **labels):
+    """Time every public method of obj into latency{op=<method>, **labels}.
+
+    Only the outermost call on a thread is observed, so a method that calls
+    others of obj (save_record_scan calling save_record_scans, say) counts
+    once, under its own name. Exceptions are counted in errors{op=...,
+    **labels} and re-raised. Generator methods are timed over their
+    iteration (the time spent producing items, not the caller's loop body),
+    and errors raised while iterating are counted. on_call(), if given, runs
+    once per observed call. Methods named in exclude are left alone.
+    Returns obj, whose methods are replaced in place.
+    """
+    active = threading.local()  # .depth > 0 while an observed call runs on this thread
+
+    def wrap(name, method):
+        if inspect.isgeneratorfunction(method):
+            @functools.wraps(method)
+            def timed(*args, **kwargs):
+                if getattr(active, "depth", 0):
+                    return (yield from method(*args, **kwargs))
+                if on_call is not None:
+                    on_call()
+                items = method(*args, **kwargs)
+                elapsed = 0.0
+                try:
+                    while True:
+                        active.depth = 1
+                        start = time.perf_counter()
+                        try:
+                            item = next(items)
+                        except StopIteration as stop:
+                            return stop.value
+                        finally:
+                            elapsed += time.perf_counter() - start
+                            active.depth = 0
+                        yield item
+                except Exception:
+                    errors.inc(op=name, **labels)
+                    raise
+                finally:
+                    items.close()
+                    latency.observe(elapsed, op=name, **labels)
+        else:
+            @functools.wraps(method)
+            def timed(*args, **kwargs):
+                if getattr(active, "depth", 0):
+                    return method(*args, **kwargs)
+                if on_call is not None:
+                    on_call()
+                active.depth = 1
+                start = time.perf_counter()
+                try:
+                    return method(*args, **kwargs)
+                except Exception:
+                    errors.inc(op=name, **labels)
+                    raise
+                finally:
+                    active.depth = 0
+                    latency.observe(time.perf_counter() - start, op=name, **labels)
+        return timed
+
+    for name, attr in inspect.getmembers(type(obj)):
+        if name.startswith("_") or name in exclude or not inspect.isfunction(attr):
+            continue  # private helpers, properties and plain attributes
+        setattr(obj, name, wrap(name, getattr(obj, name)))
+    return obj
@@ -0,0 +1,156 @@
+# preview_cache.py
+"""Per-record cache of the /preview-record payload.
+
+A record's preview is built once from its record_scans and then kept up to
+date by /save-record-scan, so polling clients no longer re-read and re-parse
+every scan. Each preview carries a version "<generation>-<n>": n grows with
+every change, and the generation changes whenever the preview is rebuilt, so
+a client holding a version from an older build gets the full preview instead
+of a wrong delta.
+
+A scan saved while its record's preview is being rebuilt may be missed by
+the rebuild's read, so add_scan also hands it to every rebuild of that
+record in progress, which applies it before the preview is cached.
+
+The cache is per process: a scan saved through another worker only shows
+up once the preview is rebuilt, `ttl` seconds after it was built.
+"""
+import json
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+LABEL_KEYS = ("name", "full_name", "title", "username")
+
+
+def preview_entry(scan):
+    """(key, entry) for one record_scans doc, as shown by /preview-record."""
+    raw_data = scan.get("data", "")
+    cleaned_data = raw_data
+    label = "unknown"
+    try:
+        parsed = json.loads(raw_data)
+        if isinstance(parsed, dict):
+            cleaned_data = json.dumps(parsed, separators=(",", ":"))
+            for key_option in LABEL_KEYS:
+                value = parsed.get(key_option)
+                if isinstance(value, str) and value.strip():
+                    label = value.strip().lower()
+                    break
+    except (TypeError, ValueError):
+        if str(raw_data).strip().lower().startswith("http"):
+            label = "link"
+    key = f"{scan.get('type')}:{label}"
+    return key, {
+        "data": cleaned_data,
+        "id": scan["id"],
+        "scanned_at": scan.get("scanned_at"),
+        "type": scan.get("type"),
+    }
+
+
+class _Preview:
+    def __init__(self):
+        self.generation = uuid.uuid4().hex[:8]
+        self.n = 0
+        self.entries = {}   # key -> entry
+        self.changed = {}   # key -> n at which it was last set
+        self.built_at = time.monotonic()
+
+    @property
+    def version(self):
+        return f"{self.generation}-{self.n}"
+
+    def put(self, scan):
+        key, entry = preview_entry(scan)
+        self.n += 1
+        self.entries[key] = entry
+        self.changed[key] = self.n
+
+
+class PreviewCache:
+    def __init__(self, store, max_records=2048, ttl=300):
+        self.store = store
+        self.max_records = max_records
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._previews = OrderedDict()  # (uid, record_id) -> _Preview
+        self._rebuilds = {}  # (uid, record_id) -> [scans added meanwhile] for each rebuild in progress
+
+    def _fresh(self, uid, record_id):
+        preview = self._previews.get((uid, record_id))
+        if preview and time.monotonic() - preview.built_at < self.ttl:
+            self._previews.move_to_end((uid, record_id))
+            return preview
+        return None
+
+    def _get(self, uid, record_id):
+        with self._lock:
+            preview = self._fresh(uid, record_id)
+            if preview:
+                return preview
+            added = []
+            self._rebuilds.setdefault((uid, record_id), []).append(added)
+        preview = _Preview()
+        try:
+            for scan in self.store.iter_record_scans(uid, record_id):
+                preview.put(scan)
+        except BaseException:
+            with self._lock:
+                self._end_rebuild(uid, record_id, added)
+            raise
+        with self._lock:
+            self._end_rebuild(uid, record_id, added)
+            # scans saved during the read, which it may have missed
+            for scan in added:
+                preview.put(scan)
+            # keep a preview another thread built (and maybe updated) meanwhile
+            existing = self._fresh(uid, record_id)
+            if existing:
+                return existing
+            self._previews[(uid, record_id)] = preview
+            while len(self._previews) > self.max_records:
+                self._previews.popitem(last=False)
+        return preview
+
+    def _end_rebuild(self, uid, record_id, added):
+        rebuilds = self._rebuilds[(uid, record_id)]
+        del rebuilds[next(i for i, r in enumerate(rebuilds) if r is added)]
+        if not rebuilds:
+            del self._rebuilds[(uid, record_id)]
+
+    def get(self, uid, record_id, since=None):
+        """Return (version, entries); only entries changed after `since` if it is current."""
+        preview = self._get(uid, record_id)
+        with self._lock:
+            if since:
+                generation, _, n = since.partition("-")
+                if generation == preview.generation and n.isdigit():
+                    n = int(n)
+                    return preview.version, {k: dict(preview.entries[k])
+                                             for k, v in preview.changed.items() if v > n}
+            return preview.version, {k: dict(v) for k, v in preview.entries.items()}
+
+    def add_scan(self, uid, record_id, scan):
+        """Apply a newly saved scan to a cached preview.
+
+        Returns the preview's new version, or None if it is not cached.
+        """
+        with self._lock:
+            for added in self._rebuilds.get((uid, record_id), ()):
+                added.append(scan)
+            preview = self._previews.get((uid, record_id))
+            if preview:
+                preview.put(scan)
+                return preview.version
+        return None
+
+    def invalidate(self, uid, record_id=None):
+        """Drop one record's preview, or all of uid's when record_id is None."""
+        with self._lock:
+            if record_id is not None:
+                self._previews.pop((uid, record_id), None)
+            else:
+                for key in [k for k in self._previews if k[0] == uid]:
+                    del self._previews[key]
@@ -0,0 +1,156 @@
+# qr_cache.py
+"""Content-addressed cache of generated QR images.
+
+A generated file is named after a hash of what produced it (the payload plus
+the render options), so an identical /generate request is answered from the
+existing file without re-encoding, two users can never overwrite each other's
+image, and the URL of a file never changes meaning - it can be served as
+immutable. The directory is bounded by entry count and total bytes; the least
+recently used files are deleted first.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from io import BytesIO
+
+from metrics import counter, histogram
+
+# qrcode.make() defaults
+DEFAULT_OPTIONS = {"error_correction": "M", "box_size": 10, "border": 4}
+
+_ERROR_CORRECTION = {"L": 1, "M": 0, "Q": 3, "H": 2}  # qrcode.constants.ERROR_CORRECT_*
+
+RENDER_SECONDS = histogram("qr_cache_produce_seconds", "Time to produce a file missing from the QR cache", ["kind"])
+LOOKUPS = counter("qr_cache_lookups_total", "QR cache lookups", ["kind", "result"])
+
+
+def cache_key(payload, options=None):
+    """Hex key for a payload rendered with `options`."""
+    raw = json.dumps([payload, dict(DEFAULT_OPTIONS, **(options or {}))], sort_keys=True)
+    return hashlib.blake2b(raw.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def _build_qr(payload, options):
+    import qrcode
+    opts = dict(DEFAULT_OPTIONS, **(options or {}))
+    qr = qrcode.QRCode(
+        error_correction=_ERROR_CORRECTION[opts["error_correction"]],
+        box_size=opts["box_size"],
+        border=opts["border"],
+    )
+    qr.add_data(payload)
+    qr.make(fit=True)
+    return qr
+
+
+def render_qr_png(payload, options=None):
+    """Encode `payload` as a QR code and return the PNG bytes."""
+    buf = BytesIO()
+    _build_qr(payload, options).make_image().save(buf)
+    return buf.getvalue()
+
+
+def render_qr_svg(payload, options=None):
+    """Encode `payload` as a QR code and return the SVG bytes."""
+    from qrcode.image.svg import SvgPathImage
+    buf = BytesIO()
+    _build_qr(payload, options).make_image(image_factory=SvgPathImage).save(buf)
+    return buf.getvalue()
+
+
+class QRImageCache:
+    def __init__(self, directory, max_entries=5000, max_bytes=256 * 1024 * 1024):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # filename -> size, least recently used first
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._loaded = False
+
+    def _load(self):
+        """Index files left by a previous run, oldest access first (on first use)."""
+        if self._loaded:
+            return
+        self._loaded = True
+        os.makedirs(self.directory, exist_ok=True)
+        files = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.startswith(".") or not os.path.isfile(path):
+                continue
+            st = os.stat(path)
+            files.append((st.st_mtime, name, st.st_size))
+        for _, name, size in sorted(files):
+            self._entries[name] = size
+            self._bytes += size
+        self._evict()
+
+    def path(self, filename):
+        return os.path.join(self.directory, filename)
+
+    def get_or_create(self, key, ext, produce):
+        """Return the filename for `key`, calling produce() -> bytes on a miss."""
+        filename = f"{key}.{ext}"
+        with self._lock:
+            self._load()
+            if filename in self._entries:
+                self._entries.move_to_end(filename)
+                self.hits += 1
+                hit = True
+            else:
+                hit = False
+        LOOKUPS.inc(kind=ext, result="hit" if hit else "miss")
+        if hit:
+            try:
+                os.utime(self.path(filename))  # keeps LRU order across restarts
+                return filename
+            except FileNotFoundError:
+                # deleted behind our back; forget it and produce it again
+                with self._lock:
+                    self._bytes -= self._entries.pop(filename, 0)
+        start = time.perf_counter()
+        data = produce()
+        RENDER_SECONDS.observe(time.perf_counter() - start, kind=ext)
+        tmp = self.path(f".{filename}.{threading.get_ident()}.tmp")
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, self.path(filename))
+        with self._lock:
+            if filename not in self._entries:
+                self._bytes += len(data)
+                self.misses += 1
+            self._entries[filename] = len(data)
+            self._entries.move_to_end(filename)
+            self._evict()
+        return filename
+
+    def qr_png(self, payload, options=None):
+        """Filename of the PNG for `payload`, rendering it only on a miss."""
+        return self.get_or_create(cache_key(payload, options), "png",
+                                  lambda: render_qr_png(payload, options))
+
+    def json_file(self, text):
+        """Filename of a JSON document stored under its content hash."""
+        key = hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+        return self.get_or_create(key, "json", lambda: text.encode("utf-8"))
+
+    def _evict(self):
+        while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+            filename, size = self._entries.popitem(last=False)
+            self._bytes -= size
+            try:
+                os.remove(self.path(filename))
+            except FileNotFoundError:
+                pass
+
+    def stats(self):
+        with self._lock:
+            self._load()
+            return {"entries": len(self._entries), "bytes": self._bytes,
+                    "hits": self.hits, "misses": self.misses}
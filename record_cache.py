@@ -0,0 +1,48 @@
+# record_cache.py
+"""Per-user cache of record title -> record id / folder metadata.
+
+/save-record-scan is called for every decoded video frame, so resolving the
+record by title on each call is the dominant cost. Entries are invalidated by
+the routes that rename, delete or move records and expire after `ttl` seconds
+so changes made by other workers are picked up.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+
+class RecordCache:
+    def __init__(self, max_users=1024, ttl=300):
+        self.max_users = max_users
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._users = OrderedDict()  # uid -> {title: (expires_at, entry)}
+
+    def get(self, uid, title):
+        """Return the cached entry dict for a title, or None."""
+        with self._lock:
+            titles = self._users.get(uid)
+            if not titles or title not in titles:
+                return None
+            expires_at, entry = titles[title]
+            if expires_at < time.monotonic():
+                del titles[title]
+                return None
+            self._users.move_to_end(uid)
+            return dict(entry)
+
+    def put(self, uid, title, entry):
+        with self._lock:
+            titles = self._users.setdefault(uid, {})
+            titles[title] = (time.monotonic() + self.ttl, dict(entry))
+            self._users.move_to_end(uid)
+            while len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+
+    def invalidate(self, uid, title=None):
+        """Drop one title, or every cached record of uid when title is None."""
+        with self._lock:
+            if title is None:
+                self._users.pop(uid, None)
+            elif uid in self._users:
+                self._users[uid].pop(title, None)
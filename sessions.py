@@ -0,0 +1,197 @@
+# sessions.py
+"""Server-side Flask sessions: the cookie carries only a random session id.
+
+Flask's default session serializes everything into a signed cookie, so the
+QR payload and JSON preview stored by /generate were sent back (and
+re-verified) on every request afterwards, including each /save-record-scan
+frame, and a large structured payload could push the cookie past the 4KB
+browser limit. With ServerSessionInterface the session data lives in a
+backend and the cookie is a fixed-size id, whatever the user stored.
+
+Backends (SESSION_BACKEND):
+  sqlite  a local SQLite file; shared by every worker on the host (default)
+  memory  a dict in this process; only for a single worker or tests
+  cookie  Flask's signed cookie session (the old behavior)
+
+Sessions expire `ttl` seconds after their last write. A session that is read
+but not modified is only re-saved (to push its expiry out) once more than
+half of its TTL has passed, so most requests cost one lookup and no write.
+"""
+import secrets
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
+
+# the serializer Flask uses for cookie sessions (handles bytes, datetimes, ...)
+_serializer = TaggedJSONSerializer()
+
+
+class ServerSession(CallbackDict, SessionMixin):
+    def __init__(self, initial=None, sid=None, new=False, expires_at=None):
+        def on_update(self):
+            self.modified = True
+
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.expires_at = expires_at
+        self.modified = False
+        self.replaced_sid = None
+
+    def regenerate(self):
+        """Move the data to a fresh id (call on login, against session fixation)."""
+        if not self.new:
+            self.replaced_sid = self.sid
+        self.sid = secrets.token_urlsafe(32)
+        self.new = True
+        self.modified = True
+
+
+class MemorySessionBackend:
+    """Sessions in a process-local dict, LRU-bounded."""
+
+    def __init__(self, max_sessions=10000):
+        self.max_sessions = max_sessions
+        self._lock = threading.Lock()
+        self._sessions = OrderedDict()  # sid -> (data, expires_at)
+
+    def load(self, sid):
+        """(data, expires_at) for a live session, or None."""
+        with self._lock:
+            entry = self._sessions.get(sid)
+            if entry is None:
+                return None
+            if entry[1] <= time.time():
+                del self._sessions[sid]
+                return None
+            self._sessions.move_to_end(sid)
+            return _serializer.loads(entry[0]), entry[1]
+
+    def save(self, sid, data, expires_at):
+        with self._lock:
+            self._sessions[sid] = (_serializer.dumps(data), expires_at)
+            self._sessions.move_to_end(sid)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+
+    def delete(self, sid):
+        with self._lock:
+            self._sessions.pop(sid, None)
+
+
+class SQLiteSessionBackend:
+    """Sessions in a SQLite table; expired rows are purged every `purge_every` seconds."""
+
+    def __init__(self, path="sessions.db", purge_every=600):
+        self.path = path
+        self.purge_every = purge_every
+        self._next_purge = 0.0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=10)
+        if path != ":memory:":
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions (id TEXT PRIMARY KEY, data TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+
+    def load(self, sid):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT data, expires_at FROM sessions WHERE id = ? AND expires_at > ?", (sid, time.time())
+            ).fetchone()
+        if row is None:
+            return None
+        return _serializer.loads(row[0]), row[1]
+
+    def save(self, sid, data, expires_at):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO sessions (id, data, expires_at) VALUES (?, ?, ?)",
+                (sid, _serializer.dumps(data), expires_at),
+            )
+            if now >= self._next_purge:
+                self._next_purge = now + self.purge_every
+                self._conn.execute("DELETE FROM sessions WHERE expires_at <= ?", (now,))
+
+    def delete(self, sid):
+        with self._lock:
+            self._conn.execute("DELETE FROM sessions WHERE id = ?", (sid,))
+
+
+class ServerSessionInterface(SessionInterface):
+    """Flask session interface that keeps session data in `backend`."""
+
+    def __init__(self, backend, ttl=7 * 24 * 3600):
+        self.backend = backend
+        self.ttl = ttl
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid and len(sid) <= 64:
+            try:
+                entry = self.backend.load(sid)
+            except Exception as e:
+                print(f"Warning: session load failed: {e}")
+                entry = None
+            if entry is not None:
+                data, expires_at = entry
+                return ServerSession(data, sid=sid, expires_at=expires_at)
+        return ServerSession(sid=secrets.token_urlsafe(32), new=True)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        if session.accessed:
+            response.vary.add("Cookie")
+        if session.replaced_sid:
+            self.backend.delete(session.replaced_sid)
+
+        if not session:
+            if session.modified and not session.new:
+                # cleared (logout): drop the stored session and the cookie
+                self.backend.delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path,
+                                       secure=self.get_cookie_secure(app),
+                                       partitioned=self.get_cookie_partitioned(app),
+                                       httponly=self.get_cookie_httponly(app),
+                                       samesite=self.get_cookie_samesite(app))
+            return
+
+        now = time.time()
+        stale = session.expires_at is None or session.expires_at - now < self.ttl / 2
+        if not (session.new or session.modified or stale):
+            return
+        expires_at = now + self.ttl
+        self.backend.save(session.sid, dict(session), expires_at)
+        if session.new or session.permanent:
+            response.set_cookie(
+                name,
+                session.sid,
+                expires=self.get_expiration_time(app, session),
+                httponly=self.get_cookie_httponly(app),
+                domain=domain,
+                path=path,
+                secure=self.get_cookie_secure(app),
+                partitioned=self.get_cookie_partitioned(app),
+                samesite=self.get_cookie_samesite(app),
+            )
+
+
+def create_session_interface(backend, ttl, sqlite_path="sessions.db"):
+    """Session interface for SESSION_BACKEND; None keeps Flask's cookie sessions."""
+    backend = (backend or "cookie").lower()
+    if backend == "cookie":
+        return None
+    if backend == "memory":
+        return ServerSessionInterface(MemorySessionBackend(), ttl=ttl)
+    if backend == "sqlite":
+        return ServerSessionInterface(SQLiteSessionBackend(sqlite_path), ttl=ttl)
+    raise ValueError(f"Unknown session backend: {backend!r}")
@@ -16,14 +16,13 @@ document.addEventListener('DOMContentLoaded', () => {
 
     // 🆕 Load scanned codes from backend
     function preloadScannedCodes() {
-        fetch('/scans')
+        fetch('/scans?limit=500')
             .then(res => res.json())
             .then(data => {
                 if (data) {
-                    for (const key of Object.keys(data)) {
-                        if (key !== "counts") {
-                            scanData.scannedCodes.add(key);
-                        }
+                    // first page of recent scans (see next_cursor for older ones)
+                    for (const scan of data.scans || []) {
+                        scanData.scannedCodes.add(`${scan.type}:${scan.data}`);
                     }
                     scanData.typeCounts = data.counts || {};
                     updateStats();
@@ -54,6 +53,26 @@ document.addEventListener('DOMContentLoaded', () => {
     }
 
     preloadScannedCodes();  // Load existing scans
+    connectLiveUpdates();   // Scans saved from other tabs/devices
+
+    function connectLiveUpdates() {
+        if (!window.io) return;
+        const socket = io();
+        socket.on('scan_saved', scan => {
+            const codeKey = `${scan.type}:${scan.data}`;
+            if (scanData.scannedCodes.has(codeKey)) return;  // our own scan, already counted
+            scanData.scannedCodes.add(codeKey);
+            scanData.typeCounts[scan.type] = (scanData.typeCounts[scan.type] || 0) + 1;
+            updateStats();
+        });
+        socket.on('counts_changed', msg => {
+            if (msg.reset) {
+                scanData.scannedCodes.clear();
+                scanData.typeCounts = {};
+                updateStats();
+            }
+        });
+    }
     startCameraAndScanner();  // Start the scanner
 
     function initScanner() {
@@ -79,18 +98,13 @@ document.addEventListener('DOMContentLoaded', () => {
                     updateStats();
                     playBeep();
 
-                    fetch('/save-scan', {
-                        method: 'POST',
-                        headers: {
-                            'Content-Type': 'application/json'
-                        },
-                        body: JSON.stringify({
-                            format: format,
-                            text: text
-                        })
+                    // Buffered with other scans and saved in one request
+                    ScanBatcher.queueScan({
+                        format: format,
+                        text: text
                     })
-                    .then(res => res.json())
                     .then(data => {
+                        if (data.error) throw new Error(data.error);
                         const scanTime = new Date().toLocaleString();
                         if (data.new) {
                             resultElement.innerHTML = `
@@ -104,6 +118,10 @@ document.addEventListener('DOMContentLoaded', () => {
                             `;
                         }
                     }).catch(err => {
+                        // not saved: forget the code so the next frame retries it
+                        scanData.scannedCodes.delete(codeKey);
+                        scanData.typeCounts[format] = Math.max(0, (scanData.typeCounts[format] || 1) - 1);
+                        updateStats();
                         console.error('Failed to save scan:', err);
                     });
                 } else {
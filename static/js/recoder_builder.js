@@ -70,7 +70,7 @@ function populateFromQuery(params) {
 }
 
 function fetchRecordPreview(title) {
-  fetch(`/preview-record?title=${encodeURIComponent(title)}&t=${Date.now()}`)
+  fetch(`/preview-record?title=${encodeURIComponent(title)}`)
     .then(res => res.json())
     .then(record => {
       const container = document.getElementById("preview-container");
@@ -112,7 +112,7 @@ function downloadRecord() {
 
   const title = meta.title || 'Untitled';
 
-  fetch(`/preview-record?title=${encodeURIComponent(title)}&t=${Date.now()}`)
+  fetch(`/preview-record?title=${encodeURIComponent(title)}`)
     .then(res => res.json())
     .then(record => {
       const count = Object.keys(record).length;
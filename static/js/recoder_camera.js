@@ -12,6 +12,8 @@ const scanData = {
   scannedCodes: new Set(),
   typeCounts: {}
 };
+// codeKey -> server verdict (true new / false duplicate), null while queued
+const savedCodes = new Map();
 
 const metaParams = new URLSearchParams(window.location.search);
 const metaInfo = {
@@ -88,18 +90,29 @@ function startCameraAndScanner() {
         const format = result.getBarcodeFormat();
         const codeKey = `${format}:${text}`;
 
-        fetch('/save-record-scan', {
-          method: 'POST',
-          headers: { 'Content-Type': 'application/json' },
-          body: JSON.stringify({
-            format: format,
-            text: text,
-            meta_info: metaInfo
-          })
+        // Codes already answered (or waiting in the batch) aren't sent again
+        if (savedCodes.has(codeKey)) {
+          drawBoundingBox(result, false);
+          if (savedCodes.get(codeKey) !== null) {
+            resultElement.innerHTML = `<strong class="duplicate-scan">⏭ ${format}:</strong> ${text}`;
+          }
+          return;
+        }
+        savedCodes.set(codeKey, null);
+
+        ScanBatcher.queueScan({
+          format: format,
+          text: text,
+          meta_info: metaInfo
         })
-        .then(res => res.json())
         .then(data => {
+          if (data.error) {
+            savedCodes.delete(codeKey);  // retry on the next frame
+            console.error("Save failed:", data.error);
+            return;
+          }
           const isNew = !!data.new;
+          savedCodes.set(codeKey, isNew);
           drawBoundingBox(result, isNew);
 
           if (isNew) {
@@ -111,6 +124,10 @@ function startCameraAndScanner() {
           } else {
             resultElement.innerHTML = `<strong class="duplicate-scan">⏭ ${format}:</strong> ${text}`;
           }
+        })
+        .catch(err => {
+          savedCodes.delete(codeKey);  // network failure: retry on the next frame
+          console.error("Save failed:", err);
         });
       }
 
@@ -141,7 +158,7 @@ startBtn.addEventListener('click', () => {
 });
 
 function preloadExistingScans(title, callback) {
-  fetch(`/preview-record?title=${encodeURIComponent(title)}&t=${Date.now()}`)
+  fetch(`/preview-record?title=${encodeURIComponent(title)}`)
     .then(res => res.json())
     .then(record => {
       for (const key of Object.keys(record)) {
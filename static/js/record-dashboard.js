@@ -2,13 +2,85 @@
 let currentFolder = 'all';
 let allRecords = [];
 let allFolders = [];
+let socket = null;
 
 // Initialize when page loads
 document.addEventListener('DOMContentLoaded', function() {
     loadFoldersAndRecords();
     setupEventListeners();
+    connectLiveUpdates();
 });
 
+// True when changes arrive over the socket, so actions need not reload everything
+function liveUpdatesConnected() {
+    return socket !== null && socket.connected;
+}
+
+// Apply pushed record/folder changes (see events.py) instead of re-fetching
+function connectLiveUpdates() {
+    if (!window.io) return;
+    socket = io();
+    socket.on('record_updated', applyRecordEvent);
+    socket.on('folder_changed', applyFolderEvent);
+    // Events missed while disconnected are not replayed: reload after a reconnect
+    let connectedBefore = false;
+    socket.on('connect', () => {
+        if (connectedBefore) loadFoldersAndRecords();
+        connectedBefore = true;
+    });
+}
+
+function rerender() {
+    renderFolders();
+    renderRecords();
+    updateCounts();
+}
+
+function applyRecordEvent(event) {
+    const record = allRecords.find(r => r.id === event.record_id);
+    if (!record) {
+        // a record this page hasn't seen yet
+        if (event.action !== 'deleted') loadFoldersAndRecords();
+        return;
+    }
+    switch (event.action) {
+        case 'scan_added':
+            record.scan_count = (record.scan_count || 0) + (event.scan_count_delta || 1);
+            break;
+        case 'renamed':
+            record.title = event.title;
+            break;
+        case 'updated':
+            record.subtitle = event.subtitle;
+            break;
+        case 'moved':
+            record.folder_id = event.folder_id;
+            break;
+        case 'deleted':
+            allRecords = allRecords.filter(r => r.id !== event.record_id);
+            break;
+    }
+    rerender();
+}
+
+function applyFolderEvent(event) {
+    const folder = event.folder;
+    switch (event.action) {
+        case 'created':
+            if (!allFolders.some(f => f.id === folder.id)) allFolders.push(folder);
+            break;
+        case 'renamed':
+            allFolders.filter(f => f.id === folder.id).forEach(f => { f.name = folder.name; });
+            allRecords.filter(r => r.folder_id === folder.id).forEach(r => { r.folder_name = folder.name; });
+            break;
+        case 'deleted':
+            allFolders = allFolders.filter(f => f.id !== folder.id);
+            allRecords.filter(r => r.folder_id === folder.id).forEach(r => { r.folder_id = null; });
+            break;
+    }
+    rerender();
+}
+
 function setupEventListeners() {
     // Search functionality
     document.getElementById('search').addEventListener('input', filterRecords);
@@ -365,7 +437,7 @@ async function createFolder(parentId = null) {
 
         const data = await response.json();
         if (data.success) {
-            await loadFoldersAndRecords(); // Reload to get updated data
+            if (!liveUpdatesConnected()) await loadFoldersAndRecords(); // Reload to get updated data
         } else {
             alert('Error creating folder: ' + data.error);
         }
@@ -396,7 +468,7 @@ async function renameFolder(folderId, currentName) {
 
         const data = await response.json();
         if (data.success) {
-            await loadFoldersAndRecords();
+            if (!liveUpdatesConnected()) await loadFoldersAndRecords();
         } else {
             alert('Error renaming folder: ' + data.error);
         }
@@ -418,7 +490,7 @@ async function deleteFolder(folderId, folderName) {
 
         const data = await response.json();
         if (data.success) {
-            await loadFoldersAndRecords();
+            if (!liveUpdatesConnected()) await loadFoldersAndRecords();
             // If we were viewing the deleted folder, switch to all records
             if (currentFolder == folderId) {
                 selectFolder('all', document.querySelector('[data-folder="all"]'));
@@ -475,7 +547,7 @@ async function confirmMoveToFolder() {
 
         const data = await response.json();
         if (data.success) {
-            await loadFoldersAndRecords();
+            if (!liveUpdatesConnected()) await loadFoldersAndRecords();
             bootstrap.Modal.getInstance(document.getElementById('moveToFolderModal')).hide();
         } else {
             alert('Error moving record: ' + data.error);
@@ -510,7 +582,7 @@ function renameRecord(currentTitle) {
                 const titleElement = recordCard.querySelector('.record-title');
                 if (titleElement) titleElement.textContent = newTitle;
                 recordCard.dataset.recordTitle = newTitle; // update data attribute
-            } else {
+            } else if (!liveUpdatesConnected()) {
                 location.reload(); // fallback if record not found in DOM
             }
         } else {
@@ -548,7 +620,7 @@ function editSubtitle(recordTitle, currentSubtitle) {
             const subtitleElement = document.querySelector(`[data-record-title="${recordTitle}"] .record-subtitle`);
             if (subtitleElement) {
                 subtitleElement.textContent = newSubtitle;
-            } else {
+            } else if (!liveUpdatesConnected()) {
                 location.reload(); // fallback if no element found
             }
         } else {
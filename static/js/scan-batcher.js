@@ -0,0 +1,49 @@
+// Buffers scans for a short window and saves them with one POST to /save-scans.
+// ScanBatcher.queueScan({format, text, meta_info}) resolves with that scan's
+// verdict from the server: {new: true|false} or {error: "..."}.
+const ScanBatcher = (() => {
+    const WINDOW_MS = 250;
+    const MAX_BATCH = 200;  // SAVE_SCANS_MAX on the server
+    let pending = [];
+    let timer = null;
+
+    function flush() {
+        clearTimeout(timer);
+        timer = null;
+        const batch = pending.splice(0, MAX_BATCH);
+        if (pending.length) timer = setTimeout(flush, 0);
+        if (!batch.length) return;
+
+        fetch('/save-scans', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify(batch.map(p => p.scan))
+        })
+        .then(res => res.json())
+        .then(data => {
+            const results = data.results || [];
+            batch.forEach((p, i) => p.resolve(results[i] || { error: data.error || 'No result' }));
+        })
+        .catch(err => batch.forEach(p => p.reject(err)));
+    }
+
+    function queueScan(scan) {
+        return new Promise((resolve, reject) => {
+            pending.push({ scan: { ...scan, client_ts: new Date().toISOString() }, resolve, reject });
+            if (pending.length >= MAX_BATCH) {
+                flush();
+            } else if (!timer) {
+                timer = setTimeout(flush, WINDOW_MS);
+            }
+        });
+    }
+
+    // Don't lose a buffered window when the page is closed
+    window.addEventListener('pagehide', () => {
+        if (!pending.length) return;
+        const body = JSON.stringify(pending.splice(0, MAX_BATCH).map(p => p.scan));
+        navigator.sendBeacon('/save-scans', new Blob([body], { type: 'application/json' }));
+    });
+
+    return { queueScan };
+})();
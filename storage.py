@@ -0,0 +1,1031 @@
+# storage.py
+"""Storage backends for the app's per-user data.
+
+Every route goes through a Store instead of talking to Firestore directly.
+Two implementations share the same interface:
+
+- FirestoreStore: the production layout (users/{uid}/scans, records, ...)
+- SQLiteStore: the same paths modelled as indexed SQLite tables, either in a
+  file or in memory, so the app can run (and be load-tested) offline.
+
+Documents are plain dicts. Timestamps are filled in by the store
+(server timestamps on Firestore, UTC datetimes on SQLite), and documents read
+back from records, record_scans, folders and scans carry their id under "id".
+"""
+import base64
+import hashlib
+import json
+import sqlite3
+import threading
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from counters import ShardedCounter
+
+# Fields that hold timestamps (restored to datetimes when read from SQLite)
+TIMESTAMP_FIELDS = (
+    "timestamp", "created_at", "updated_at", "scanned_at",
+    "generated_at", "uploaded_at",
+)
+
+
+class NotFoundError(LookupError):
+    """Raised when updating a document that does not exist."""
+
+
+def record_scan_id(record_id, data):
+    """Deterministic record_scans id, so a duplicate scan maps to the same doc."""
+    return hashlib.sha1(f"{record_id}\x00{data}".encode("utf-8")).hexdigest()
+
+
+def encode_cursor(timestamp, doc_id):
+    """Opaque page cursor for (timestamp, id) ordered listings."""
+    ts = timestamp.isoformat() if hasattr(timestamp, "isoformat") else timestamp
+    raw = json.dumps([ts, doc_id]).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor):
+    """Return (timestamp datetime, doc id); raises ValueError if malformed."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        ts, doc_id = json.loads(raw)
+        return datetime.fromisoformat(ts), str(doc_id)
+    except Exception as e:
+        raise ValueError(f"Invalid cursor: {cursor!r}") from e
+
+
+class Store:
+    """Interface shared by all backends."""
+
+    name = "base"
+
+    @staticmethod
+    def _page(docs, limit):
+        """Trim a limit+1 fetch to one page and build the next cursor."""
+        if len(docs) <= limit:
+            return docs, None
+        docs = docs[:limit]
+        return docs, encode_cursor(docs[-1].get("timestamp"), docs[-1]["id"])
+
+    # ---- users ----
+    def create_user_profile(self, uid, username, email):
+        raise NotImplementedError
+
+    def get_profile_by_username(self, username):
+        raise NotImplementedError
+
+    def get_profile_by_uid(self, uid):
+        raise NotImplementedError
+
+    def get_user_flag(self, uid, name):
+        """True once set_user_flag(uid, name) has been called."""
+        raise NotImplementedError
+
+    def set_user_flag(self, uid, name):
+        raise NotImplementedError
+
+    # ---- counts ----
+    def increment_count(self, uid, scan_type, amount=1):
+        raise NotImplementedError
+
+    def get_counts(self, uid):
+        raise NotImplementedError
+
+    def reset_counts(self, uid):
+        raise NotImplementedError
+
+    def write_batch(self, scans, counts):
+        """Write queued scans [(uid, doc)] and increments {uid: {type: n}} together."""
+        raise NotImplementedError
+
+    # ---- scans ----
+    def add_scan(self, uid, doc):
+        raise NotImplementedError
+
+    def scan_exists(self, uid, data):
+        raise NotImplementedError
+
+    def iter_scans(self, uid, newest_first=True):
+        raise NotImplementedError
+
+    def iter_scan_data(self, uid):
+        """Just the `data` field of every scan (for dedup indexes)."""
+        raise NotImplementedError
+
+    def list_scans(self, uid, limit=50, cursor=None, scan_type=None):
+        """One page of scans, newest first.
+
+        Returns (docs, next_cursor); next_cursor is None on the last page.
+        """
+        raise NotImplementedError
+
+    def clear_scans(self, uid):
+        raise NotImplementedError
+
+    # ---- qr_generations / upload_attempts ----
+    def add_qr_generation(self, uid, doc):
+        raise NotImplementedError
+
+    def add_qr_generations(self, uid, docs):
+        """Log several generations in one batched write."""
+        raise NotImplementedError
+
+    def add_upload_attempt(self, uid, doc):
+        raise NotImplementedError
+
+    # ---- records ----
+    def find_record(self, uid, title):
+        """Return (record_id, record_dict) for a title, or (None, None)."""
+        raise NotImplementedError
+
+    def add_record(self, uid, doc):
+        raise NotImplementedError
+
+    def update_record(self, uid, record_id, fields, touch=True):
+        """Apply `fields`; `touch` also bumps updated_at."""
+        raise NotImplementedError
+
+    def delete_record(self, uid, record_id):
+        """Delete a record and all of its record_scans."""
+        raise NotImplementedError
+
+    def list_records(self, uid):
+        """All records, most recently updated first."""
+        raise NotImplementedError
+
+    def update_records_in_folder(self, uid, folder_id, fields):
+        """Apply `fields` to every record whose folder_id is `folder_id`."""
+        raise NotImplementedError
+
+    def index_record_columns(self, uid, record_id, columns):
+        """Merge `columns` into a record's column list and mark it complete.
+
+        Records created by save_record_scan(s) are complete from the start;
+        this backfills records saved before the column list existed.
+        """
+        raise NotImplementedError
+
+    # ---- record_scans ----
+    def record_scan_exists(self, uid, record_id, data):
+        raise NotImplementedError
+
+    def iter_record_scans(self, uid, record_id, ordered=False):
+        """Scans of a record; newest first when `ordered` is set."""
+        raise NotImplementedError
+
+    def new_record_id(self, uid):
+        """Allocate an id for a record that will be created later."""
+        raise NotImplementedError
+
+    def save_record_scan(self, uid, record_id, scan_doc, record_fields, new_record=False, columns=None):
+        """Add a scan to a record in one write.
+
+        The scan is stored under record_scan_id(record_id, data); if that doc
+        already exists nothing is written and False is returned. Otherwise the
+        record is created (new_record) or updated with record_fields, its
+        scan_count and the scan's type count are incremented, `columns` is
+        merged into the record's "columns" list (a set union), and True is
+        returned. Raises NotFoundError if an existing record has gone away.
+        """
+        raise NotImplementedError
+
+    def save_record_scans(self, uid, record_id, scan_docs, record_fields, new_record=False, columns=None):
+        """save_record_scan for several scans of one record in one write.
+
+        Returns one bool per scan doc (False for duplicates, including repeats
+        within scan_docs). At most 490 scans per call on Firestore.
+        """
+        results = []
+        for doc in scan_docs:
+            results.append(self.save_record_scan(uid, record_id, doc, record_fields,
+                                                 new_record=new_record and not any(results),
+                                                 columns=columns))
+        return results
+
+    def count_record_scans(self, uid, record_id):
+        raise NotImplementedError
+
+    # ---- folders ----
+    def get_folder(self, uid, folder_id):
+        raise NotImplementedError
+
+    def folder_name_exists(self, uid, name):
+        raise NotImplementedError
+
+    def add_folder(self, uid, doc):
+        raise NotImplementedError
+
+    def add_folders(self, uid, docs):
+        """Add several folders at once; returns the new docs with their ids."""
+        raise NotImplementedError
+
+    def update_folder(self, uid, folder_id, fields):
+        raise NotImplementedError
+
+    def delete_folder(self, uid, folder_id):
+        raise NotImplementedError
+
+    def list_folders(self, uid):
+        raise NotImplementedError
+
+
+# ---------------------------
+# Firestore
+# ---------------------------
+class FirestoreStore(Store):
+    """Store backed by Cloud Firestore (users/{uid}/...)."""
+
+    name = "firestore"
+    BATCH_LIMIT = 500
+
+    def __init__(self, client, count_shards=8, counts_cache_ttl=2.0):
+        """client: a Firestore client, or a callable returning one on first use."""
+        self._client = client
+        self._db = None if callable(client) else client
+        self._fs_module = None
+        # meta/counts is split over count_shards docs (see counters.py)
+        self.counters = ShardedCounter(count_shards, counts_cache_ttl)
+
+    @property
+    def db(self):
+        if self._db is None:
+            self._db = self._client()
+        return self._db
+
+    @property
+    def _fs(self):
+        # firebase_admin.firestore pulls in the whole google-cloud stack; import on first write
+        if self._fs_module is None:
+            from firebase_admin import firestore
+            self._fs_module = firestore
+        return self._fs_module
+
+    def _user(self, uid):
+        return self.db.collection("users").document(uid)
+
+    def _col(self, uid, name):
+        return self._user(uid).collection(name)
+
+    def _counts_ref(self, uid, shard=None):
+        """A counts shard; a random one unless `shard` names it."""
+        return self._user(uid).collection("meta").document(shard or self.counters.pick())
+
+    def _count_shard_refs(self, uid):
+        meta = self._user(uid).collection("meta")
+        return [meta.document(name) for name in self.counters.shard_names()]
+
+    def _flags_ref(self, uid):
+        return self._user(uid).collection("meta").document("flags")
+
+    @staticmethod
+    def _with_id(snapshot):
+        d = snapshot.to_dict() or {}
+        d["id"] = snapshot.id
+        return d
+
+    def _commit_in_batches(self, refs, op, fields=None):
+        """Run `op` ("delete", "update" or "set") over refs in batches of 500.
+
+        For "set", refs yields (ref, doc) pairs.
+        """
+        batch = self.db.batch()
+        count = 0
+        for ref in refs:
+            if op == "delete":
+                batch.delete(ref)
+            elif op == "set":
+                batch.set(*ref)
+            else:
+                batch.update(ref, fields)
+            count += 1
+            if count == self.BATCH_LIMIT:
+                batch.commit()
+                batch = self.db.batch()
+                count = 0
+        if count > 0:
+            batch.commit()
+
+    # ---- users ----
+    def create_user_profile(self, uid, username, email):
+        self._user(uid).collection("meta").document("profile").set({
+            "username": username,
+            "email": email,
+            "created_at": self._fs.SERVER_TIMESTAMP
+        }, merge=True)
+        # Maintain a usernames mapping for quick username->uid lookup
+        self.db.collection("usernames").document(username.lower()).set({
+            "uid": uid,
+            "username": username,
+            "email": email,
+            "created_at": self._fs.SERVER_TIMESTAMP
+        }, merge=True)
+        # Create default meta counts doc
+        self._counts_ref(uid, "counts").set({}, merge=True)
+        return True
+
+    def get_profile_by_username(self, username):
+        doc = self.db.collection("usernames").document(username.lower()).get()
+        return doc.to_dict() if doc.exists else None
+
+    def get_profile_by_uid(self, uid):
+        doc = self._user(uid).collection("meta").document("profile").get()
+        return doc.to_dict() if doc.exists else None
+
+    def get_user_flag(self, uid, name):
+        doc = self._flags_ref(uid).get()
+        return bool(doc.exists and (doc.to_dict() or {}).get(name))
+
+    def set_user_flag(self, uid, name):
+        self._flags_ref(uid).set({name: True}, merge=True)
+
+    # ---- counts ----
+    def increment_count(self, uid, scan_type, amount=1):
+        with self.counters.writing(uid):
+            self._counts_ref(uid).set({scan_type: self._fs.Increment(amount)}, merge=True)
+            self.counters.apply(uid, {scan_type: amount})
+
+    def get_counts(self, uid):
+        def fetch():
+            # every shard in one round trip
+            shards = self.db.get_all(self._count_shard_refs(uid))
+            return self.counters.total(s.to_dict() for s in shards if s.exists)
+        return self.counters.read(uid, fetch)
+
+    def reset_counts(self, uid):
+        batch = self.db.batch()
+        for ref in self._count_shard_refs(uid):
+            batch.set(ref, {})
+        with self.counters.writing(uid):
+            batch.commit()
+            self.counters.reset(uid)
+
+    def write_batch(self, scans, counts):
+        batch = self.db.batch()
+        ops = 0
+        committed = []  # count deltas in the current batch
+        writes = [("scan", uid, doc) for uid, doc in scans]
+        writes += [("counts", uid, by_type) for uid, by_type in counts.items()]
+        for kind, uid, payload in writes:
+            if kind == "scan":
+                doc = dict(payload, timestamp=self._fs.SERVER_TIMESTAMP)
+                batch.set(self._col(uid, "scans").document(), doc)
+            else:
+                increments = {t: self._fs.Increment(n) for t, n in payload.items()}
+                batch.set(self._counts_ref(uid), increments, merge=True)
+                committed.append((uid, payload))
+            ops += 1
+            if ops == self.BATCH_LIMIT:
+                self._commit_counted(batch, committed)
+                batch = self.db.batch()
+                ops = 0
+                committed = []
+        if ops:
+            self._commit_counted(batch, committed)
+
+    def _commit_counted(self, batch, deltas):
+        """Commit, then apply the batch's (uid, {type: n}) increments to cached counts."""
+        with self.counters.writing(*(uid for uid, _ in deltas)):
+            batch.commit()
+            for uid, delta in deltas:
+                self.counters.apply(uid, delta)
+
+    # ---- scans ----
+    def add_scan(self, uid, doc):
+        doc = dict(doc, timestamp=self._fs.SERVER_TIMESTAMP)
+        _, ref = self._col(uid, "scans").add(doc)
+        return ref.id
+
+    def scan_exists(self, uid, data):
+        q = self._col(uid, "scans").where("data", "==", data).limit(1).stream()
+        return any(q)
+
+    def iter_scans(self, uid, newest_first=True):
+        q = self._col(uid, "scans")
+        if newest_first:
+            q = q.order_by("timestamp", direction=self._fs.Query.DESCENDING)
+        for d in q.stream():
+            yield self._with_id(d)
+
+    def list_scans(self, uid, limit=50, cursor=None, scan_type=None):
+        q = self._col(uid, "scans")
+        if scan_type:
+            q = q.where("type", "==", scan_type)
+        q = (q.order_by("timestamp", direction=self._fs.Query.DESCENDING)
+             .order_by(self._fs.FieldPath.document_id(), direction=self._fs.Query.DESCENDING))
+        if cursor:
+            ts, doc_id = decode_cursor(cursor)
+            q = q.start_after({"timestamp": ts, "__name__": self._col(uid, "scans").document(doc_id)})
+        docs = [self._with_id(d) for d in q.limit(limit + 1).stream()]
+        return self._page(docs, limit)
+
+    def iter_scan_data(self, uid):
+        # field projection: only `data` comes over the wire
+        for d in self._col(uid, "scans").select(["data"]).stream():
+            yield d.get("data")
+
+    def clear_scans(self, uid):
+        self._commit_in_batches((d.reference for d in self._col(uid, "scans").stream()), "delete")
+
+    # ---- qr_generations / upload_attempts ----
+    def add_qr_generation(self, uid, doc):
+        doc = dict(doc, generated_at=self._fs.SERVER_TIMESTAMP)
+        _, ref = self._col(uid, "qr_generations").add(doc)
+        return ref.id
+
+    def add_qr_generations(self, uid, docs):
+        col = self._col(uid, "qr_generations")
+        refs = ((col.document(), dict(d, generated_at=self._fs.SERVER_TIMESTAMP)) for d in docs)
+        self._commit_in_batches(refs, "set")
+
+    def add_upload_attempt(self, uid, doc):
+        doc = dict(doc, uploaded_at=self._fs.SERVER_TIMESTAMP)
+        _, ref = self._col(uid, "upload_attempts").add(doc)
+        return ref.id
+
+    # ---- records ----
+    def find_record(self, uid, title):
+        docs = list(self._col(uid, "records").where("title", "==", title).limit(1).stream())
+        if not docs:
+            return None, None
+        return docs[0].id, self._with_id(docs[0])
+
+    def add_record(self, uid, doc):
+        doc = dict(doc)
+        doc.setdefault("created_at", self._fs.SERVER_TIMESTAMP)
+        doc.setdefault("updated_at", self._fs.SERVER_TIMESTAMP)
+        _, ref = self._col(uid, "records").add(doc)
+        return ref.id
+
+    def update_record(self, uid, record_id, fields, touch=True):
+        if touch:
+            fields = dict(fields, updated_at=self._fs.SERVER_TIMESTAMP)
+        self._col(uid, "records").document(record_id).update(fields)
+
+    def delete_record(self, uid, record_id):
+        scans_q = self._col(uid, "record_scans").where("record_id", "==", record_id).stream()
+        self._commit_in_batches((s.reference for s in scans_q), "delete")
+        self._col(uid, "records").document(record_id).delete()
+
+    def list_records(self, uid):
+        q = self._col(uid, "records").order_by("updated_at", direction=self._fs.Query.DESCENDING)
+        return [self._with_id(r) for r in q.stream()]
+
+    def update_records_in_folder(self, uid, folder_id, fields):
+        records_q = self._col(uid, "records").where("folder_id", "==", folder_id).stream()
+        self._commit_in_batches((r.reference for r in records_q), "update", fields)
+
+    def index_record_columns(self, uid, record_id, columns):
+        fields = {"columns_complete": True}
+        if columns:
+            fields["columns"] = self._fs.ArrayUnion(list(columns))
+        self._col(uid, "records").document(record_id).update(fields)
+
+    # ---- record_scans ----
+    def record_scan_exists(self, uid, record_id, data):
+        q = (self._col(uid, "record_scans")
+             .where("record_id", "==", record_id)
+             .where("data", "==", data)
+             .limit(1).stream())
+        return any(q)
+
+    def iter_record_scans(self, uid, record_id, ordered=False):
+        q = self._col(uid, "record_scans").where("record_id", "==", record_id)
+        if ordered:
+            q = q.order_by("scanned_at", direction=self._fs.Query.DESCENDING)
+        for d in q.stream():
+            yield self._with_id(d)
+
+    def count_record_scans(self, uid, record_id):
+        q = self._col(uid, "record_scans").where("record_id", "==", record_id)
+        if hasattr(q, "count"):
+            # aggregation query: one round trip, no documents transferred
+            return int(q.count().get()[0][0].value)
+        return sum(1 for _ in q.stream())
+
+    def new_record_id(self, uid):
+        return self._col(uid, "records").document().id
+
+    def _record_columns(self, record_fields, columns, new_record):
+        if new_record:
+            return dict(record_fields, columns=sorted(set(columns or ())), columns_complete=True)
+        if not columns:
+            return record_fields
+        return dict(record_fields, columns=self._fs.ArrayUnion(list(columns)))
+
+    def save_record_scan(self, uid, record_id, scan_doc, record_fields, new_record=False, columns=None):
+        from google.api_core.exceptions import Conflict, NotFound
+        scan_id = record_scan_id(record_id, scan_doc["data"])
+        record_ref = self._col(uid, "records").document(record_id)
+        record_fields = self._record_columns(record_fields, columns, new_record)
+        batch = self.db.batch()
+        # create() fails with ALREADY_EXISTS for a duplicate, which aborts the whole batch
+        batch.create(self._col(uid, "record_scans").document(scan_id),
+                     dict(scan_doc, scanned_at=self._fs.SERVER_TIMESTAMP))
+        if new_record:
+            batch.set(record_ref, dict(record_fields, scan_count=1,
+                                       created_at=self._fs.SERVER_TIMESTAMP,
+                                       updated_at=self._fs.SERVER_TIMESTAMP))
+        else:
+            batch.update(record_ref, dict(record_fields, scan_count=self._fs.Increment(1),
+                                          updated_at=self._fs.SERVER_TIMESTAMP))
+        batch.set(self._counts_ref(uid), {scan_doc["type"]: self._fs.Increment(1)}, merge=True)
+        with self.counters.writing(uid):
+            try:
+                batch.commit()
+            except Conflict:
+                return False
+            except NotFound as e:
+                raise NotFoundError(f"records/{record_id}") from e
+            self.counters.apply(uid, {scan_doc["type"]: 1})
+        return True
+
+    def save_record_scans(self, uid, record_id, scan_docs, record_fields, new_record=False, columns=None):
+        from google.api_core.exceptions import Conflict, NotFound
+        scans_col = self._col(uid, "record_scans")
+        refs = [scans_col.document(record_scan_id(record_id, d["data"])) for d in scan_docs]
+        # one get_all round trip instead of a failed create per duplicate
+        existing = set() if new_record else {s.id for s in self.db.get_all(refs) if s.exists}
+        results, counts = [], {}
+        batch = self.db.batch()
+        for ref, doc in zip(refs, scan_docs):
+            is_new = ref.id not in existing
+            results.append(is_new)
+            if is_new:
+                existing.add(ref.id)
+                batch.create(ref, dict(doc, scanned_at=self._fs.SERVER_TIMESTAMP))
+                counts[doc["type"]] = counts.get(doc["type"], 0) + 1
+        added = sum(results)
+        if not added:
+            return results
+        record_ref = self._col(uid, "records").document(record_id)
+        fields = self._record_columns(record_fields, columns, new_record)
+        if new_record:
+            batch.set(record_ref, dict(fields, scan_count=added,
+                                       created_at=self._fs.SERVER_TIMESTAMP,
+                                       updated_at=self._fs.SERVER_TIMESTAMP))
+        else:
+            batch.update(record_ref, dict(fields, scan_count=self._fs.Increment(added),
+                                          updated_at=self._fs.SERVER_TIMESTAMP))
+        batch.set(self._counts_ref(uid), {t: self._fs.Increment(n) for t, n in counts.items()}, merge=True)
+        with self.counters.writing(uid):
+            try:
+                batch.commit()
+            except Conflict:
+                # another writer saved one of them since get_all; settle it scan by scan
+                return super().save_record_scans(uid, record_id, scan_docs, record_fields, new_record, columns)
+            except NotFound as e:
+                raise NotFoundError(f"records/{record_id}") from e
+            self.counters.apply(uid, counts)
+        return results
+
+    # ---- folders ----
+    def get_folder(self, uid, folder_id):
+        doc = self._col(uid, "folders").document(folder_id).get()
+        return self._with_id(doc) if doc.exists else None
+
+    def folder_name_exists(self, uid, name):
+        return any(self._col(uid, "folders").where("name", "==", name).limit(1).stream())
+
+    def add_folder(self, uid, doc):
+        doc = dict(doc, created_at=self._fs.SERVER_TIMESTAMP)
+        _, ref = self._col(uid, "folders").add(doc)
+        return ref.id
+
+    def add_folders(self, uid, docs):
+        folders_col = self._col(uid, "folders")
+        batch = self.db.batch()
+        added = []
+        for doc in docs:
+            ref = folders_col.document()
+            batch.set(ref, dict(doc, created_at=self._fs.SERVER_TIMESTAMP))
+            added.append(dict(doc, id=ref.id))
+        batch.commit()
+        return added
+
+    def update_folder(self, uid, folder_id, fields):
+        self._col(uid, "folders").document(folder_id).update(fields)
+
+    def delete_folder(self, uid, folder_id):
+        self._col(uid, "folders").document(folder_id).delete()
+
+    def list_folders(self, uid):
+        return [self._with_id(f) for f in self._col(uid, "folders").stream()]
+
+
+# ---------------------------
+# SQLite
+# ---------------------------
+# Indexed columns per collection; the full document lives in `doc` as JSON.
+_SQLITE_COLUMNS = {
+    "scans": ("data", "type", "timestamp"),
+    "records": ("title", "folder_id", "updated_at"),
+    "record_scans": ("record_id", "data", "scanned_at"),
+    "folders": ("name",),
+    "qr_generations": ("generated_at",),
+    "upload_attempts": ("uploaded_at",),
+}
+
+_SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS profiles (
+    uid TEXT PRIMARY KEY,
+    username TEXT NOT NULL,
+    username_lower TEXT NOT NULL UNIQUE,
+    email TEXT,
+    created_at TEXT
+);
+CREATE TABLE IF NOT EXISTS counts (
+    uid TEXT NOT NULL,
+    type TEXT NOT NULL,
+    count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (uid, type)
+);
+CREATE TABLE IF NOT EXISTS scans (
+    id TEXT PRIMARY KEY, uid TEXT NOT NULL,
+    data TEXT, type TEXT, timestamp TEXT, doc TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_scans_uid_ts ON scans (uid, timestamp DESC);
+CREATE INDEX IF NOT EXISTS idx_scans_uid_data ON scans (uid, data);
+CREATE INDEX IF NOT EXISTS idx_scans_uid_type_ts ON scans (uid, type, timestamp DESC);
+CREATE TABLE IF NOT EXISTS records (
+    id TEXT PRIMARY KEY, uid TEXT NOT NULL,
+    title TEXT, folder_id TEXT, updated_at TEXT, doc TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_records_uid_title ON records (uid, title);
+CREATE INDEX IF NOT EXISTS idx_records_uid_folder ON records (uid, folder_id);
+CREATE INDEX IF NOT EXISTS idx_records_uid_updated ON records (uid, updated_at DESC);
+CREATE TABLE IF NOT EXISTS record_scans (
+    id TEXT PRIMARY KEY, uid TEXT NOT NULL,
+    record_id TEXT, data TEXT, scanned_at TEXT, doc TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_record_scans_rec_data ON record_scans (uid, record_id, data);
+CREATE INDEX IF NOT EXISTS idx_record_scans_rec_ts ON record_scans (uid, record_id, scanned_at DESC);
+CREATE TABLE IF NOT EXISTS folders (
+    id TEXT PRIMARY KEY, uid TEXT NOT NULL,
+    name TEXT, doc TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_folders_uid_name ON folders (uid, name);
+CREATE TABLE IF NOT EXISTS qr_generations (
+    id TEXT PRIMARY KEY, uid TEXT NOT NULL,
+    generated_at TEXT, doc TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_qr_generations_uid ON qr_generations (uid, generated_at DESC);
+CREATE TABLE IF NOT EXISTS upload_attempts (
+    id TEXT PRIMARY KEY, uid TEXT NOT NULL,
+    uploaded_at TEXT, doc TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_upload_attempts_uid ON upload_attempts (uid, uploaded_at DESC);
+CREATE TABLE IF NOT EXISTS user_flags (
+    uid TEXT NOT NULL,
+    name TEXT NOT NULL,
+    PRIMARY KEY (uid, name)
+);
+"""
+
+
+def _utcnow():
+    return datetime.now(timezone.utc)
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+
+def _db_value(value):
+    """Convert a document value into something SQLite can index."""
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if value is None or isinstance(value, (str, int, float)):
+        return value
+    return json.dumps(value, default=_json_default)
+
+
+def _load_doc(doc_id, raw):
+    d = json.loads(raw)
+    for key in TIMESTAMP_FIELDS:
+        if isinstance(d.get(key), str):
+            try:
+                d[key] = datetime.fromisoformat(d[key])
+            except ValueError:
+                pass
+    d["id"] = doc_id
+    return d
+
+
+class SQLiteStore(Store):
+    """Store backed by a local SQLite database (path or ":memory:")."""
+
+    name = "sqlite"
+
+    def __init__(self, path=":memory:"):
+        self.path = path
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        if path != ":memory:":
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SQLITE_SCHEMA)
+
+    # ---- generic helpers ----
+    def _execute(self, sql, params=()):
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def _insert(self, table, uid, doc, doc_id=None):
+        doc_id = doc_id or uuid.uuid4().hex
+        cols = _SQLITE_COLUMNS[table]
+        values = [doc_id, uid] + [_db_value(doc.get(c)) for c in cols]
+        values.append(json.dumps({k: v for k, v in doc.items() if k != "id"}, default=_json_default))
+        placeholders = ", ".join("?" * len(values))
+        self._execute(
+            f"INSERT INTO {table} (id, uid, {', '.join(cols)}, doc) VALUES ({placeholders})",
+            values,
+        )
+        return doc_id
+
+    def _update(self, table, uid, doc_id, fields, increments=None, unions=None):
+        with self._lock:
+            rows = self._execute(f"SELECT doc FROM {table} WHERE uid = ? AND id = ?", (uid, doc_id))
+            if not rows:
+                raise NotFoundError(f"{table}/{doc_id}")
+            doc = json.loads(rows[0][0])
+            doc.update(fields)
+            for field, n in (increments or {}).items():
+                doc[field] = (doc.get(field) or 0) + n
+            for field, values in (unions or {}).items():
+                doc[field] = sorted(set(doc.get(field) or []) | set(values))
+            cols = _SQLITE_COLUMNS[table]
+            assignments = ", ".join(f"{c} = ?" for c in cols)
+            values = [_db_value(doc.get(c)) for c in cols]
+            values += [json.dumps(doc, default=_json_default), uid, doc_id]
+            self._execute(f"UPDATE {table} SET {assignments}, doc = ? WHERE uid = ? AND id = ?", values)
+
+    def _select(self, table, uid, where=None, order_by=None, limit=None):
+        sql = f"SELECT id, doc FROM {table} WHERE uid = ?"
+        params = [uid]
+        for col, value in (where or {}).items():
+            if value is None:
+                sql += f" AND {col} IS NULL"
+            else:
+                sql += f" AND {col} = ?"
+                params.append(_db_value(value))
+        if order_by:
+            sql += f" ORDER BY {order_by}"
+        if limit:
+            sql += f" LIMIT {int(limit)}"
+        return [_load_doc(doc_id, raw) for doc_id, raw in self._execute(sql, params)]
+
+    def _exists(self, table, uid, where):
+        clauses = " AND ".join(f"{c} = ?" for c in where)
+        params = [uid] + [_db_value(v) for v in where.values()]
+        return bool(self._execute(f"SELECT 1 FROM {table} WHERE uid = ? AND {clauses} LIMIT 1", params))
+
+    # ---- users ----
+    def create_user_profile(self, uid, username, email):
+        self._execute(
+            "INSERT OR REPLACE INTO profiles (uid, username, username_lower, email, created_at) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (uid, username, username.lower(), email, _utcnow().isoformat()),
+        )
+        return True
+
+    def _profile(self, column, value):
+        rows = self._execute(
+            f"SELECT uid, username, email, created_at FROM profiles WHERE {column} = ?", (value,)
+        )
+        if not rows:
+            return None
+        uid, username, email, created_at = rows[0]
+        return {"uid": uid, "username": username, "email": email,
+                "created_at": datetime.fromisoformat(created_at) if created_at else None}
+
+    def get_profile_by_username(self, username):
+        return self._profile("username_lower", username.lower())
+
+    def get_profile_by_uid(self, uid):
+        return self._profile("uid", uid)
+
+    def get_user_flag(self, uid, name):
+        return bool(self._execute("SELECT 1 FROM user_flags WHERE uid = ? AND name = ?", (uid, name)))
+
+    def set_user_flag(self, uid, name):
+        self._execute("INSERT OR IGNORE INTO user_flags (uid, name) VALUES (?, ?)", (uid, name))
+
+    # ---- counts ----
+    def increment_count(self, uid, scan_type, amount=1):
+        self._execute(
+            "INSERT INTO counts (uid, type, count) VALUES (?, ?, ?) "
+            "ON CONFLICT (uid, type) DO UPDATE SET count = count + excluded.count",
+            (uid, scan_type, amount),
+        )
+
+    def get_counts(self, uid):
+        return dict(self._execute("SELECT type, count FROM counts WHERE uid = ?", (uid,)))
+
+    def reset_counts(self, uid):
+        self._execute("DELETE FROM counts WHERE uid = ?", (uid,))
+
+    def write_batch(self, scans, counts):
+        now = _utcnow()
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                # a microsecond apart, so pages and exports keep the order the scans were queued in
+                for i, (uid, doc) in enumerate(scans):
+                    self._insert("scans", uid, dict(doc, timestamp=now + timedelta(microseconds=i)))
+                for uid, by_type in counts.items():
+                    for scan_type, n in by_type.items():
+                        self.increment_count(uid, scan_type, n)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    # ---- scans ----
+    def add_scan(self, uid, doc):
+        return self._insert("scans", uid, dict(doc, timestamp=_utcnow()))
+
+    def scan_exists(self, uid, data):
+        return self._exists("scans", uid, {"data": data})
+
+    def iter_scans(self, uid, newest_first=True):
+        order = "timestamp DESC, rowid DESC" if newest_first else None
+        return iter(self._select("scans", uid, order_by=order))
+
+    def iter_scan_data(self, uid):
+        return (row[0] for row in self._execute("SELECT data FROM scans WHERE uid = ?", (uid,)))
+
+    def list_scans(self, uid, limit=50, cursor=None, scan_type=None):
+        sql = "SELECT id, doc FROM scans WHERE uid = ?"
+        params = [uid]
+        if scan_type:
+            sql += " AND type = ?"
+            params.append(scan_type)
+        if cursor:
+            ts, doc_id = decode_cursor(cursor)
+            ts = ts.isoformat()
+            sql += " AND (timestamp < ? OR (timestamp = ? AND id < ?))"
+            params += [ts, ts, doc_id]
+        sql += " ORDER BY timestamp DESC, id DESC LIMIT ?"
+        params.append(limit + 1)
+        docs = [_load_doc(doc_id, raw) for doc_id, raw in self._execute(sql, params)]
+        return self._page(docs, limit)
+
+    def clear_scans(self, uid):
+        self._execute("DELETE FROM scans WHERE uid = ?", (uid,))
+
+    # ---- qr_generations / upload_attempts ----
+    def add_qr_generation(self, uid, doc):
+        return self._insert("qr_generations", uid, dict(doc, generated_at=_utcnow()))
+
+    def add_qr_generations(self, uid, docs):
+        now = _utcnow()
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                for i, doc in enumerate(docs):
+                    self._insert("qr_generations", uid, dict(doc, generated_at=now + timedelta(microseconds=i)))
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def add_upload_attempt(self, uid, doc):
+        return self._insert("upload_attempts", uid, dict(doc, uploaded_at=_utcnow()))
+
+    # ---- records ----
+    def find_record(self, uid, title):
+        docs = self._select("records", uid, {"title": title}, limit=1)
+        if not docs:
+            return None, None
+        return docs[0]["id"], docs[0]
+
+    def add_record(self, uid, doc):
+        now = _utcnow()
+        doc = dict(doc)
+        doc.setdefault("created_at", now)
+        doc.setdefault("updated_at", now)
+        return self._insert("records", uid, doc)
+
+    def update_record(self, uid, record_id, fields, touch=True):
+        if touch:
+            fields = dict(fields, updated_at=_utcnow())
+        self._update("records", uid, record_id, fields)
+
+    def delete_record(self, uid, record_id):
+        with self._lock:
+            self._execute("DELETE FROM record_scans WHERE uid = ? AND record_id = ?", (uid, record_id))
+            self._execute("DELETE FROM records WHERE uid = ? AND id = ?", (uid, record_id))
+
+    def list_records(self, uid):
+        return self._select("records", uid, order_by="updated_at DESC")
+
+    def update_records_in_folder(self, uid, folder_id, fields):
+        with self._lock:
+            for rec in self._select("records", uid, {"folder_id": folder_id}):
+                self._update("records", uid, rec["id"], fields)
+
+    def index_record_columns(self, uid, record_id, columns):
+        self._update("records", uid, record_id, {"columns_complete": True}, unions={"columns": columns})
+
+    # ---- record_scans ----
+    def record_scan_exists(self, uid, record_id, data):
+        return self._exists("record_scans", uid, {"record_id": record_id, "data": data})
+
+    def iter_record_scans(self, uid, record_id, ordered=False):
+        order = "scanned_at DESC, rowid DESC" if ordered else "rowid"
+        return iter(self._select("record_scans", uid, {"record_id": record_id}, order_by=order))
+
+    def count_record_scans(self, uid, record_id):
+        rows = self._execute(
+            "SELECT COUNT(*) FROM record_scans WHERE uid = ? AND record_id = ?", (uid, record_id)
+        )
+        return rows[0][0]
+
+    def new_record_id(self, uid):
+        return uuid.uuid4().hex
+
+    def save_record_scan(self, uid, record_id, scan_doc, record_fields, new_record=False, columns=None):
+        return self.save_record_scans(uid, record_id, [scan_doc], record_fields, new_record, columns)[0]
+
+    def save_record_scans(self, uid, record_id, scan_docs, record_fields, new_record=False, columns=None):
+        now = _utcnow()
+        results, seen = [], set()
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                for doc in scan_docs:
+                    scan_id = record_scan_id(record_id, doc["data"])
+                    is_new = scan_id not in seen and not self._execute(
+                        "SELECT 1 FROM record_scans WHERE id = ?", (scan_id,))
+                    results.append(is_new)
+                    if is_new:
+                        seen.add(scan_id)
+                        self._insert("record_scans", uid, dict(doc, scanned_at=now), doc_id=scan_id)
+                        self.increment_count(uid, doc["type"])
+                added = sum(results)
+                if added and new_record:
+                    self._insert("records", uid, dict(record_fields, scan_count=added,
+                                                      columns=sorted(set(columns or ())),
+                                                      columns_complete=True,
+                                                      created_at=now, updated_at=now),
+                                 doc_id=record_id)
+                elif added:
+                    self._update("records", uid, record_id, dict(record_fields, updated_at=now),
+                                 increments={"scan_count": added},
+                                 unions={"columns": columns or ()})
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return results
+
+    # ---- folders ----
+    def get_folder(self, uid, folder_id):
+        docs = self._select("folders", uid, {"id": folder_id}, limit=1)
+        return docs[0] if docs else None
+
+    def folder_name_exists(self, uid, name):
+        return self._exists("folders", uid, {"name": name})
+
+    def add_folder(self, uid, doc):
+        return self._insert("folders", uid, dict(doc, created_at=_utcnow()))
+
+    def add_folders(self, uid, docs):
+        with self._lock:
+            return [dict(doc, id=self.add_folder(uid, doc)) for doc in docs]
+
+    def update_folder(self, uid, folder_id, fields):
+        self._update("folders", uid, folder_id, fields)
+
+    def delete_folder(self, uid, folder_id):
+        self._execute("DELETE FROM folders WHERE uid = ? AND id = ?", (uid, folder_id))
+
+    def list_folders(self, uid):
+        return self._select("folders", uid, order_by="rowid")
+
+
+# ---------------------------
+# Factory
+# ---------------------------
+def create_store(backend, firestore_client=None, sqlite_path="qr_project.db", **firestore_options):
+    """Build the configured store.
+
+    backend is "firestore", "sqlite" or "memory". firestore_client is a client
+    or a callable that creates one on first use; firestore_options go to
+    FirestoreStore. If Firestore was requested but no client is available,
+    fall back to SQLite.
+    """
+    backend = (backend or "firestore").lower()
+    if backend == "firestore":
+        if firestore_client is not None:
+            return FirestoreStore(firestore_client, **firestore_options)
+        print(f"⚠️ Firestore unavailable, falling back to SQLite store at '{sqlite_path}'")
+        return SQLiteStore(sqlite_path)
+    if backend == "memory":
+        return SQLiteStore(":memory:")
+    if backend == "sqlite":
+        return SQLiteStore(sqlite_path)
+    raise ValueError(f"Unknown STORAGE_BACKEND '{backend}'")
@@ -0,0 +1,203 @@
+# write_queue.py
+"""Write-behind queue for scan documents and scan-count increments.
+
+Scan routes enqueue their writes and return immediately; a background thread
+coalesces them (increments are summed per uid/type) and hands them to the
+store in batches of at most `max_batch` operations. A batch is flushed when it
+is full or when its oldest write is `max_age` seconds old, and the queue is
+drained on shutdown.
+
+Increments stay visible to pending_counts() until the batch holding them has
+been written, and `counts_guard(*uids)`, if given, is held for the uids of a
+batch from the moment its increments leave the queue until they are written
+(CountsMirror.writing, so a counts load racing the flush is not kept).
+"""
+import threading
+import time
+from collections import defaultdict
+from contextlib import ExitStack
+
+
+class WriteBehindQueue:
+    def __init__(self, store, max_batch=500, max_age=0.5, max_retries=3, counts_guard=None):
+        self.store = store
+        self.counts_guard = counts_guard
+        self.max_batch = max_batch
+        self.max_age = max_age
+        self.max_retries = max_retries
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()  # one batch in flight at a time
+        self._scans = []                                      # [(uid, doc)]
+        self._counts = defaultdict(lambda: defaultdict(int))  # uid -> type -> n
+        self._inflight_counts = {}                            # uid -> type -> n, being written
+        self._pending_data = defaultdict(int)                 # (uid, data) -> n
+        self._oldest = None
+        self._retries = 0
+        self._thread = None
+        self._stopping = False
+        self.flushed_ops = 0
+        self.failed_ops = 0
+
+    # ---- producers ----
+    def enqueue_scan(self, uid, doc):
+        with self._cond:
+            self._scans.append((uid, doc))
+            self._pending_data[(uid, doc.get("data"))] += 1
+            self._touch()
+
+    def enqueue_increment(self, uid, scan_type, amount=1):
+        with self._cond:
+            self._counts[uid][scan_type] += amount
+            self._touch()
+
+    def _touch(self):
+        if self._oldest is None:
+            self._oldest = time.monotonic()
+        if self._depth() >= self.max_batch:
+            self._cond.notify()
+
+    # ---- introspection ----
+    def _depth(self):
+        return len(self._scans) + len(self._counts)
+
+    def depth(self):
+        """Number of pending write operations (scan docs + counts docs)."""
+        with self._cond:
+            return self._depth()
+
+    def stats(self):
+        with self._cond:
+            return {
+                "depth": self._depth(),
+                "flushed_ops": self.flushed_ops,
+                "failed_ops": self.failed_ops,
+                "running": bool(self._thread and self._thread.is_alive()),
+            }
+
+    def has_pending_scan(self, uid, data):
+        with self._cond:
+            return self._pending_data.get((uid, data), 0) > 0
+
+    def pending_scan_data(self, uid):
+        """Payloads of uid's scans not written yet (until their batch has been committed)."""
+        with self._cond:
+            return [data for (u, data) in self._pending_data if u == uid]
+
+    def pending_counts(self, uid):
+        """uid's increments not written yet, including those of the batch being written."""
+        with self._cond:
+            counts = dict(self._counts.get(uid, {}))
+            for scan_type, n in self._inflight_counts.get(uid, {}).items():
+                counts[scan_type] = counts.get(scan_type, 0) + n
+            return counts
+
+    # ---- flushing ----
+    def _take(self):
+        """Detach up to max_batch pending ops."""
+        counts = {}
+        for uid in list(self._counts)[:self.max_batch]:
+            counts[uid] = dict(self._counts.pop(uid))
+        room = self.max_batch - len(counts)
+        scans, self._scans = self._scans[:room], self._scans[room:]
+        self._oldest = time.monotonic() if self._depth() else None
+        self._inflight_counts = counts
+        return scans, counts
+
+    def _restore(self, scans, counts):
+        self._scans[:0] = scans
+        for uid, by_type in counts.items():
+            for scan_type, n in by_type.items():
+                self._counts[uid][scan_type] += n
+        if self._oldest is None:
+            self._oldest = time.monotonic()
+
+    def _release(self, scans):
+        for uid, doc in scans:
+            key = (uid, doc.get("data"))
+            self._pending_data[key] -= 1
+            if self._pending_data[key] <= 0:
+                del self._pending_data[key]
+
+    def _flush_once(self):
+        """Commit one batch; returns False if it failed and was requeued."""
+        with self._flush_lock, ExitStack() as guard:
+            with self._cond:
+                if not self._depth():
+                    return True
+                scans, counts = self._take()
+                if self.counts_guard is not None and counts:
+                    guard.enter_context(self.counts_guard(*counts))
+            return self._commit(scans, counts)
+
+    def flush(self):
+        """Write everything that is pending right now (blocking)."""
+        while self.depth():
+            if not self._flush_once():
+                return
+        # wait for a batch the flusher thread may still have in flight
+        with self._flush_lock:
+            pass
+
+    def _commit(self, scans, counts):
+        ops = len(scans) + len(counts)
+        try:
+            self.store.write_batch(scans, counts)
+        except Exception as e:
+            with self._cond:
+                self._inflight_counts = {}
+                self._retries += 1
+                if self._retries <= self.max_retries:
+                    print(f"Warning: write-behind flush failed (attempt {self._retries}), retrying: {e}")
+                    self._restore(scans, counts)
+                    return False
+                print(f"❌ Write-behind flush failed, dropping {ops} ops: {e}")
+                self._retries = 0
+                self.failed_ops += ops
+                self._release(scans)
+            return True
+        with self._cond:
+            self._inflight_counts = {}
+            self._retries = 0
+            self.flushed_ops += ops
+            self._release(scans)
+        return True
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._stopping:
+                    if self._depth() >= self.max_batch:
+                        break
+                    if self._oldest is not None:
+                        wait = self.max_age - (time.monotonic() - self._oldest)
+                        if wait <= 0:
+                            break
+                    else:
+                        wait = None
+                    self._cond.wait(wait)
+                if self._stopping:
+                    return
+            if not self._flush_once():
+                # back off before retrying a failed batch
+                time.sleep(self.max_age)
+
+    # ---- lifecycle ----
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+            self._thread.start()
+        return self
+
+    def drain(self, timeout=10):
+        """Stop the flusher thread and write out everything still queued."""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        deadline = time.monotonic() + timeout
+        while self.depth() and time.monotonic() < deadline:
+            self.flush()
+        if self.depth():
+            print(f"❌ Write-behind drain timed out with {self.depth()} ops pending")